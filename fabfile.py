@@ -14,9 +14,12 @@ Usage:
     fab show-outdated
     fab freeze-deps
     fab update-and-freeze
+    fab loadtest --admin=admin:secret --user=jdoe:secret --save-baseline
+    fab loadtest --concurrency=16 --requests=2000 --threshold=0.1
 """
 
 import re
+import shlex
 import sys
 import tomllib
 from pathlib import Path
@@ -482,7 +485,7 @@ def freeze_deps(c: Connection) -> None:
 
     print("Generating requirements.txt...")
     try:
-        c.run("uv export --no-group dev --frozen --output-file=requirements.txt --quiet")
+        c.run("uv export --no-group dev --all-extras --frozen --output-file=requirements.txt --quiet")
         print("requirements.txt generated successfully")
     except Exception as e:
         print(f"Error generating requirements.txt: {str(e)}")
@@ -495,3 +498,44 @@ def update_and_freeze(c: Connection) -> None:
     """
     update_deps(c)
     freeze_deps(c)
+
+
+@task
+def loadtest(
+    c: Connection,
+    base_url: str = "http://127.0.0.1:8000",
+    admin: str = "",
+    user: str = "",
+    concurrency: int = 8,
+    requests: int = 500,
+    threshold: float = 0.2,
+    save_baseline: bool = False,
+    serve: bool = True,
+) -> None:
+    """
+    Load test a local server and compare it with the recorded baseline
+
+    Args:
+        base_url: Server to test, started with gunicorn when serve is set
+        admin: username:password of an admin, LOADTEST_ADMIN by default
+        user: username:password of a regular user, LOADTEST_USER by default
+        save_baseline: Record the results as the new baseline instead of comparing
+    """
+    command = [
+        "python src/benchmarks/loadtest.py",
+        f"--base-url={base_url}",
+        f"--concurrency={concurrency}",
+        f"--requests={requests}",
+        f"--threshold={threshold}",
+    ]
+    if admin:
+        command.append(f"--admin={shlex.quote(admin)}")
+    if user:
+        command.append(f"--user={shlex.quote(user)}")
+    if save_baseline:
+        command.append("--save-baseline")
+    if serve:
+        command.append("--serve")
+    result = c.run(" ".join(command), warn=True)
+    if result.failed:
+        sys.exit(result.exited)
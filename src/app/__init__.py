@@ -1,63 +1,109 @@
 # app/__init__.py
 
 # imports
-import logging
-import os
-from logging.handlers import RotatingFileHandler
-
+import click
 from flask import Flask
 from flask import abort
 from flask import render_template
 from flask_bootstrap import Bootstrap
 from flask_login import LoginManager
-from flask_migrate import Migrate
 from flask_sqlalchemy import SQLAlchemy
 
 # local import
+from app import database
+from app import instrumentation
+from app import log
+from app import metrics
+from app import startup
 from config import app_config
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": database.RoutingSession})
 login_manager = LoginManager()
 
 
 def create_app(config_name):
-    app = Flask(__name__, instance_relative_config=True)
-    app.config.from_object(app_config[config_name])
-    app.config.from_pyfile("config.py")
-    Bootstrap(app)
-    db.init_app(app)
-    login_manager.init_app(app)
-    login_manager.login_message = "You must be logged in to access this page!"
-    login_manager.login_view = "auth.login"
-
-    if not os.path.exists("log"):
-        os.mkdir("log")
-
-    file_handler = RotatingFileHandler("log/microblog.log", maxBytes=10240, backupCount=10)
-    file_handler.setFormatter(
-        logging.Formatter("%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]")
-    )
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
-
-    app.logger.setLevel(logging.INFO)
+    profile = startup.StartupProfile(startup.enabled())
+
+    with profile.step("config"):
+        app = Flask(__name__, instance_relative_config=True)
+        app.extensions["startup_profile"] = profile
+        app.config.from_object(app_config[config_name])
+        app.config.from_pyfile("config.py")
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = database.engine_options(app.config)
+        app.config["SQLALCHEMY_BINDS"] = dict(
+            database.replica_binds(app.config), **(app.config.get("SQLALCHEMY_BINDS") or {})
+        )
+
+    with profile.step("extensions"):
+        Bootstrap(app)
+        db.init_app(app)
+        login_manager.init_app(app)
+        login_manager.login_message = "You must be logged in to access this page!"
+        login_manager.login_view = "auth.login"
+
+    with profile.step("logging and metrics"):
+        log.init_app(app)
+        instrumentation.init_app(app)
+        metrics.init_app(app)
+
     app.logger.info("Microblog startup")
 
-    migrate = Migrate(app, db)
+    # only `flask db` needs Flask-Migrate, and importing alembic is slow
+    if click.get_current_context(silent=True) is not None:
+        with profile.step("migrate"):
+            from flask_migrate import Migrate
+
+            Migrate(app, db)
+
+    with profile.step("models and caches"):
+        from app import models
+
+        models.principals.init_app(app, "PRINCIPAL_CACHE")
+        models.hasher.init_app(app)
+
+        from app.refdata import refdata
+
+        refdata.init_app(app)
+
+        from app.uniqueness import uniqueness
+
+        uniqueness.init_app(app)
+
+        from app import stats
+
+        stats.summaries.init_app(app, "STATS_CACHE")
+
+        from app.fragments import fragments
+
+        fragments.init_app(app)
+
+        from app.assets import assets
+
+        assets.init_app(app)
+
+    with profile.step("commands"):
+        from app import commands
+
+        commands.init_app(app)
+
+    with profile.step("blueprints"):
+        from .admin import admin as admin_blueprint
 
-    from app import models
+        app.register_blueprint(admin_blueprint, url_prefix="/admin")
 
-    from .admin import admin as admin_blueprint
+        from .auth import auth as auth_blueprint
 
-    app.register_blueprint(admin_blueprint, url_prefix="/admin")
+        app.register_blueprint(auth_blueprint)
 
-    from .auth import auth as auth_blueprint
+        from .home import home as home_blueprint
 
-    app.register_blueprint(auth_blueprint)
+        app.register_blueprint(home_blueprint)
 
-    from .home import home as home_blueprint
+        from .api import api as api_blueprint
 
-    app.register_blueprint(home_blueprint)
+        app.register_blueprint(api_blueprint, url_prefix="/api/v1")
+        # answer unauthenticated API calls with 401 instead of the login page
+        login_manager.blueprint_login_views["api"] = None
 
     @app.errorhandler(403)
     def forbidden(error):
@@ -75,4 +121,5 @@ def create_app(config_name):
     def error():
         abort(500)
 
+    profile.report(app.logger)
     return app
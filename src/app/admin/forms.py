@@ -1,16 +1,20 @@
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileAllowed
+from flask_wtf.file import FileField
+from flask_wtf.file import FileRequired
 from wtforms import PasswordField
+from wtforms import SelectField
 from wtforms import StringField
 from wtforms import SubmitField
 from wtforms import ValidationError
 from wtforms.validators import DataRequired
 from wtforms.validators import Email
 from wtforms.validators import EqualTo
-from wtforms_sqlalchemy.fields import QuerySelectField
 
 from ..models import Department
-from ..models import Employee
 from ..models import Role
+from ..refdata import refdata
+from ..uniqueness import uniqueness
 
 
 class DepartmentForm(FlaskForm):
@@ -29,14 +33,103 @@ class RoleForm(FlaskForm):
     submit = SubmitField("Submit")
 
 
+class ReferenceSelectField(SelectField):
+    """Select field of department or role ids served from the refdata cache
+
+    With a blank label, 0 is offered first and selects no row.
+    """
+
+    def __init__(self, label=None, validators=None, model=None, blank=None, **kwargs):
+        super(ReferenceSelectField, self).__init__(
+            label,
+            validators,
+            coerce=int,
+            choices=lambda: ([(0, blank)] if blank else []) + refdata.choices(model),
+            **kwargs,
+        )
+        self.model = model
+        self.blank = blank
+
+    def pre_validate(self, form):
+        if self.blank and self.data == 0:
+            return
+        if self.data is None or not refdata.contains(self.model, self.data):
+            raise ValidationError(self.gettext("Not a valid choice."))
+
+
+class DepartmentDeleteForm(FlaskForm):
+    """Department deletion form, optionally moving its employees"""
+
+    reassign_to = ReferenceSelectField(
+        "Move its employees to", model=Department, blank="Nobody, leave them unassigned"
+    )
+    submit = SubmitField("Delete")
+
+
+class RoleDeleteForm(FlaskForm):
+    """Role deletion form, optionally moving its employees"""
+
+    reassign_to = ReferenceSelectField(
+        "Move its employees to", model=Role, blank="Nobody, leave them unassigned"
+    )
+    submit = SubmitField("Delete")
+
+
 class EmployeeAssignForm(FlaskForm):
     """Departments and roles allocation form to employees"""
 
-    department = QuerySelectField(query_factory=lambda: Department.query.all(), get_label="name")
-    role = QuerySelectField(query_factory=lambda: Role.query.all(), get_label="name")
+    department_id = ReferenceSelectField("Department", model=Department)
+    role_id = ReferenceSelectField("Role", model=Role)
     submit = SubmitField("Submit")
 
 
+class BulkAssignForm(FlaskForm):
+    """Department and role allocation form to many employees at once"""
+
+    employee_ids = StringField(
+        "Employee ids",
+        description="Separated by commas or spaces, leave empty to select by department and role.",
+    )
+    from_department_id = ReferenceSelectField(
+        "Current department", model=Department, blank="Any department"
+    )
+    from_role_id = ReferenceSelectField("Current role", model=Role, blank="Any role")
+    department_id = ReferenceSelectField("New department", model=Department, blank="Unchanged")
+    role_id = ReferenceSelectField("New role", model=Role, blank="Unchanged")
+    submit = SubmitField("Assign")
+
+    def selected_ids(self):
+        """Return the entered employee ids"""
+        return [int(value) for value in (self.employee_ids.data or "").replace(",", " ").split()]
+
+    def validate_employee_ids(self, field):
+        try:
+            self.selected_ids()
+        except ValueError:
+            raise ValidationError("Employee ids must be numbers.")
+
+    def validate(self, extra_validators=None):
+        if not super(BulkAssignForm, self).validate(extra_validators):
+            return False
+        if not (self.selected_ids() or self.from_department_id.data or self.from_role_id.data):
+            self.employee_ids.errors.append("Select employees by id, department or role.")
+            return False
+        if not (self.department_id.data or self.role_id.data):
+            self.department_id.errors.append("Choose a new department or role.")
+            return False
+        return True
+
+
+class EmployeeImportForm(FlaskForm):
+    """Bulk employee upload form"""
+
+    file = FileField(
+        "CSV or NDJSON file",
+        validators=[FileRequired(), FileAllowed(["csv", "ndjson", "jsonl"], "CSV or NDJSON only")],
+    )
+    submit = SubmitField("Import")
+
+
 class RegistrationForm(FlaskForm):
     """New account creation form"""
 
@@ -54,10 +147,18 @@ class RegistrationForm(FlaskForm):
     confirm_password = PasswordField("Confirm Password")
     submit = SubmitField("Register")
 
+    _taken = None
+
+    def taken(self):
+        """Look up the username and email in a single round trip"""
+        if self._taken is None:
+            self._taken = uniqueness.taken(self.username.data, self.email.data)
+        return self._taken
+
     def validate_email(self, field):
-        if Employee.query.filter_by(email=field.data).first():
+        if "email" in self.taken():
             raise ValidationError("Email is already in use.")
 
     def validate_username(self, field):
-        if Employee.query.filter_by(username=field.data).first():
+        if "username" in self.taken():
             raise ValidationError("Username is already in use.")
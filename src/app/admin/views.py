@@ -1,39 +1,82 @@
+import io
+import os
+import uuid
+
+from flask import Response
 from flask import abort
+from flask import current_app
 from flask import flash
+from flask import jsonify
 from flask import redirect
 from flask import render_template
+from flask import request
+from flask import stream_with_context
 from flask import url_for
 from flask_login import current_user
 from flask_login import login_required
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
 
+from .. import assignments
+from .. import database
 from .. import db
+from .. import exporter
+from .. import importer
+from .. import search
+from ..jobs import jobs
 from ..models import Department
 from ..models import Employee
 from ..models import Role
+from ..models import principals
+from ..pagination import InvalidCursor
+from ..pagination import keyset_paginate
 from . import admin
+from .forms import BulkAssignForm
+from .forms import DepartmentDeleteForm
 from .forms import DepartmentForm
 from .forms import EmployeeAssignForm
+from .forms import EmployeeImportForm
 from .forms import RegistrationForm
+from .forms import RoleDeleteForm
 from .forms import RoleForm
 
 
+def delete_group(instance, form):
+    """Delete a department or role, moving its employees if form says so"""
+    if request.method == "POST" and not form.validate():
+        abort(400)
+    try:
+        moved = assignments.delete_group(instance, reassign_to=form.reassign_to.data or None)
+    except ValueError:
+        abort(400)
+    db.session.commit()
+    return moved
+
+
 def check_admin():
     """Prevent non-admins from accessing the page"""
     if not current_user.is_admin:
         abort(403)
 
 
+def get_per_page(default_key):
+    """Read the requested page size, clamped to the configured maximum"""
+    default = current_app.config[default_key]
+    per_page = request.args.get("per_page", default, type=int)
+    return max(1, min(per_page, current_app.config["MAX_PER_PAGE"]))
+
+
 # Department views
 @admin.route("/departments", methods=["GET", "POST"])
 @login_required
+@database.read_only
 def list_departments():
     """List all departments"""
     check_admin()
-    departments = Department.query.all()
-
+    # called by the template only when its cached fragment is stale
     return render_template(
         "admin/departments/departments.html",
-        departments=departments,
+        departments=Department.with_headcount,
         title="Departments",
     )
 
@@ -95,6 +138,7 @@ def edit_department(id):
         action="Edit",
         add_department=add_department,
         form=form,
+        delete_form=DepartmentDeleteForm(),
         department=department,
         title="Edit Department",
     )
@@ -107,9 +151,10 @@ def delete_department(id):
     check_admin()
 
     department = Department.query.get_or_404(id)
-    db.session.delete(department)
-    db.session.commit()
+    moved = delete_group(department, DepartmentDeleteForm())
     flash("You have successfully deleted the department.")
+    if moved:
+        flash("{0} employees were moved to another department.".format(moved))
 
     # redirect to the departments page
     return redirect(url_for("admin.list_departments"))
@@ -120,11 +165,11 @@ def delete_department(id):
 # Role Views
 @admin.route("/roles")
 @login_required
+@database.read_only
 def list_roles():
     """List all roles"""
     check_admin()
-    roles = Role.query.all()
-    return render_template("admin/roles/roles.html", roles=roles, title="Roles")
+    return render_template("admin/roles/roles.html", roles=Role.with_headcount, title="Roles")
 
 
 @admin.route("/roles/add", methods=["GET", "POST"])
@@ -174,7 +219,14 @@ def edit_role(id):
 
     form.description.data = role.description
     form.name.data = role.name
-    return render_template("admin/roles/role.html", add_role=add_role, form=form, title="Edit Role")
+    return render_template(
+        "admin/roles/role.html",
+        add_role=add_role,
+        form=form,
+        delete_form=RoleDeleteForm(),
+        role=role,
+        title="Edit Role",
+    )
 
 
 @admin.route("/roles/delete/<int:id>", methods=["GET", "POST"])
@@ -184,9 +236,10 @@ def delete_role(id):
     check_admin()
 
     role = Role.query.get_or_404(id)
-    db.session.delete(role)
-    db.session.commit()
+    moved = delete_group(role, RoleDeleteForm())
     flash("You have successfully deleted the role.")
+    if moved:
+        flash("{0} employees were moved to another role.".format(moved))
 
     # redirect to the roles page
     return redirect(url_for("admin.list_roles"))
@@ -195,14 +248,103 @@ def delete_role(id):
 
 
 # Employees view
+
+# sortable columns of the employees listing, all of them indexed
+EMPLOYEE_SORT_COLUMNS = {
+    "id": Employee.id,
+    "last_name": Employee.last_name,
+    "first_name": Employee.first_name,
+    "username": Employee.username,
+    "email": Employee.email,
+}
+
+
 @admin.route("/employees")
 @login_required
+@database.read_only
 def list_employees():
     """List all employees"""
     check_admin()
 
-    employees = Employee.query.all()
-    return render_template("admin/employees/employees.html", employees=employees, title="Employees")
+    sort = request.args.get("sort", "last_name")
+    if sort not in EMPLOYEE_SORT_COLUMNS:
+        abort(400)
+    descending = request.args.get("order", "asc") == "desc"
+    per_page = get_per_page("EMPLOYEES_PER_PAGE")
+
+    # departments and roles come in with the same query instead of being
+    # lazy loaded for every row of the table
+    query = Employee.query.options(joinedload(Employee.department), joinedload(Employee.role))
+    try:
+        page = keyset_paginate(
+            query,
+            EMPLOYEE_SORT_COLUMNS[sort],
+            Employee.id,
+            per_page,
+            after=request.args.get("after"),
+            before=request.args.get("before"),
+            descending=descending,
+        )
+    except InvalidCursor:
+        abort(400)
+
+    return render_template(
+        "admin/employees/employees.html",
+        employees=page.items,
+        page=page,
+        sort=sort,
+        order="desc" if descending else "asc",
+        per_page=per_page,
+        sort_columns=EMPLOYEE_SORT_COLUMNS,
+        title="Employees",
+    )
+
+
+@admin.route("/employees/search")
+@login_required
+@database.read_only
+def search_employees():
+    """Search employees by name, username or email"""
+    check_admin()
+    term = request.args.get("q", "")
+    employees = search.search_employees(
+        term,
+        limit=current_app.config["SEARCH_RESULTS"],
+        options=(joinedload(Employee.department), joinedload(Employee.role)),
+    )
+    return render_template(
+        "admin/employees/search.html",
+        employees=employees,
+        q=term,
+        title="Search Employees",
+    )
+
+
+@admin.route("/employees/autocomplete")
+@login_required
+@database.read_only
+def autocomplete_employees():
+    """Suggest employees whose name, username or email match q"""
+    check_admin()
+    employees = search.search_employees(
+        request.args.get("q", ""), limit=current_app.config["AUTOCOMPLETE_RESULTS"]
+    )
+    response = jsonify(
+        [
+            {
+                "id": employee.id,
+                "username": employee.username,
+                "name": " ".join(filter(None, (employee.first_name, employee.last_name))),
+                "email": employee.email,
+                "url": url_for("admin.assign_employee", id=employee.id),
+            }
+            for employee in employees
+        ]
+    )
+    # browsers repeat the same prefixes while typing and deleting
+    response.cache_control.private = True
+    response.cache_control.max_age = 30
+    return response
 
 
 @admin.route("/employees/assign/<int:id>", methods=["GET", "POST"])
@@ -218,8 +360,8 @@ def assign_employee(id):
 
     form = EmployeeAssignForm(obj=employee)
     if form.validate_on_submit():
-        employee.department = form.department.data
-        employee.role = form.role.data
+        employee.department_id = form.department_id.data
+        employee.role_id = form.role_id.data
         db.session.add(employee)
         db.session.commit()
         flash("You have successfully assigned a department and role.")
@@ -235,6 +377,105 @@ def assign_employee(id):
     )
 
 
+@admin.route("/employees/assign", methods=["GET", "POST"])
+@login_required
+def bulk_assign_employees():
+    """Assign a department and/or a role to many employees at once"""
+    check_admin()
+
+    form = BulkAssignForm()
+    if form.validate_on_submit():
+        values = {
+            name: getattr(form, name).data
+            for name in assignments.FIELDS
+            if getattr(form, name).data
+        }
+        ids = form.selected_ids() or None
+        where = {
+            name: getattr(form, "from_" + name).data
+            for name in assignments.FIELDS
+            if getattr(form, "from_" + name).data
+        }
+        try:
+            result = assignments.assign_employees(values, ids=ids, where=where)
+        except assignments.AdminAssignmentError:
+            db.session.rollback()
+            abort(403)
+        db.session.commit()
+        flash("Assigned {0} of {1} selected employees.".format(result.updated, result.matched))
+        return redirect(url_for("admin.list_employees"))
+
+    return render_template("admin/employees/bulk_assign.html", form=form, title="Assign Employees")
+
+
+@admin.route("/employees/import", methods=["GET", "POST"])
+@login_required
+def import_employees():
+    """Create employees in bulk from an uploaded CSV or NDJSON file"""
+    check_admin()
+
+    form = EmployeeImportForm()
+    result = job = None
+    errors = importer.ErrorSample()
+    if form.validate_on_submit():
+        upload = form.file.data
+        fmt = importer.guess_format(upload.filename)
+        size = upload.stream.seek(0, os.SEEK_END)
+        upload.stream.seek(0)
+        if size > current_app.config["IMPORT_INLINE_MAX_BYTES"]:
+            # large files are imported by a worker, see app/jobs.py
+            name = "import-{0}.{1}".format(uuid.uuid4().hex, fmt)
+            upload.save(os.path.join(jobs.files_dir(), name))
+            job = jobs.enqueue("import_employees", path=name, fmt=fmt)
+            db.session.commit()
+            flash("The file is imported in the background as job {0}.".format(job.id))
+        else:
+            # werkzeug spools large uploads to disk, read them as a text stream
+            stream = io.TextIOWrapper(
+                upload.stream, encoding="utf-8", errors="surrogateescape", newline=""
+            )
+            try:
+                result = importer.import_employees(stream, fmt, errors=errors)
+            except importer.ImportFileError as exp:
+                result = exp.result
+                flash(
+                    "The import stopped, the file cannot be read. {0}. {1} employees "
+                    "were imported before.".format(exp, result.inserted if result else 0)
+                )
+            else:
+                flash(
+                    "Imported {0} of {1} employees, {2} rows rejected.".format(
+                        result.inserted, result.read, result.errors
+                    )
+                )
+
+    return render_template(
+        "admin/employees/import.html",
+        form=form,
+        result=result,
+        errors=errors,
+        job=job,
+        title="Import Employees",
+    )
+
+
+@admin.route("/export/<entity>.<fmt>")
+@login_required
+@database.statement_timeout(0)
+def export(entity, fmt):
+    """Stream employees, departments or roles as a CSV or NDJSON download"""
+    check_admin()
+    if entity not in exporter.QUERIES or fmt not in exporter.FORMATS:
+        abort(404)
+
+    rows = exporter.stream_rows(entity, fmt)
+    return Response(
+        stream_with_context(rows),
+        mimetype=exporter.MIMETYPES[fmt],
+        headers={"Content-Disposition": "attachment; filename={0}.{1}".format(entity, fmt)},
+    )
+
+
 @admin.route("/register", methods=["GET", "POST"])
 @login_required
 def register():
@@ -249,7 +490,21 @@ def register():
             password=form.password.data,
         )
         db.session.add(employee)
-        db.session.commit()
-        flash("You have succesfully registred")
-        return redirect(url_for("home.admin_dashboard"))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # registered concurrently, past what the form could check
+            db.session.rollback()
+            flash("Error: email or username is already in use.")
+        else:
+            flash("You have succesfully registred")
+            return redirect(url_for("home.admin_dashboard"))
     return render_template("admin/register.html", form=form, title="Register")
+
+
+@admin.route("/diagnostics")
+@login_required
+def diagnostics():
+    """Report the cache counters of the worker serving the request"""
+    check_admin()
+    return jsonify(principal_cache=principals.stats(), db_pool=database.pool_stats(db.engine))
@@ -0,0 +1,289 @@
+import hashlib
+
+from flask import abort
+from flask import current_app
+from flask import jsonify
+from flask import request
+from flask import url_for
+from flask_login import current_user
+from flask_login import login_required
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
+
+from .. import assignments
+from .. import database
+from .. import db
+from ..http import conditional
+from ..models import Department
+from ..models import Employee
+from ..models import Job
+from ..models import Role
+from ..pagination import InvalidCursor
+from ..pagination import keyset_paginate
+from . import api
+
+# model, writable fields with their type and maximum length, and the
+# fields required on creation of every resource
+RESOURCES = {
+    "departments": (Department, {"name": (str, 60), "description": (str, 200)}, ("name",)),
+    "roles": (Role, {"name": (str, 60), "description": (str, 200)}, ("name",)),
+    "employees": (
+        Employee,
+        {
+            "email": (str, 60),
+            "username": (str, 60),
+            "first_name": (str, 60),
+            "last_name": (str, 60),
+            "password": (str, None),
+            "department_id": (int, None),
+            "role_id": (int, None),
+        },
+        ("email", "username", "password"),
+    ),
+}
+
+REFERENCES = {"department_id": Department, "role_id": Role}
+
+# fields never returned, so a PUT may leave them out to keep them unchanged
+WRITE_ONLY = ("password",)
+
+
+def json_error(error):
+    """Answer errors of the API in JSON instead of HTML pages"""
+    return jsonify(error=error.name, message=error.description), error.code
+
+
+# registered per code so they win over the HTML handlers of the app
+for code in (400, 401, 403, 404, 405, 409, 412, 500):
+    api.register_error_handler(code, json_error)
+
+
+@api.before_request
+@login_required
+def check_admin():
+    """Only admins may use the API"""
+    if not current_user.is_admin:
+        abort(403)
+
+
+def get_resource(resource):
+    if resource not in RESOURCES:
+        abort(404)
+    return RESOURCES[resource]
+
+
+def check_if_match(instance):
+    """Refuse writes based on an outdated version of instance"""
+    if request.if_match and not request.if_match.contains_weak(instance.etag):
+        abort(412, "The resource was modified, fetch it again.")
+
+
+def parse_body(fields, required, partial=False, replace=False):
+    """Validate the JSON body against the writable fields of a resource
+
+    Required fields must be present unless partial is set, and can never
+    be null. With replace every field but the write-only ones must be
+    present, as the body is the whole new representation.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        abort(400, "Expected a JSON object.")
+
+    values = {}
+    for name, value in data.items():
+        if name not in fields:
+            abort(400, "Unknown field: {0}".format(name))
+        kind, length = fields[name]
+        if value is None and name in required:
+            abort(400, "{0} cannot be null".format(name))
+        if value is not None and (not isinstance(value, kind) or isinstance(value, bool)):
+            abort(400, "{0} must be a {1}".format(name, kind.__name__))
+        if length is not None and value is not None and len(value) > length:
+            abort(400, "{0} is longer than {1} characters".format(name, length))
+        if name in REFERENCES and value is not None:
+            if db.session.get(REFERENCES[name], value) is None:
+                abort(400, "{0} {1} does not exist".format(name, value))
+        values[name] = value
+
+    if replace:
+        missing = [
+            name
+            for name in fields
+            if name not in WRITE_ONLY
+            and (name not in values or (name in required and not values[name]))
+        ]
+    else:
+        missing = [name for name in required if not values.get(name)]
+    if missing and not partial:
+        abort(400, "Missing fields: {0}".format(", ".join(missing)))
+    return values
+
+
+def save(instance, status=200):
+    """Commit instance and answer with its new representation"""
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        abort(409, "A unique value is already in use.")
+    except StaleDataError:
+        db.session.rollback()
+        abort(412, "The resource was modified concurrently, fetch it again.")
+    response = jsonify(instance.to_dict())
+    response.status_code = status
+    response.set_etag(instance.etag, weak=True)
+    response.last_modified = instance.updated_at
+    return response
+
+
+@api.route("/<resource>")
+@database.read_only
+def list_resource(resource):
+    """List a resource ordered by id, one page at a time"""
+    model = get_resource(resource)[0]
+    per_page = max(
+        1,
+        min(
+            request.args.get("per_page", current_app.config["API_PER_PAGE"], type=int),
+            current_app.config["MAX_PER_PAGE"],
+        ),
+    )
+    try:
+        page = keyset_paginate(
+            model.query, model.id, model.id, per_page, after=request.args.get("after")
+        )
+    except InvalidCursor:
+        abort(400, "Invalid cursor.")
+
+    # the page changes whenever one of its rows, or the set of rows, does
+    digest = hashlib.sha1(
+        ",".join("{0}:{1}".format(item.id, item.version) for item in page).encode("ascii")
+    )
+    digest.update(b"+" if page.has_next else b".")
+    last_modified = max((item.updated_at for item in page if item.updated_at), default=None)
+
+    next_url = None
+    if page.has_next:
+        next_url = url_for(
+            "api.list_resource", resource=resource, per_page=per_page, after=page.next_cursor
+        )
+    payload = {"items": [item.to_dict() for item in page], "next": next_url}
+    response = conditional(payload, "{0}-{1}".format(resource, digest.hexdigest()), last_modified)
+    if next_url:
+        response.headers["Link"] = '<{0}>; rel="next"'.format(next_url)
+    return response
+
+
+@api.route("/<resource>", methods=["POST"])
+def create_resource(resource):
+    """Create a department, role or employee"""
+    model, fields, required = get_resource(resource)
+    instance = model(**parse_body(fields, required))
+    db.session.add(instance)
+    response = save(instance, status=201)
+    response.headers["Location"] = url_for(
+        "api.get_resource_item", resource=resource, id=instance.id
+    )
+    return response
+
+
+def is_id(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+@api.route("/employees/assign", methods=["POST"])
+def assign_employees():
+    """Assign a department and/or a role to many employees at once
+
+    The body holds the new department_id and/or role_id, null to
+    unassign, and selects the employees either by ids or by filter, their
+    current department_id and/or role_id. Answers how many employees were
+    selected and how many changed.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        abort(400, "Expected a JSON object.")
+    unknown = sorted(data.keys() - {"ids", "filter"} - REFERENCES.keys())
+    if unknown:
+        abort(400, "Unknown fields: {0}".format(", ".join(unknown)))
+
+    values = {name: data[name] for name in REFERENCES if name in data}
+    if not values:
+        abort(400, "Missing fields: department_id or role_id")
+    for name, value in values.items():
+        if value is not None and not is_id(value):
+            abort(400, "{0} must be an int".format(name))
+        if value is not None and db.session.get(REFERENCES[name], value) is None:
+            abort(400, "{0} {1} does not exist".format(name, value))
+
+    ids, where = data.get("ids"), data.get("filter")
+    if (ids is None) == (where is None):
+        abort(400, "Select employees with either ids or filter.")
+    if ids is not None and not (isinstance(ids, list) and all(is_id(value) for value in ids)):
+        abort(400, "ids must be a list of ints")
+    if where is not None and not (
+        isinstance(where, dict)
+        and where
+        and where.keys() <= REFERENCES.keys()
+        and all(value is None or is_id(value) for value in where.values())
+    ):
+        abort(400, "filter must map department_id and/or role_id to an int or null")
+
+    try:
+        result = assignments.assign_employees(values, ids=ids, where=where)
+    except assignments.AdminAssignmentError as exp:
+        db.session.rollback()
+        abort(403, str(exp))
+    db.session.commit()
+    return jsonify(result.to_dict())
+
+
+@api.route("/jobs/<int:id>")
+def get_job(id):
+    """Return the status and, once done, the result of a background job"""
+    job = db.session.get(Job, id) or abort(404)
+    response = jsonify(job.to_dict())
+    response.cache_control.no_store = True
+    return response
+
+
+@api.route("/<resource>/<int:id>")
+def get_resource_item(resource, id):
+    """Return one department, role or employee"""
+    model = get_resource(resource)[0]
+    instance = db.session.get(model, id) or abort(404)
+    return conditional(instance.to_dict(), instance.etag, instance.updated_at)
+
+
+@api.route("/<resource>/<int:id>", methods=["PUT", "PATCH"])
+def update_resource(resource, id):
+    """Replace (PUT) or update some fields (PATCH) of a department, role or employee"""
+    model, fields, required = get_resource(resource)
+    instance = db.session.get(model, id) or abort(404)
+    check_if_match(instance)
+
+    if request.method == "PUT":
+        values = parse_body(fields, required, replace=True)
+    else:
+        values = parse_body(fields, required, partial=True)
+    # admins cannot be assigned a department or role, as in assign_employee
+    if model is Employee and instance.is_admin and values.keys() & REFERENCES.keys():
+        abort(403, "Admins cannot be assigned a department or role.")
+    for name, value in values.items():
+        setattr(instance, name, value)
+    return save(instance)
+
+
+@api.route("/<resource>/<int:id>", methods=["DELETE"])
+def delete_resource(resource, id):
+    """Delete a department, role or employee"""
+    model = get_resource(resource)[0]
+    instance = db.session.get(model, id) or abort(404)
+    check_if_match(instance)
+    if model is Employee:
+        db.session.delete(instance)
+    else:
+        # unassigns the employees and bumps their version, as the admin views do
+        assignments.delete_group(instance)
+    db.session.commit()
+    return "", 204
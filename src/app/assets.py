@@ -0,0 +1,163 @@
+# app/assets.py
+"""Fingerprinted and precompressed static files
+
+`flask assets build` copies every file of the static folder to
+static/dist under a name containing a hash of its content, writes .gz
+and, when the brotli package is installed, .br variants next to the
+compressible ones, and records the names in static/dist/manifest.json.
+
+Once the manifest exists url_for("static", filename=...) points to the
+fingerprinted copies, which are served with a one year immutable
+Cache-Control and in the best encoding the client accepts. Without a
+manifest, e.g. in development, static files are served as before.
+"""
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import shutil
+
+from flask import request
+from flask import send_from_directory
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+DIST = "dist"
+MANIFEST = "manifest.json"
+COMPRESSIBLE = (".css", ".js", ".svg", ".eot", ".ttf", ".otf", ".json", ".txt", ".map", ".html")
+# file extension and Content-Encoding of the variants, by preference
+ENCODINGS = ((".br", "br"), (".gz", "gzip"))
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+_CSS_URL = re.compile(r"""url\(\s*(['"]?)([^'")?#]+)([?#][^'")]*)?\1\s*\)""")
+
+
+def _fingerprint(path, content):
+    digest = hashlib.sha256(content).hexdigest()[:12]
+    root, ext = posixpath.splitext(path)
+    return "{0}.{1}{2}".format(root, digest, ext)
+
+
+def _rewrite_css(path, content, manifest):
+    """Point the url() of a stylesheet to the fingerprinted files"""
+    directory = posixpath.dirname(path)
+
+    def replace(match):
+        quote, target, suffix = match.group(1), match.group(2), match.group(3) or ""
+        if ":" in target or target.startswith("/"):
+            return match.group(0)
+        source = posixpath.normpath(posixpath.join(directory, target))
+        if source not in manifest:
+            return match.group(0)
+        # both files move to dist, so the relative path keeps working
+        hashed = posixpath.relpath(manifest[source], directory)
+        return "url({0}{1}{2}{0})".format(quote, hashed, suffix)
+
+    text = content.decode("utf-8")
+    return _CSS_URL.sub(replace, text).encode("utf-8")
+
+
+def _write_variants(path, content):
+    """Write the compressed variants that are smaller than the original"""
+    variants = [(".gz", gzip.compress(content, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        variants.append((".br", brotli.compress(content, quality=11)))
+    for ext, compressed in variants:
+        if len(compressed) < len(content):
+            with open(path + ext, "wb") as variant:
+                variant.write(compressed)
+
+
+def build(static_folder):
+    """Fingerprint and compress the files of static_folder, return the manifest"""
+    output = os.path.join(static_folder, DIST)
+    shutil.rmtree(output, ignore_errors=True)
+
+    sources = []
+    for directory, dirnames, filenames in os.walk(static_folder):
+        dirnames[:] = [name for name in dirnames if os.path.join(directory, name) != output]
+        for filename in filenames:
+            full = os.path.join(directory, filename)
+            sources.append(os.path.relpath(full, static_folder).replace(os.sep, "/"))
+    # stylesheets last, their url() need the names of the files they use
+    sources.sort(key=lambda path: (path.endswith(".css"), path))
+
+    manifest = {}
+    for path in sources:
+        with open(os.path.join(static_folder, path), "rb") as source:
+            content = source.read()
+        if path.endswith(".css"):
+            content = _rewrite_css(path, content, manifest)
+        hashed = _fingerprint(path, content)
+        target = os.path.join(output, hashed)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, "wb") as copy:
+            copy.write(content)
+        if path.endswith(COMPRESSIBLE):
+            _write_variants(target, content)
+        manifest[path] = hashed
+
+    with open(os.path.join(output, MANIFEST), "w", encoding="utf-8") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+    return manifest
+
+
+class Assets(object):
+    """Serve the fingerprinted static files listed in the manifest"""
+
+    def __init__(self):
+        self.manifest = {}
+        self.hashed = frozenset()
+        self.static_folder = None
+
+    def init_app(self, app):
+        self.static_folder = app.static_folder
+        self.manifest = {}
+        if app.config.get("ASSETS_FINGERPRINT", True):
+            path = os.path.join(app.static_folder, DIST, MANIFEST)
+            try:
+                with open(path, encoding="utf-8") as manifest_file:
+                    self.manifest = {
+                        source: DIST + "/" + hashed
+                        for source, hashed in json.load(manifest_file).items()
+                    }
+            except FileNotFoundError:
+                pass
+        self.hashed = frozenset(self.manifest.values())
+        if self.manifest:
+            app.url_defaults(self.fingerprint_url)
+            app.view_functions["static"] = self.send_static_file
+
+    def fingerprint_url(self, endpoint, values):
+        if endpoint == "static" and "filename" in values:
+            values["filename"] = self.manifest.get(values["filename"], values["filename"])
+
+    def send_static_file(self, filename):
+        if filename not in self.hashed:
+            return send_from_directory(self.static_folder, filename)
+
+        mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        for ext, encoding in ENCODINGS:
+            if request.accept_encodings[encoding] and os.path.isfile(
+                os.path.join(self.static_folder, filename + ext)
+            ):
+                response = send_from_directory(
+                    self.static_folder, filename + ext, mimetype=mimetype, max_age=31536000
+                )
+                response.headers["Content-Encoding"] = encoding
+                break
+        else:
+            response = send_from_directory(self.static_folder, filename, max_age=31536000)
+        response.headers["Cache-Control"] = IMMUTABLE
+        response.vary.add("Accept-Encoding")
+        return response
+
+
+assets = Assets()
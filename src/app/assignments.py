@@ -0,0 +1,113 @@
+# app/assignments.py
+"""Set-based assignment of many employees to a department and role"""
+
+from collections import Counter
+
+from sqlalchemy import func
+from sqlalchemy import or_
+from sqlalchemy import select
+from sqlalchemy import update
+
+from app import db
+from app import stats
+from app.models import Employee
+from app.models import invalidate_principals
+from app.models import utcnow
+
+FIELDS = ("department_id", "role_id")
+
+
+class AdminAssignmentError(Exception):
+    """Raised when the selected employees include admins"""
+
+
+class AssignResult(object):
+    """Counters of a bulk assignment"""
+
+    def __init__(self, matched=0, updated=0):
+        self.matched = matched
+        self.updated = updated
+
+    def to_dict(self):
+        return {"matched": self.matched, "updated": self.updated}
+
+    def __repr__(self):
+        return "<AssignResult: matched={0} updated={1}>".format(self.matched, self.updated)
+
+
+def assign_employees(values, ids=None, where=None):
+    """Set values, a dict of department_id and/or role_id, on many employees
+
+    Employees are selected by ids or by where, a dict of their current
+    department_id and/or role_id, None meaning unassigned. Admins cannot
+    be assigned: selecting one by id raises AdminAssignmentError, a where
+    selection skips them. The employees are never loaded: the selected
+    rows are locked and counted per department and role with one grouped
+    query, which also gives the statistics deltas, and the ones that
+    change are written with one UPDATE, which bumps their version, in the
+    current transaction. The caller commits.
+    """
+    table = Employee.__table__
+    if ids is not None:
+        ids = list(ids)
+        criteria = [table.c.id.in_(ids)]
+    else:
+        criteria = [table.c.is_admin.is_not(True)]
+        for name, value in (where or {}).items():
+            column = table.c[name]
+            criteria.append(column.is_(None) if value is None else column == value)
+
+    locked = (
+        select(table.c.department_id, table.c.role_id, table.c.is_admin)
+        .where(*criteria)
+        .with_for_update()
+        .subquery()
+    )
+    counts = db.session.execute(
+        select(locked.c.department_id, locked.c.role_id, locked.c.is_admin, func.count()).group_by(
+            locked.c.department_id, locked.c.role_id, locked.c.is_admin
+        )
+    ).all()
+    if any(is_admin for department_id, role_id, is_admin, headcount in counts):
+        raise AdminAssignmentError("Admins cannot be assigned a department or role.")
+
+    result = AssignResult(matched=sum(headcount for *group, headcount in counts))
+    changing = 0
+    deltas = Counter()
+    for department_id, role_id, is_admin, headcount in counts:
+        current = {"department_id": department_id, "role_id": role_id}
+        moved = dict(current, **values)
+        if moved != current:
+            changing += headcount
+            deltas.subtract({group: headcount for group in stats.groups(**current)})
+            deltas.update({group: headcount for group in stats.groups(**moved)})
+    if not changing:
+        return result
+
+    # bypasses the ORM, so the version and updated_at are set here
+    changed = or_(*(table.c[name].is_distinct_from(value) for name, value in values.items()))
+    result.updated = db.session.execute(
+        update(table)
+        .where(*criteria, changed)
+        .values(version=table.c.version + 1, updated_at=utcnow(), **values)
+    ).rowcount
+    stats.apply(db.session, deltas)
+    # a where selection may be any number of employees, drop every principal
+    invalidate_principals(db.session, ids)
+    return result
+
+
+def delete_group(instance, reassign_to=None):
+    """Delete a department or role, moving its employees to reassign_to
+
+    The employees are moved by assign_employees, without a target to no
+    department or role, so their version is bumped and they are never
+    loaded. ON DELETE SET NULL remains as a backstop for the admins it
+    skips. Returns the number of employees moved, the caller commits.
+    """
+    name = type(instance).__name__.lower() + "_id"
+    if reassign_to is not None and reassign_to == instance.id:
+        raise ValueError("Employees cannot be moved to the deleted {0}.".format(name[:-3]))
+    moved = assign_employees({name: reassign_to}, where={name: instance.id}).updated
+    db.session.delete(instance)
+    return moved
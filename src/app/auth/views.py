@@ -20,6 +20,11 @@ def login():
         # check if employee exist
         employee = Employee.query.filter_by(username=form.username.data).first()
         if employee is not None and employee.verify_password(form.password.data):
+            # upgrade hashes made with an outdated method or cost
+            if employee.password_needs_rehash():
+                employee.password = form.password.data
+                db.session.commit()
+
             # log in employee
             login_user(employee)
 
@@ -0,0 +1,86 @@
+# app/changes.py
+"""Per table change counters shared by every process
+
+Each transaction writing to one of VERSIONED_TABLES bumps the counter of
+that table just before it commits, in the same transaction, so a counter
+changes exactly when the committed content of its table does. Caches key
+their entries on these counters instead of expiring them by time.
+"""
+
+from flask import g
+from flask import has_app_context
+from sqlalchemy import event
+from sqlalchemy import select
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from app.models import VERSIONED_TABLES
+from app.models import TableVersion
+
+# tables written by ON DELETE SET NULL when a row of the key table is deleted
+ON_DELETE = {"departments": "employees", "roles": "employees"}
+
+
+def table_versions(session):
+    """Return {table name: version}, read once per request"""
+    versions = g.get("_table_versions") if has_app_context() else None
+    if versions is None:
+        versions = dict(session.execute(select(TableVersion.name, TableVersion.version)).all())
+        if has_app_context():
+            g._table_versions = versions
+    return versions
+
+
+def _changed(session):
+    return session.info.setdefault("changed_tables", set())
+
+
+def mark_changed(session, *tables):
+    """Bump tables on commit, for writes the session cannot see, e.g. a COPY"""
+    _changed(session).update(table for table in tables if table in VERSIONED_TABLES)
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_flushed(session, flush_context):
+    changed = _changed(session)
+    for instance in session.new | session.dirty | session.deleted:
+        table = getattr(instance, "__tablename__", None)
+        if table in VERSIONED_TABLES and (
+            instance not in session.dirty or session.is_modified(instance)
+        ):
+            changed.add(table)
+            if instance in session.deleted and table in ON_DELETE:
+                changed.add(ON_DELETE[table])
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _collect_executed(state):
+    # bulk INSERT, UPDATE and DELETE statements skip the flush
+    if state.is_insert or state.is_update or state.is_delete:
+        table = getattr(state.statement.table, "name", None)
+        if table in VERSIONED_TABLES:
+            _changed(state.session).add(table)
+
+
+@event.listens_for(Session, "before_commit")
+def _bump_versions(session):
+    # commit flushes after this hook, do it now to count pending objects
+    session.flush()
+    changed = session.info.pop("changed_tables", None)
+    if changed:
+        session.execute(
+            update(TableVersion)
+            .where(TableVersion.name.in_(sorted(changed)))
+            .values(version=TableVersion.version + 1)
+        )
+
+
+@event.listens_for(Session, "after_commit")
+def _forget_read_versions(session):
+    if has_app_context():
+        g.pop("_table_versions", None)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_changes(session):
+    session.info.pop("changed_tables", None)
@@ -0,0 +1,179 @@
+# app/commands.py
+"""flask command line commands"""
+
+import csv
+import os
+import signal
+import time
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from flask.cli import with_appcontext
+
+from app import assets
+from app import db
+from app import exporter
+from app import importer
+from app import jobs
+from app import seed as seeding
+from app import stats
+
+employees_cli = AppGroup("employees", help="Manage employees in bulk.")
+assets_cli = AppGroup("assets", help="Build the static files.")
+stats_cli = AppGroup("stats", help="Maintain the dashboard statistics.")
+
+
+@employees_cli.command("import")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--format", "fmt", type=click.Choice(importer.FORMATS), help="Defaults to the extension."
+)
+@click.option(
+    "--errors", "errors_path", type=click.Path(dir_okay=False), help="Per-row error file."
+)
+@click.option("--chunk-size", default=1000, show_default=True)
+def import_employees(path, fmt, errors_path, chunk_size):
+    """Import employees from a CSV or NDJSON file.
+
+    Columns: email, username, first_name, last_name and optionally
+    password or password_hash, department and role (by name).
+    """
+    fmt = fmt or importer.guess_format(path)
+    errors_path = errors_path or path + ".errors.csv"
+
+    with (
+        open(path, newline="", encoding="utf-8", errors="surrogateescape") as stream,
+        open(errors_path, "w", newline="", encoding="utf-8") as errors_file,
+    ):
+        errors = csv.writer(errors_file)
+        errors.writerow(importer.ERROR_FIELDS)
+        try:
+            result = importer.import_employees(stream, fmt, errors=errors, chunk_size=chunk_size)
+        except importer.ImportFileError as exp:
+            raise click.ClickException(
+                "The import stopped, the file cannot be read. {0}. {1} employees were "
+                "imported before.".format(exp, exp.result.inserted if exp.result else 0)
+            )
+
+    click.echo(
+        "Read {0} rows, inserted {1}, rejected {2}.".format(
+            result.read, result.inserted, result.errors
+        )
+    )
+    if result.errors:
+        click.echo("Rejected rows written to {0}".format(errors_path))
+
+
+@click.command("export")
+@click.argument("entity", type=click.Choice(sorted(exporter.QUERIES)))
+@click.option("--format", "fmt", type=click.Choice(exporter.FORMATS), default="csv")
+@click.option("--output", type=click.File("w", encoding="utf-8"), default="-")
+@click.option("--chunk-size", default=1000, show_default=True)
+@with_appcontext
+def export(entity, fmt, output, chunk_size):
+    """Export employees, departments or roles as CSV or NDJSON."""
+    for chunk in exporter.stream_rows(entity, fmt, chunk_size=chunk_size):
+        output.write(chunk)
+
+
+@assets_cli.command("build")
+@with_appcontext
+def build_assets():
+    """Fingerprint and precompress the static files.
+
+    Writes static/dist and its manifest.json, which the application
+    picks up on its next start.
+    """
+    static_folder = current_app.static_folder
+    manifest = assets.build(static_folder)
+    click.echo(
+        "Built {0} files in {1}".format(len(manifest), os.path.join(static_folder, assets.DIST))
+    )
+    if assets.brotli is None:
+        click.echo("brotli is not installed, only gzip variants were written")
+
+
+@stats_cli.command("rebuild")
+@with_appcontext
+def rebuild_stats():
+    """Recompute the headcount statistics from the employees table.
+
+    Only needed after employees were changed by hand, the application
+    keeps the statistics up to date itself.
+    """
+    counted = stats.rebuild(db.session)
+    db.session.commit()
+    click.echo("Counted {0} employees.".format(counted))
+
+
+@click.command("worker")
+@click.option("--concurrency", type=int, help="Jobs run at once, defaults to WORKER_CONCURRENCY.")
+@click.option("--poll-interval", type=float, help="Seconds between polls of an empty queue.")
+@click.option("--burst", is_flag=True, help="Exit once no job is due.")
+@with_appcontext
+def worker(concurrency, poll_interval, burst):
+    """Run the queued background jobs.
+
+    SIGTERM and Ctrl-C let the running jobs finish before exiting.
+    """
+    app = current_app._get_current_object()
+    runner = jobs.Worker(
+        app,
+        concurrency=concurrency or app.config["WORKER_CONCURRENCY"],
+        poll_interval=poll_interval or app.config["WORKER_POLL_INTERVAL"],
+        burst=burst,
+    )
+    signal.signal(signal.SIGTERM, lambda signum, frame: runner.stop())
+    click.echo("Worker {0} running {1} jobs at once.".format(runner.name, runner.concurrency))
+    runner.run()
+
+
+@click.command("seed")
+@click.option("--departments", default=20, show_default=True)
+@click.option("--roles", default=10, show_default=True)
+@click.option("--employees", default=100000, show_default=True)
+@click.option("--seed", "seed_", default=0, show_default=True, help="Seed of the generator.")
+@click.option("--skew", default=1.1, show_default=True, help="Zipf exponent of the group sizes.")
+@click.option("--unassigned", default=0.02, show_default=True, help="Share without a group.")
+@click.option("--password", default="password", show_default=True, help="Of every account.")
+@click.option("--admin", default="admin", show_default=True, help="Admin account to create.")
+@click.option("--user", default="jdoe", show_default=True, help="Regular account to create.")
+@click.option("--batch-size", default=50000, show_default=True)
+@with_appcontext
+def seed(departments, roles, employees, seed_, skew, unassigned, password, admin, user, batch_size):
+    """Fill the database with generated departments, roles and employees.
+
+    The same --seed on the same database gives the same rows. The admin
+    and user accounts, if missing, are the ones benchmarks/loadtest.py
+    logs in with.
+    """
+    started = time.perf_counter()
+    seeder = seeding.Seeder(
+        seed=seed_, skew=skew, unassigned=unassigned, password=password, batch_size=batch_size
+    )
+    seeder.groups(departments, roles)
+    click.echo(
+        "Added {0} departments and {1} roles.".format(len(seeder.departments), len(seeder.roles))
+    )
+    for inserted in seeder.employees(employees):
+        click.echo(
+            "Added {0}/{1} employees in {2:.1f}s.".format(
+                inserted, employees, time.perf_counter() - started
+            )
+        )
+    seeder.accounts(admin=admin, user=user)
+    counted = seeder.rebuild_stats()
+    click.echo(
+        "Done in {0:.1f}s, {1} employees counted.".format(time.perf_counter() - started, counted)
+    )
+
+
+def init_app(app):
+    """Register the commands on app"""
+    app.cli.add_command(employees_cli)
+    app.cli.add_command(export)
+    app.cli.add_command(assets_cli)
+    app.cli.add_command(stats_cli)
+    app.cli.add_command(worker)
+    app.cli.add_command(seed)
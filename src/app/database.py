@@ -0,0 +1,249 @@
+# app/database.py
+"""Database engine configuration, connection pool instrumentation and
+routing of read-only work to replicas"""
+
+import functools
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import current_app
+from flask import g
+from flask import has_request_context
+from flask import session as cookie_session
+from flask_sqlalchemy.session import Session as FlaskSession
+from sqlalchemy import event
+from sqlalchemy import exc
+from sqlalchemy.engine import Engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import NullPool
+from sqlalchemy.pool import QueuePool
+
+# upper bounds, in seconds, of the pool checkout wait histogram
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, float("inf"))
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool recording how long checkouts wait for a free connection"""
+
+    def __init__(self, *args, **kwargs):
+        super(InstrumentedQueuePool, self).__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.wait_buckets = [0] * len(WAIT_BUCKETS)
+        self.peak_checkedout = 0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super(InstrumentedQueuePool, self)._do_get()
+        except exc.TimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            self._record(time.perf_counter() - start)
+
+    def _record(self, waited):
+        with self._stats_lock:
+            self.checkouts += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+            for index, bound in enumerate(WAIT_BUCKETS):
+                if waited <= bound:
+                    self.wait_buckets[index] += 1
+                    break
+            self.peak_checkedout = max(self.peak_checkedout, self.checkedout())
+
+    def stats(self):
+        """Return the checkout counters and the current saturation"""
+        capacity = self.size() + max(self._max_overflow, 0)
+        with self._stats_lock:
+            return {
+                "size": self.size(),
+                "max_overflow": self._max_overflow,
+                "checked_out": self.checkedout(),
+                "peak_checked_out": self.peak_checkedout,
+                "saturation": self.checkedout() / capacity if capacity else 0.0,
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_total": self.wait_total,
+                "wait_max": self.wait_max,
+                "wait_buckets": dict(
+                    zip([str(bound) for bound in WAIT_BUCKETS], self.wait_buckets)
+                ),
+            }
+
+
+def engine_options(config):
+    """Build SQLALCHEMY_ENGINE_OPTIONS from the DB_* settings of config
+
+    Options set explicitly in SQLALCHEMY_ENGINE_OPTIONS take precedence.
+    SQLite keeps the defaults of Flask-SQLAlchemy.
+    """
+    options = {}
+    uri = config.get("SQLALCHEMY_DATABASE_URI")
+    url = make_url(uri) if uri else None
+
+    if url is not None and url.get_backend_name() != "sqlite":
+        if config.get("DB_PGBOUNCER") and config.get("DB_NULL_POOL"):
+            # PgBouncer does the pooling, every checkout opens a connection to it
+            options["poolclass"] = NullPool
+        else:
+            options.update(
+                poolclass=InstrumentedQueuePool,
+                pool_size=config.get("DB_POOL_SIZE", 5),
+                max_overflow=config.get("DB_MAX_OVERFLOW", 10),
+                pool_timeout=config.get("DB_POOL_TIMEOUT", 30),
+                pool_recycle=config.get("DB_POOL_RECYCLE", -1),
+            )
+        options["pool_pre_ping"] = config.get("DB_POOL_PRE_PING", False)
+
+        if config.get("DB_PGBOUNCER") and url.get_driver_name() == "psycopg":
+            # transaction pooling hands every transaction a different server
+            # connection, where statements prepared earlier do not exist
+            options["connect_args"] = {"prepare_threshold": None}
+
+    options.update(config.get("SQLALCHEMY_ENGINE_OPTIONS") or {})
+    return options
+
+
+def replica_binds(config):
+    """Return the SQLALCHEMY_BINDS entries of the DB_REPLICAS urls"""
+    return {
+        "replica{0}".format(index): url for index, url in enumerate(config.get("DB_REPLICAS") or ())
+    }
+
+
+def pool_stats(engine):
+    """Return the checkout statistics of engine or None if not instrumented"""
+    pool = engine.pool
+    return pool.stats() if isinstance(pool, InstrumentedQueuePool) else None
+
+
+def statement_timeout(milliseconds):
+    """Run the queries of a view with another statement timeout, 0 disables it"""
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            g.statement_timeout = milliseconds
+            return view(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+@event.listens_for(Engine, "begin")
+def _set_statement_timeout(conn):
+    """Apply the statement timeout to every PostgreSQL transaction
+
+    SET LOCAL only lasts until the end of the transaction, which keeps it
+    compatible with PgBouncer in transaction pooling mode.
+    """
+    if conn.dialect.name != "postgresql" or not has_request_context():
+        return
+    timeout = g.get("statement_timeout", current_app.config.get("DB_STATEMENT_TIMEOUT"))
+    if timeout is not None:
+        conn.exec_driver_sql("SET LOCAL statement_timeout = %d" % int(timeout))
+
+
+@event.listens_for(Engine, "connect")
+def _enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    """Make SQLite enforce foreign keys, and their ON DELETE actions"""
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
+
+# key of the cookie session holding the time until which reads stay on
+# the primary, so that a client sees its own writes despite replica lag
+PRIMARY_UNTIL = "_db_primary_until"
+
+
+@contextmanager
+def replica_reads():
+    """Let the reads of the with block go to a replica"""
+    if not has_request_context():
+        yield
+        return
+    previous = g.get("db_read_only", False)
+    g.db_read_only = True
+    try:
+        yield
+    finally:
+        g.db_read_only = previous
+
+
+def read_only(view):
+    """Send the queries of a view that never writes to a replica"""
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        with replica_reads():
+            return view(*args, **kwargs)
+
+    return wrapper
+
+
+class RoutingSession(FlaskSession):
+    """Session reading from a replica inside replica_reads()
+
+    Flushes, INSERT, UPDATE, DELETE and SELECT ... FOR UPDATE always use
+    the primary, as does every read of a client for DB_REPLICA_LAG seconds
+    after it committed a write.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        engine = super(RoutingSession, self).get_bind(
+            mapper=mapper, clause=clause, bind=bind, **kwargs
+        )
+        if bind is None and engine is self._db.engines.get(None) and self._use_replica(clause):
+            return self._db.engines[g.db_replica]
+        return engine
+
+    def _use_replica(self, clause):
+        if self._flushing or not has_request_context() or not g.get("db_read_only"):
+            return False
+        if clause is not None and (
+            getattr(clause, "is_dml", False) or getattr(clause, "_for_update_arg", None)
+        ):
+            return False
+        if cookie_session.get(PRIMARY_UNTIL, 0) > time.time():
+            return False
+        if "db_replica" not in g:
+            replicas = sorted(replica_binds(current_app.config))
+            g.db_replica = random.choice(replicas) if replicas else None
+        return g.db_replica is not None
+
+
+@event.listens_for(Session, "after_flush")
+def _flushed(session, flush_context):
+    session.info["db_wrote"] = True
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _executed(state):
+    if state.is_insert or state.is_update or state.is_delete:
+        state.session.info["db_wrote"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _stick_to_primary(session):
+    if session.info.pop("db_wrote", False) and has_request_context():
+        lag = current_app.config.get("DB_REPLICA_LAG", 5)
+        if current_app.config.get("DB_REPLICAS") and lag:
+            cookie_session[PRIMARY_UNTIL] = time.time() + lag
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_writes(session):
+    session.info.pop("db_wrote", None)
@@ -0,0 +1,75 @@
+# app/exporter.py
+"""Streaming CSV and NDJSON export of employees, departments and roles"""
+
+import csv
+import io
+import json
+
+from sqlalchemy import select
+
+from app import db
+from app.models import Department
+from app.models import Employee
+from app.models import Role
+
+FORMATS = ("csv", "ndjson")
+MIMETYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+
+def _employees():
+    # names are joined in SQL instead of lazy loading them per row
+    return (
+        select(
+            Employee.id,
+            Employee.email,
+            Employee.username,
+            Employee.first_name,
+            Employee.last_name,
+            Department.name.label("department"),
+            Role.name.label("role"),
+            Employee.is_admin,
+        )
+        .outerjoin(Department, Employee.department_id == Department.id)
+        .outerjoin(Role, Employee.role_id == Role.id)
+        .order_by(Employee.id)
+    )
+
+
+def _departments():
+    return select(Department.id, Department.name, Department.description).order_by(Department.id)
+
+
+def _roles():
+    return select(Role.id, Role.name, Role.description).order_by(Role.id)
+
+
+QUERIES = {"employees": _employees, "departments": _departments, "roles": _roles}
+
+
+def _csv_chunk(rows):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue()
+
+
+def _ndjson_chunk(rows, fields):
+    return "".join(json.dumps(dict(zip(fields, row))) + "\n" for row in rows)
+
+
+def stream_rows(entity, fmt, chunk_size=1000):
+    """Yield the rows of entity as text, one chunk of rows at a time
+
+    The rows are fetched through a server side cursor, so neither the
+    database driver nor the process ever holds the whole table.
+    """
+    statement = QUERIES[entity]().execution_options(yield_per=chunk_size)
+    result = db.session.execute(statement)
+    fields = list(result.keys())
+
+    if fmt == "csv":
+        yield _csv_chunk([fields])
+    for rows in result.partitions():
+        if fmt == "csv":
+            yield _csv_chunk(rows)
+        else:
+            yield _ndjson_chunk(rows, fields)
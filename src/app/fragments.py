@@ -0,0 +1,226 @@
+# app/fragments.py
+"""Template fragment cache
+
+    {% cache "admin.departments", 300, "departments", "employees" %}
+        ...
+    {% endcache %}
+
+caches the rendered block for 300 seconds under a key made of its name
+and the change counters of the tables listed after the TTL, so that any
+committed write to those tables makes the next render miss. Fragments
+must not contain anything specific to the user or the request, such as
+CSRF tokens or flashed messages.
+"""
+
+import hashlib
+import os
+import tempfile
+import time
+
+from flask import current_app
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+from app import db
+from app.cache import LRUCache
+from app.changes import table_versions
+
+try:
+    import redis
+except ImportError:  # pragma: no cover
+    redis = None
+
+
+class NullBackend(object):
+    """Cache nothing, every fragment is rendered"""
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl):
+        pass
+
+
+class LRUBackend(object):
+    """Fragments kept in the memory of each worker process"""
+
+    def __init__(self, maxsize=512):
+        self.cache = LRUCache(maxsize)
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value, ttl):
+        self.cache.set(key, value, ttl)
+
+
+class FileSystemBackend(object):
+    """Fragments shared by the processes of a host through a directory
+
+    Expired files are removed when read, and every prune_every writes the
+    directory is swept of the expired ones and cut down to maxsize files,
+    the least recently written going first, since fragments keyed on old
+    table versions are never read again.
+    """
+
+    def __init__(self, directory, maxsize=512, prune_every=100):
+        self.directory = directory
+        self.maxsize = maxsize
+        self.prune_every = prune_every
+        self._writes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode("utf-8")).hexdigest())
+
+    @staticmethod
+    def _expired(path, now):
+        with open(path, encoding="utf-8") as cached:
+            expires = float(cached.readline())
+        return bool(expires) and expires < now
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as cached:
+                expires = float(cached.readline())
+                if not expires or expires >= time.time():
+                    return cached.read()
+        except (OSError, ValueError):
+            return None
+        self._remove(path)
+        return None
+
+    def set(self, key, value, ttl):
+        expires = time.time() + ttl if ttl else 0
+        # write aside then rename so that readers never see half a fragment
+        handle, path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(handle, "w", encoding="utf-8") as cached:
+            cached.write("{0}\n{1}".format(expires, value))
+        os.replace(path, self._path(key))
+        self._writes += 1
+        if self._writes % self.prune_every == 0:
+            self.prune()
+
+    def prune(self):
+        """Remove the expired fragments and the oldest ones above maxsize"""
+        now = time.time()
+        kept = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                try:
+                    if self._expired(entry.path, now):
+                        self._remove(entry.path)
+                    else:
+                        kept.append((entry.stat().st_mtime, entry.path))
+                except (OSError, ValueError):
+                    continue
+        kept.sort(reverse=True)
+        for _, path in kept[self.maxsize :]:
+            self._remove(path)
+
+
+class RedisBackend(object):
+    """Fragments shared by every host through a Redis compatible server
+
+    client is anything with the get(key) and set(key, value, ex=seconds)
+    methods of redis.Redis, so a local stand-in can replace the server.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def get(self, key):
+        value = self.client.get(key)
+        return value.decode("utf-8") if isinstance(value, bytes) else value
+
+    def set(self, key, value, ttl):
+        self.client.set(key, value, ex=ttl or None)
+
+
+class FragmentCache(object):
+    """Render template fragments once per version of the tables they show"""
+
+    def __init__(self):
+        self.backend = NullBackend()
+        self.prefix = "fragment"
+        self.default_ttl = 300
+
+    def init_app(self, app, backend=None):
+        """Use backend or the one named by FRAGMENT_CACHE_BACKEND"""
+        self.prefix = app.config.get("FRAGMENT_CACHE_PREFIX", self.prefix)
+        self.default_ttl = app.config.get("FRAGMENT_CACHE_TTL", self.default_ttl)
+        self.backend = backend or self._make_backend(app.config)
+        app.jinja_env.add_extension(FragmentCacheExtension)
+
+    @staticmethod
+    def _make_backend(config):
+        name = config.get("FRAGMENT_CACHE_BACKEND", "lru")
+        if name == "lru":
+            return LRUBackend(config.get("FRAGMENT_CACHE_SIZE", 512))
+        if name == "filesystem":
+            return FileSystemBackend(
+                config.get("FRAGMENT_CACHE_DIR", "cache/fragments"),
+                config.get("FRAGMENT_CACHE_SIZE", 512),
+            )
+        if name == "redis":
+            if redis is None:
+                raise RuntimeError("FRAGMENT_CACHE_BACKEND is redis but redis is not installed")
+            return RedisBackend(redis.Redis.from_url(config["FRAGMENT_CACHE_URL"]))
+        if name == "null":
+            return NullBackend()
+        raise ValueError("Unknown FRAGMENT_CACHE_BACKEND {0!r}".format(name))
+
+    def key(self, name, tables):
+        versions = table_versions(db.session) if tables else {}
+        parts = [self.prefix, name]
+        parts.extend("{0}={1}".format(table, versions.get(table, 0)) for table in tables)
+        return ":".join(parts)
+
+    def render(self, name, ttl, tables, render):
+        """Return the cached fragment or the result of render()"""
+        key = self.key(name, tables)
+        try:
+            value = self.backend.get(key)
+        except Exception:
+            # a cache that is down must not take the pages down with it
+            current_app.logger.exception("Fragment cache read failed")
+            value = None
+        if value is None:
+            value = str(render())
+            try:
+                self.backend.set(key, value, self.default_ttl if ttl is None else ttl)
+            except Exception:
+                current_app.logger.exception("Fragment cache write failed")
+        return Markup(value)
+
+
+fragments = FragmentCache()
+
+
+class FragmentCacheExtension(Extension):
+    """The {% cache name[, ttl[, table, ...]] %} ... {% endcache %} tag"""
+
+    tags = {"cache"}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        while parser.stream.skip_if("comma"):
+            args.append(parser.parse_expression())
+        body = parser.parse_statements(["name:endcache"], drop_needle=True)
+        call = self.call_method("_render", [nodes.List(args)])
+        return nodes.CallBlock(call, [], [], body).set_lineno(lineno)
+
+    def _render(self, args, caller):
+        name = args[0]
+        ttl = args[1] if len(args) > 1 else None
+        return fragments.render(name, ttl, args[2:], caller)
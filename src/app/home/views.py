@@ -3,6 +3,10 @@ from flask import render_template
 from flask_login import current_user
 from flask_login import login_required
 
+from .. import database
+from .. import db
+from .. import stats
+from ..http import conditional
 from . import home
 
 
@@ -25,3 +29,18 @@ def admin_dashboard():
     if not current_user.is_admin:
         abort(403)
     return render_template("home/admin_dashboard.html", title="Dashboard")
+
+
+@home.route("/admin/dashboard/stats")
+@login_required
+@database.read_only
+def admin_stats():
+    """Headcount statistics of the dashboard charts, as JSON"""
+    if not current_user.is_admin:
+        abort(403)
+    versions, summary = stats.summary(db.session)
+    response = conditional(summary, "stats-" + "-".join(str(version) for version in versions))
+    # revalidated on every view, which costs one read of table_versions
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
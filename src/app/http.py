@@ -0,0 +1,34 @@
+# app/http.py
+"""HTTP helpers shared by the blueprints"""
+
+from datetime import timezone
+
+from flask import current_app
+from flask import jsonify
+from flask import request
+
+
+def not_modified(etag, last_modified=None):
+    """Tell if the validators of the request match this version
+
+    If-Modified-Since is only looked at without If-None-Match, and at the
+    second precision of HTTP dates; last_modified is a naive UTC datetime.
+    """
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    since = request.if_modified_since
+    if since is None or last_modified is None:
+        return False
+    return last_modified.replace(tzinfo=timezone.utc, microsecond=0) <= since
+
+
+def conditional(payload, etag, last_modified=None):
+    """Return payload as JSON unless the client already holds this version"""
+    if not_modified(etag, last_modified):
+        response = current_app.response_class(status=304)
+    else:
+        response = jsonify(payload)
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    return response
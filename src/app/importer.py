@@ -0,0 +1,280 @@
+# app/importer.py
+"""Streaming bulk import of employees from CSV or NDJSON files"""
+
+import contextlib
+import csv
+import json
+import os
+from itertools import islice
+
+from email_validator import EmailNotValidError
+from email_validator import validate_email
+from sqlalchemy import or_
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects import sqlite
+
+from app import db
+from app import stats
+from app.jobs import jobs
+from app.models import Department
+from app.models import Employee
+from app.models import Role
+from app.passwords import hasher
+from app.uniqueness import uniqueness
+
+FORMATS = ("csv", "ndjson")
+ERROR_FIELDS = ("line", "username", "email", "error")
+STRING_FIELDS = ("email", "username", "first_name", "last_name")
+
+
+class ImportFileError(Exception):
+    """Raised when an import file cannot be read, at all or from some line on
+
+    result is the ImportResult of the chunks committed before the error.
+    """
+
+    result = None
+
+
+class ImportResult(object):
+    """Counters of an import run"""
+
+    def __init__(self):
+        self.read = 0
+        self.inserted = 0
+        self.errors = 0
+
+    def __repr__(self):
+        return "<ImportResult: read={0} inserted={1} errors={2}>".format(
+            self.read, self.inserted, self.errors
+        )
+
+
+class ErrorSample(list):
+    """csv.writer stand-in keeping the first `limit` rejected rows"""
+
+    def __init__(self, limit=100):
+        super(ErrorSample, self).__init__()
+        self.limit = limit
+
+    def writerow(self, row):
+        if len(self) < self.limit:
+            self.append(row)
+
+
+def guess_format(filename):
+    """Guess the file format from the extension of filename"""
+    if filename.lower().endswith((".ndjson", ".jsonl")):
+        return "ndjson"
+    return "csv"
+
+
+def _text_lines(stream, counter):
+    """Yield the lines of stream, counting them in counter[0]
+
+    Streams opened with errors="surrogateescape" hold undecodable bytes as
+    lone surrogates, which encoding back finds line by line.
+    """
+    for line in stream:
+        counter[0] += 1
+        try:
+            line.encode("utf-8")
+        except UnicodeEncodeError:
+            raise ImportFileError("Line {0}: not UTF-8 text".format(counter[0])) from None
+        yield line
+
+
+def read_rows(stream, fmt):
+    """Yield (line number, dict) pairs from a text stream without loading it
+
+    Raises ImportFileError, naming the line, when the stream stops being
+    UTF-8 text or CSV.
+    """
+    if fmt not in FORMATS:
+        raise ImportFileError("Unknown format: {0}".format(fmt))
+    counter = [0]
+    lines = _text_lines(stream, counter)
+    try:
+        if fmt == "csv":
+            reader = csv.DictReader(lines)
+            for row in reader:
+                yield reader.line_num, row
+        else:
+            for line in lines:
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    row = None
+                yield counter[0], row if isinstance(row, dict) else None
+    except (UnicodeDecodeError, csv.Error) as exp:
+        raise ImportFileError("Line {0}: {1}".format(counter[0] + 1, exp)) from exp
+
+
+def _insert_statement():
+    """INSERT that skips rows hitting a unique index instead of failing"""
+    table = Employee.__table__
+    dialect = db.engine.dialect.name
+    if dialect == "postgresql":
+        statement = postgresql.insert(table).on_conflict_do_nothing()
+    elif dialect == "sqlite":
+        statement = sqlite.insert(table).on_conflict_do_nothing()
+    else:
+        statement = table.insert()
+    return statement.returning(table.c.username)
+
+
+class EmployeeImporter(object):
+    """Validate and insert employees chunk by chunk
+
+    Only one chunk is held in memory at a time. Every chunk is checked
+    against the unique indexes with one query, inserted with one multi-row
+    INSERT and committed, so a failure never loses the chunks before it.
+    Rejected rows are written to `errors`, a csv.writer like object.
+    """
+
+    def __init__(self, errors=None, chunk_size=1000):
+        self.chunk_size = chunk_size
+        self.errors = errors
+        self.result = ImportResult()
+        self.departments = dict(db.session.query(Department.name, Department.id))
+        self.roles = dict(db.session.query(Role.name, Role.id))
+
+    def run(self, stream, fmt):
+        rows = read_rows(stream, fmt)
+        try:
+            while True:
+                chunk = list(islice(rows, self.chunk_size))
+                if not chunk:
+                    break
+                self.result.read += len(chunk)
+                self._import_chunk(chunk)
+        except ImportFileError as exp:
+            exp.result = self.result
+            raise
+        return self.result
+
+    def _reject(self, line, row, error):
+        self.result.errors += 1
+        if self.errors is not None:
+            row = row or {}
+            self.errors.writerow([line, row.get("username"), row.get("email"), error])
+
+    def _validate(self, line, row):
+        """Return the employees table values of row or None if it is invalid"""
+        if row is None:
+            self._reject(line, row, "unreadable row")
+            return None
+        values = {}
+        for field in STRING_FIELDS:
+            value = (row.get(field) or "").strip()
+            if len(value) > 60:
+                self._reject(line, row, "{0} is longer than 60 characters".format(field))
+                return None
+            values[field] = value or None
+        if not values["username"]:
+            self._reject(line, row, "username is required")
+            return None
+        try:
+            validate_email(values["email"] or "", check_deliverability=False)
+        except EmailNotValidError as exp:
+            self._reject(line, row, "invalid email: {0}".format(exp))
+            return None
+
+        for field, lookup in (("department", self.departments), ("role", self.roles)):
+            name = (row.get(field) or "").strip()
+            if name and name not in lookup:
+                self._reject(line, row, "unknown {0}: {1}".format(field, name))
+                return None
+            values[field + "_id"] = lookup.get(name)
+
+        values["password_hash"] = row.get("password_hash") or None
+        values["is_admin"] = False
+        return values
+
+    def _import_chunk(self, chunk):
+        pending = {}
+        passwords = {}
+        emails = set()
+        for line, row in chunk:
+            values = self._validate(line, row)
+            if values is None:
+                continue
+            if values["username"] in pending or values["email"] in emails:
+                self._reject(line, row, "duplicate in file")
+                continue
+            pending[values["username"]] = (line, row, values)
+            emails.add(values["email"])
+            if not values["password_hash"] and row.get("password"):
+                passwords[values["username"]] = row["password"]
+
+        if not pending:
+            return
+
+        # one query finds every username or email of the chunk already taken
+        taken = db.session.execute(
+            select(Employee.username, Employee.email).where(
+                or_(Employee.username.in_(list(pending)), Employee.email.in_(list(emails)))
+            )
+        ).all()
+        taken_usernames = {username for username, email in taken}
+        taken_emails = {email for username, email in taken}
+        for username, (line, row, values) in list(pending.items()):
+            if username in taken_usernames or values["email"] in taken_emails:
+                self._reject(line, row, "username or email already in use")
+                del pending[username]
+                passwords.pop(username, None)
+
+        if passwords:
+            hashes = hasher.hash_many(passwords.values())
+            for username, pwhash in zip(passwords, hashes):
+                pending[username][2]["password_hash"] = pwhash
+
+        if not pending:
+            return
+
+        rows = [values for line, row, values in pending.values()]
+        inserted = set(db.session.execute(_insert_statement(), rows).scalars())
+        stats.apply(db.session, stats.count(pending[username][2] for username in inserted))
+        db.session.commit()
+
+        self.result.inserted += len(inserted)
+        for username in inserted:
+            uniqueness.add(username, pending[username][2]["email"])
+        # rows taken by a concurrent writer between the check and the insert
+        for username in pending.keys() - inserted:
+            line, row, values = pending[username]
+            self._reject(line, row, "username or email already in use")
+
+
+def import_employees(stream, fmt, errors=None, chunk_size=1000):
+    """Import employees from a text stream and return an ImportResult"""
+    return EmployeeImporter(errors=errors, chunk_size=chunk_size).run(stream, fmt)
+
+
+@jobs.task("import_employees")
+def import_file(path, fmt):
+    """Import a file saved by the import view, then delete it
+
+    path is relative to jobs.files_dir(). The file is kept for a retry
+    when the import fails, and deleted when the last attempt does.
+    """
+    path = os.path.join(jobs.files_dir(), path)
+    errors = ErrorSample()
+    done = False
+    try:
+        with open(path, newline="", encoding="utf-8", errors="surrogateescape") as stream:
+            result = import_employees(stream, fmt, errors=errors)
+        done = True
+    finally:
+        if done or jobs.last_attempt():
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+    return {
+        "read": result.read,
+        "inserted": result.inserted,
+        "errors": result.errors,
+        "rejected": list(errors),
+    }
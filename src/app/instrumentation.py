@@ -0,0 +1,130 @@
+# app/instrumentation.py
+"""Per-request SQL statistics, Server-Timing headers and an N+1 detector"""
+
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from flask import current_app
+from flask import g
+from flask import has_app_context
+from flask import request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+_local = threading.local()
+
+_PLACEHOLDER = r"(\?|%s|%\(\w+\)s|:\w+)"
+_PLACEHOLDER_LIST = re.compile(r"\(\s*{0}(\s*,\s*{0})*\s*\)".format(_PLACEHOLDER))
+_SPACES = re.compile(r"\s+")
+
+
+def statement_shape(statement):
+    """Normalise whitespace and IN lists so repeated statements compare equal"""
+    statement = _SPACES.sub(" ", statement.strip())
+    return _PLACEHOLDER_LIST.sub("(?)", statement)
+
+
+class QueryCollector(object):
+    """Count the statements executed and the time spent in the database"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.shapes = Counter()
+
+    def record(self, statement, duration):
+        self.count += 1
+        self.duration += duration
+        self.shapes[statement_shape(statement)] += 1
+
+    def repeated(self, threshold):
+        """Return the (shape, count) pairs executed more than threshold times"""
+        return [(shape, count) for shape, count in self.shapes.most_common() if count > threshold]
+
+
+def _active_collectors():
+    collectors = list(getattr(_local, "collectors", ()))
+    if has_app_context():
+        collector = g.get("_query_collector")
+        if collector is not None:
+            collectors.append(collector)
+    return collectors
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # on the execution context, so a failing statement leaves nothing behind
+    context._query_start = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    duration = time.perf_counter() - context._query_start
+    for collector in _active_collectors():
+        collector.record(statement, duration)
+
+
+@contextmanager
+def count_queries():
+    """Collect the statements run by this thread inside the with block"""
+    collector = QueryCollector()
+    if not hasattr(_local, "collectors"):
+        _local.collectors = []
+    _local.collectors.append(collector)
+    try:
+        yield collector
+    finally:
+        _local.collectors.remove(collector)
+
+
+@contextmanager
+def assert_max_queries(limit):
+    """Fail if the with block runs more than limit statements
+
+    with assert_max_queries(3):
+        client.get("/admin/employees")
+    """
+    with count_queries() as collector:
+        yield collector
+    if collector.count > limit:
+        shapes = "\n".join(
+            "{0}x {1}".format(count, shape) for shape, count in collector.shapes.most_common()
+        )
+        raise AssertionError(
+            "{0} queries executed, expected at most {1}:\n{2}".format(
+                collector.count, limit, shapes
+            )
+        )
+
+
+def _start_collecting():
+    g._query_collector = QueryCollector()
+
+
+def _report(response):
+    collector = g.pop("_query_collector", None)
+    if collector is None:
+        return response
+
+    if current_app.config.get("SQL_SERVER_TIMING", True):
+        response.headers.add(
+            "Server-Timing",
+            'db;dur={0:.2f};desc="{1} queries"'.format(collector.duration * 1000, collector.count),
+        )
+
+    threshold = current_app.config.get("SQL_NPLUSONE_THRESHOLD")
+    if threshold is not None:
+        for shape, count in collector.repeated(threshold):
+            current_app.logger.warning(
+                "Possible N+1 query in %s: %d executions of %s", request.endpoint, count, shape
+            )
+    return response
+
+
+def init_app(app):
+    """Collect the SQL statements of every request of app"""
+    app.before_request(_start_collecting)
+    app.after_request(_report)
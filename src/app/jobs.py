@@ -0,0 +1,254 @@
+# app/jobs.py
+"""Background jobs queued in the database
+
+A view enqueues a job in its own transaction, so the job exists exactly
+when the writes of the view do, and returns without waiting for it.
+`flask worker` runs the jobs in threads, each claiming the next due job,
+running its task in an application context and storing the result. A
+failing job is retried after an exponential backoff until it has used
+its attempts. While a job runs its lock is renewed every JOB_HEARTBEAT
+seconds, a job whose worker died is claimed again once its lock is
+JOB_TIMEOUT seconds old. Nothing but the database is needed.
+"""
+
+import json
+import logging
+import os
+import random
+import socket
+import threading
+from datetime import timedelta
+
+from flask import current_app
+from sqlalchemy import and_
+from sqlalchemy import or_
+from sqlalchemy import select
+from sqlalchemy import update
+
+from app import db
+from app.models import Job
+from app.models import utcnow
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# due jobs read per claim, the ones taken meanwhile by others are skipped
+CLAIM_BATCH = 5
+
+logger = logging.getLogger(__name__)
+
+
+class UnknownTask(Exception):
+    """Raised for a job whose task is not registered"""
+
+
+class JobQueue(object):
+    """Registry of the tasks and operations on their queue"""
+
+    def __init__(self):
+        self.tasks = {}
+        self._local = threading.local()
+
+    def task(self, name, max_attempts=None):
+        """Register the decorated function as the task name
+
+        It is called with the payload of the job as keyword arguments
+        and returns a JSON serialisable result.
+        """
+
+        def register(func):
+            self.tasks[name] = (func, max_attempts)
+            return func
+
+        return register
+
+    def enqueue(self, name, delay=0, **payload):
+        """Add a job running task name to the session, the caller commits"""
+        if name not in self.tasks:
+            raise UnknownTask(name)
+        max_attempts = self.tasks[name][1] or current_app.config["JOB_MAX_ATTEMPTS"]
+        job = Job(
+            name=name,
+            payload=json.dumps(payload),
+            status=QUEUED,
+            max_attempts=max_attempts,
+            run_at=utcnow() + timedelta(seconds=delay),
+        )
+        db.session.add(job)
+        return job
+
+    def files_dir(self):
+        """Absolute directory of the files handed to jobs, created if missing
+
+        JOB_FILES_DIR is taken relative to the instance folder unless it
+        is absolute, so the web and worker processes agree on it whatever
+        their working directory. Payloads name files relative to it.
+        """
+        directory = os.path.join(current_app.instance_path, current_app.config["JOB_FILES_DIR"])
+        os.makedirs(directory, exist_ok=True)
+        return directory
+
+    def backoff(self, attempts):
+        """Seconds to wait before the next of attempts, with jitter"""
+        config = current_app.config
+        delay = min(config["JOB_BACKOFF_MAX"], config["JOB_BACKOFF"] * 2 ** (attempts - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    def claim(self, worker_id):
+        """Mark the next due job as run by worker_id and return it, or None"""
+        now = utcnow()
+        lost = now - timedelta(seconds=current_app.config["JOB_TIMEOUT"])
+        due = or_(
+            and_(Job.status == QUEUED, Job.run_at <= now),
+            and_(Job.status == RUNNING, Job.locked_at < lost),
+        )
+        candidates = db.session.scalars(
+            select(Job.id)
+            .where(due)
+            .order_by(Job.run_at, Job.id)
+            .limit(CLAIM_BATCH)
+            .with_for_update(skip_locked=True)
+        ).all()
+        for job_id in candidates:
+            # compare and set, SQLite has no row locks to skip
+            claimed = db.session.execute(
+                update(Job)
+                .where(Job.id == job_id, due)
+                .values(
+                    status=RUNNING, locked_at=now, locked_by=worker_id, attempts=Job.attempts + 1
+                )
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            if claimed:
+                db.session.commit()
+                return db.session.get(Job, job_id)
+        db.session.rollback()
+        return None
+
+    def last_attempt(self):
+        """Tell if the job running in this thread fails for good if it raises"""
+        return getattr(self._local, "last_attempt", False)
+
+    def heartbeat(self, app, job_id, worker_id, stopping):
+        """Renew the lock of a running job until stopping is set"""
+        while not stopping.wait(app.config["JOB_HEARTBEAT"]):
+            with app.app_context():
+                try:
+                    db.session.execute(
+                        update(Job)
+                        .where(Job.id == job_id, Job.status == RUNNING, Job.locked_by == worker_id)
+                        .values(locked_at=utcnow())
+                        .execution_options(synchronize_session=False)
+                    )
+                    db.session.commit()
+                except Exception:
+                    logger.exception("Cannot renew the lock of job %s", job_id)
+                    db.session.rollback()
+
+    def call(self, job):
+        """Call the task of job, renewing the lock of job meanwhile"""
+        if job.name not in self.tasks:
+            raise UnknownTask(job.name)
+        stopping = threading.Event()
+        beat = threading.Thread(
+            target=self.heartbeat,
+            args=(current_app._get_current_object(), job.id, job.locked_by, stopping),
+            name="job-heartbeat",
+            daemon=True,
+        )
+        beat.start()
+        self._local.last_attempt = job.attempts >= job.max_attempts
+        try:
+            return self.tasks[job.name][0](**json.loads(job.payload))
+        finally:
+            self._local.last_attempt = False
+            stopping.set()
+            beat.join()
+
+    def run(self, job):
+        """Run a claimed job and store its outcome"""
+        job_id = job.id
+        try:
+            result = self.call(job)
+        except Exception as exp:
+            db.session.rollback()
+            job = db.session.get(Job, job_id)
+            job.error = "{0}: {1}".format(type(exp).__name__, exp)
+            if job.attempts < job.max_attempts and not isinstance(exp, UnknownTask):
+                job.status = QUEUED
+                job.run_at = utcnow() + timedelta(seconds=self.backoff(job.attempts))
+                logger.warning("Job %s %s failed, retrying at %s", job.id, job.name, job.run_at)
+            else:
+                job.status = FAILED
+                job.finished_at = utcnow()
+                logger.exception("Job %s %s failed", job.id, job.name)
+        else:
+            job = db.session.get(Job, job_id)
+            job.status = DONE
+            job.result = json.dumps(result)
+            job.error = None
+            job.finished_at = utcnow()
+        job.locked_at = None
+        job.locked_by = None
+        db.session.commit()
+        return job
+
+
+jobs = JobQueue()
+
+
+class Worker(object):
+    """Threads claiming and running jobs until stopped
+
+    In burst mode every thread exits as soon as no job is due.
+    """
+
+    def __init__(self, app, concurrency=1, poll_interval=1.0, burst=False):
+        self.app = app
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.burst = burst
+        self.name = "{0}:{1}".format(socket.gethostname(), os.getpid())
+        self.stopping = threading.Event()
+
+    def work(self, worker_id):
+        while not self.stopping.is_set():
+            claimed = False
+            with self.app.app_context():
+                try:
+                    job = jobs.claim(worker_id)
+                    if job is not None:
+                        claimed = True
+                        jobs.run(job)
+                except Exception:
+                    logger.exception("Job worker %s failed", worker_id)
+                    db.session.rollback()
+            if not claimed:
+                if self.burst:
+                    return
+                self.stopping.wait(self.poll_interval)
+
+    def run(self):
+        threads = [
+            threading.Thread(
+                target=self.work, args=("{0}#{1}".format(self.name, index),), daemon=True
+            )
+            for index in range(self.concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                # join with a timeout, so that signals reach the main thread
+                while thread.is_alive():
+                    thread.join(0.5)
+        except KeyboardInterrupt:
+            self.stop()
+            for thread in threads:
+                thread.join()
+
+    def stop(self):
+        """Let the running jobs finish and claim no other"""
+        self.stopping.set()
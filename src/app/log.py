@@ -0,0 +1,211 @@
+# app/log.py
+"""Non-blocking structured logging
+
+Records are put on a bounded queue by the request thread and written as
+JSON lines by a background listener thread, so a slow disk or a file
+rotation never stalls a request. When the queue is full records are
+dropped and counted rather than waited for.
+"""
+
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import traceback
+import uuid
+from datetime import datetime
+from datetime import timezone
+from logging.handlers import QueueHandler
+from logging.handlers import QueueListener
+from logging.handlers import RotatingFileHandler
+
+from flask import g
+from flask import has_request_context
+from flask import request
+
+# attributes of every LogRecord, anything else was passed with extra=
+_RECORD_ATTRIBUTES = set(logging.makeLogRecord({}).__dict__) | {"message", "asctime"}
+
+
+class JSONFormatter(logging.Formatter):
+    """Format records as one JSON object per line"""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = "".join(traceback.format_exception(*record.exc_info))
+        return json.dumps(entry, default=str)
+
+
+class RequestFilter(logging.Filter):
+    """Tag records with the id of the request they were logged in"""
+
+    def filter(self, record):
+        if has_request_context() and "request_id" in g:
+            record.request_id = g.request_id
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keep only a share of the records below WARNING"""
+
+    def __init__(self, rate=1.0):
+        super(SamplingFilter, self).__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or self.rate >= 1 or random.random() < self.rate
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that never blocks and keeps records structured
+
+    The JSON formatting happens in the listener thread, only the message
+    arguments are merged here so that records stay picklable.
+    """
+
+    def __init__(self, log_queue):
+        super(DroppingQueueHandler, self).__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = "".join(traceback.format_exception(*record.exc_info))
+            record.exception = record.exc_text
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LazyRotatingFileHandler(RotatingFileHandler):
+    """RotatingFileHandler creating its directory with the first record"""
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.baseFilename), exist_ok=True)
+        return super(LazyRotatingFileHandler, self)._open()
+
+
+class LogPipeline(object):
+    """The queue handler attached to the app logger and its listener"""
+
+    def __init__(self, handlers, queue_size, sample_rate):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.handler = DroppingQueueHandler(self.queue)
+        self.handler.addFilter(RequestFilter())
+        self.handler.addFilter(SamplingFilter(sample_rate))
+        self.handlers = handlers
+        self.listener = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start the listener thread, again in every forked process"""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            if self._pid is not None:
+                # forked: the listener of the parent does not exist here and
+                # the queue locks may have been copied while held
+                self.queue = queue.Queue(maxsize=self.queue.maxsize)
+                self.handler.queue = self.queue
+            self.listener = QueueListener(self.queue, *self.handlers, respect_handler_level=True)
+            self.listener.start()
+            self._pid = os.getpid()
+
+    def stop(self):
+        with self._lock:
+            if self.listener is not None and self._pid == os.getpid():
+                self.listener.stop()
+            self._pid = None
+        for handler in self.handlers:
+            handler.close()
+
+
+_pipeline = None
+
+
+def after_fork():
+    """Start the listener of a forked worker before its first request"""
+    if _pipeline is not None:
+        _pipeline.start()
+
+
+def _start_request():
+    g.request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex
+    g.request_start = time.perf_counter()
+    _pipeline.start()
+
+
+def _log_request(response):
+    start = g.get("request_start")
+    if start is not None:
+        logging.getLogger("app.requests").info(
+            "%s %s %s",
+            request.method,
+            request.path,
+            response.status_code,
+            extra={
+                "method": request.method,
+                "path": request.path,
+                "endpoint": request.endpoint,
+                "status": response.status_code,
+                "duration_ms": round((time.perf_counter() - start) * 1000, 3),
+            },
+        )
+    response.headers["X-Request-ID"] = g.get("request_id", "")
+    return response
+
+
+def init_app(app):
+    """Send the logs of app through a queue to a rotating JSON lines file"""
+    global _pipeline
+
+    file_handler = LazyRotatingFileHandler(
+        os.path.join(app.config.get("LOG_DIR", "log"), app.config.get("LOG_FILE", "app.log")),
+        maxBytes=app.config.get("LOG_MAX_BYTES", 10 * 1024 * 1024),
+        backupCount=app.config.get("LOG_BACKUP_COUNT", 10),
+        delay=True,
+    )
+    file_handler.setFormatter(JSONFormatter())
+    file_handler.setLevel(logging.INFO)
+
+    # create_app may run several times in one process, e.g. in tests
+    if _pipeline is not None:
+        app.logger.removeHandler(_pipeline.handler)
+        logging.getLogger("app.requests").removeHandler(_pipeline.handler)
+        _pipeline.stop()
+    _pipeline = LogPipeline(
+        [file_handler],
+        queue_size=app.config.get("LOG_QUEUE_SIZE", 10000),
+        sample_rate=app.config.get("LOG_INFO_SAMPLE_RATE", 1.0),
+    )
+    _pipeline.start()
+
+    app.logger.addHandler(_pipeline.handler)
+    app.logger.setLevel(logging.INFO)
+    requests_logger = logging.getLogger("app.requests")
+    requests_logger.addHandler(_pipeline.handler)
+    requests_logger.setLevel(logging.INFO)
+    requests_logger.propagate = False
+
+    app.before_request(_start_request)
+    app.after_request(_log_request)
+    return _pipeline
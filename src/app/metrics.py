@@ -0,0 +1,113 @@
+# app/metrics.py
+"""Prometheus metrics of the HTTP requests served by the application
+
+prometheus_client is an optional dependency (pip install flask-test[metrics]).
+When PROMETHEUS_MULTIPROC_DIR is set, every gunicorn worker writes its
+samples there and /metrics aggregates the files of all workers.
+"""
+
+import hmac
+import os
+import time
+from types import ModuleType
+from typing import Optional
+
+from flask import Response
+from flask import abort
+from flask import current_app
+from flask import g
+from flask import request
+from flask_login import current_user
+
+prometheus_client: Optional[ModuleType]
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess
+except ImportError:  # pragma: no cover
+    prometheus_client = None
+
+if prometheus_client is not None:
+    REQUEST_LATENCY = prometheus_client.Histogram(
+        "http_request_duration_seconds",
+        "Time spent handling requests",
+        ["endpoint", "method"],
+        buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+    )
+    REQUESTS = prometheus_client.Counter(
+        "http_requests_total", "Requests handled", ["endpoint", "method", "status"]
+    )
+    RESPONSE_SIZE = prometheus_client.Histogram(
+        "http_response_size_bytes",
+        "Size of the response bodies",
+        ["endpoint"],
+        buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304),
+    )
+    IN_FLIGHT = prometheus_client.Gauge(
+        "http_requests_in_flight", "Requests being handled", multiprocess_mode="livesum"
+    )
+
+
+def _endpoint():
+    # unmatched urls share one label so that 404s cannot blow up cardinality
+    return request.endpoint or "unmatched"
+
+
+def _start_timer():
+    g._metrics_start = time.perf_counter()
+    IN_FLIGHT.inc()
+
+
+def _record(response):
+    start = g.get("_metrics_start")
+    if start is None:
+        return response
+    endpoint = _endpoint()
+    REQUEST_LATENCY.labels(endpoint, request.method).observe(time.perf_counter() - start)
+    REQUESTS.labels(endpoint, request.method, str(response.status_code)).inc()
+    if response.content_length is not None:
+        RESPONSE_SIZE.labels(endpoint).observe(response.content_length)
+    return response
+
+
+def _finish(exception):
+    if g.pop("_metrics_start", None) is not None:
+        IN_FLIGHT.dec()
+
+
+def check_access():
+    """Allow the bearer of METRICS_TOKEN, or a logged in admin if none is set"""
+    token = current_app.config.get("METRICS_TOKEN")
+    if token:
+        expected = "Bearer " + token
+        supplied = request.headers.get("Authorization", "")
+        if not hmac.compare_digest(supplied.encode(), expected.encode()):
+            abort(401)
+    elif not (current_user.is_authenticated and current_user.is_admin):
+        abort(403)
+
+
+def metrics():
+    """Expose the metrics of every worker in the text exposition format"""
+    check_access()
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return Response(
+        prometheus_client.generate_latest(registry),
+        mimetype=prometheus_client.CONTENT_TYPE_LATEST,
+    )
+
+
+def init_app(app):
+    """Record the requests of app and serve them on /metrics"""
+    if not app.config.get("METRICS_ENABLED", True):
+        return
+    if prometheus_client is None:
+        app.logger.info("prometheus_client is not installed, /metrics is disabled")
+        return
+    app.before_request(_start_timer)
+    app.after_request(_record)
+    app.teardown_request(_finish)
+    app.add_url_rule("/metrics", "metrics", metrics)
@@ -1,24 +1,67 @@
+import json
+from datetime import datetime
+from datetime import timezone
+
 from flask_login import UserMixin
-from werkzeug.security import check_password_hash
-from werkzeug.security import generate_password_hash
+from sqlalchemy import event
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from sqlalchemy.orm import declared_attr
+from sqlalchemy.orm import object_session
 
 from app import db
 from app import login_manager
+from app.cache import LRUCache
+from app.database import replica_reads
+from app.passwords import hasher
+
+# per process cache of the principals returned by load_user
+principals = LRUCache()
+
+
+def utcnow():
+    """Naive UTC timestamp, the way timestamps are stored"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class VersionMixin(object):
+    """Row version counter and modification time
+
+    The version is bumped by SQLAlchemy on every UPDATE and checked in its
+    WHERE clause, so concurrent writers cannot silently overwrite each
+    other. Statements bypassing the ORM must bump it themselves.
+    """
+
+    version = db.Column(db.Integer, nullable=False, server_default="1")
+    updated_at = db.Column(db.DateTime, default=utcnow, onupdate=utcnow)
 
+    @declared_attr.directive
+    def __mapper_args__(cls):
+        return {"version_id_col": cls.__table__.c.version}
 
-class Employee(UserMixin, db.Model):
+    @property
+    def etag(self):
+        return "{0}-{1}-{2}".format(self.__tablename__, self.id, self.version)
+
+
+class Employee(VersionMixin, UserMixin, db.Model):
     """Create and Employee table"""
 
     __tablename__ = "employees"
+    # (column, id) indexes serve the keyset pagination of the listing
+    __table_args__ = tuple(
+        db.Index("ix_employees_{0}_id".format(name), name, "id")
+        for name in ("email", "username", "first_name", "last_name")
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(60), index=True, unique=True)
     username = db.Column(db.String(60), index=True, unique=True)
-    first_name = db.Column(db.String(60), index=True)
-    last_name = db.Column(db.String(60), index=True)
-    password_hash = db.Column(db.String(128))
-    department_id = db.Column(db.Integer, db.ForeignKey("departments.id"))
-    role_id = db.Column(db.Integer, db.ForeignKey("roles.id"))
+    first_name = db.Column(db.String(60))
+    last_name = db.Column(db.String(60))
+    password_hash = db.Column(db.String(256))
+    department_id = db.Column(db.Integer, db.ForeignKey("departments.id", ondelete="SET NULL"))
+    role_id = db.Column(db.Integer, db.ForeignKey("roles.id", ondelete="SET NULL"))
     is_admin = db.Column(db.Boolean, default=False)
 
     @property
@@ -30,22 +73,120 @@ class Employee(UserMixin, db.Model):
     @password.setter
     def password(self, password):
         """Set password to a hashed password"""
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hasher.hash(password)
 
     def verify_password(self, password):
         """Check if hashed password matches actual password"""
-        return check_password_hash(self.password_hash, password)
+        return hasher.verify(self.password_hash, password)
+
+    def password_needs_rehash(self):
+        """Check if the password was hashed with an outdated method or cost"""
+        return hasher.needs_rehash(self.password_hash)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "email": self.email,
+            "username": self.username,
+            "first_name": self.first_name,
+            "last_name": self.last_name,
+            "department_id": self.department_id,
+            "role_id": self.role_id,
+            "is_admin": bool(self.is_admin),
+            "version": self.version,
+        }
 
     def __repr__(self):
         return "<Employee: {0}>".format(self.username)
 
 
+class Principal(UserMixin):
+    """Lightweight stand-in for an Employee used as current_user"""
+
+    def __init__(self, id, username, is_admin, department_id, role_id):
+        self.id = id
+        self.username = username
+        self.is_admin = bool(is_admin)
+        self.department_id = department_id
+        self.role_id = role_id
+
+    def __repr__(self):
+        return "<Principal: {0}>".format(self.username)
+
+
+def _query_principal(user_id):
+    row = (
+        db.session.query(
+            Employee.id,
+            Employee.username,
+            Employee.is_admin,
+            Employee.department_id,
+            Employee.role_id,
+        )
+        .filter(Employee.id == user_id)
+        .first()
+    )
+    return Principal(*row) if row is not None else None
+
+
 @login_manager.user_loader
 def load_user(user_id):
-    return Employee.query.get(int(user_id))
+    user_id = int(user_id)
+    with replica_reads():
+        return principals.get_or_set(user_id, lambda: _query_principal(user_id))
+
+
+def invalidate_principals(session, ids=None):
+    """Drop the cached principals of ids, or all of them, once session commits
+
+    Dropping them earlier would let a concurrent load_user cache the row
+    as it was before the commit for the whole TTL.
+    """
+    if ids is None:
+        session.info["stale_principals"] = None
+    elif session.info.get("stale_principals", ()) is not None:
+        session.info.setdefault("stale_principals", set()).update(ids)
+
+
+@event.listens_for(Employee, "after_insert")
+@event.listens_for(Employee, "after_update")
+@event.listens_for(Employee, "after_delete")
+def invalidate_principal(mapper, connection, target):
+    """Drop the cached principal whenever an employee row is written"""
+    invalidate_principals(object_session(target), [target.id])
+
+
+@event.listens_for(Session, "after_commit")
+def _drop_stale_principals(session):
+    stale = session.info.pop("stale_principals", ())
+    if stale is None:
+        principals.clear()
+    for user_id in stale or ():
+        principals.invalidate(user_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _keep_principals(session):
+    session.info.pop("stale_principals", None)
+
+
+class HeadcountMixin(object):
+    """Adds a grouped headcount query to tables referenced by employees"""
 
+    @classmethod
+    def with_headcount(cls):
+        """Return (row, number of employees) pairs using a single query"""
+        foreign_key = getattr(Employee, cls.__name__.lower() + "_id")
+        return (
+            db.session.query(cls, func.count(Employee.id))
+            .outerjoin(Employee, foreign_key == cls.id)
+            .group_by(cls.id)
+            .order_by(cls.id)
+            .all()
+        )
 
-class Department(db.Model):
+
+class Department(VersionMixin, HeadcountMixin, db.Model):
     """Create a Department table"""
 
     __tablename__ = "departments"
@@ -53,13 +194,24 @@ class Department(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(60), unique=True)
     description = db.Column(db.String(200))
-    employees = db.relationship("Employee", backref="department", lazy="dynamic")
+    # the database unassigns the employees of a deleted department
+    employees = db.relationship(
+        "Employee", backref="department", lazy="dynamic", passive_deletes=True
+    )
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "description": self.description,
+            "version": self.version,
+        }
 
     def __repr__(self):
         return "<Department: {0}>".format(self.name)
 
 
-class Role(db.Model):
+class Role(VersionMixin, HeadcountMixin, db.Model):
     """Create a Role table"""
 
     __tablename__ = "roles"
@@ -67,7 +219,99 @@ class Role(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(60), unique=True)
     description = db.Column(db.String(200))
-    employees = db.relationship("Employee", backref="role", lazy="dynamic")
+    employees = db.relationship("Employee", backref="role", lazy="dynamic", passive_deletes=True)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "description": self.description,
+            "version": self.version,
+        }
 
     def __repr__(self):
         return "<Role: {0}>".format(self.name)
+
+
+# tables whose changes are counted in table_versions, see app/changes.py
+VERSIONED_TABLES = ("departments", "employees", "roles")
+
+
+class TableVersion(db.Model):
+    """Change counter of a table, bumped by every transaction writing to it"""
+
+    __tablename__ = "table_versions"
+
+    name = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, server_default="0")
+
+    def __repr__(self):
+        return "<TableVersion: {0}={1}>".format(self.name, self.version)
+
+
+@event.listens_for(TableVersion.__table__, "after_create")
+def _seed_table_versions(target, connection, **kwargs):
+    connection.execute(target.insert(), [{"name": name} for name in VERSIONED_TABLES])
+
+
+class HeadcountStat(db.Model):
+    """Number of employees of a department or role, kept up to date by app/stats.py
+
+    Admins are not counted, they are never assigned. group_id 0 counts
+    the employees without a department or without a role.
+    """
+
+    __tablename__ = "headcount_stats"
+
+    dimension = db.Column(db.String(16), primary_key=True)
+    group_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    headcount = db.Column(db.Integer, nullable=False, server_default="0")
+
+    def __repr__(self):
+        return "<HeadcountStat: {0} {1}={2}>".format(self.dimension, self.group_id, self.headcount)
+
+
+@event.listens_for(HeadcountStat.__table__, "after_create")
+def _seed_headcount_stats(target, connection, **kwargs):
+    connection.execute(
+        target.insert(),
+        [{"dimension": "department", "group_id": 0}, {"dimension": "role", "group_id": 0}],
+    )
+
+
+class Job(db.Model):
+    """Background job of the queue run by `flask worker`, see app/jobs.py"""
+
+    __tablename__ = "jobs"
+    __table_args__ = (db.Index("ix_jobs_status_run_at", "status", "run_at"),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(64), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default="{}")
+    status = db.Column(db.String(16), nullable=False, default="queued")
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    run_at = db.Column(db.DateTime, nullable=False, default=utcnow)
+    locked_at = db.Column(db.DateTime)
+    locked_by = db.Column(db.String(64))
+    result = db.Column(db.Text)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, default=utcnow)
+    finished_at = db.Column(db.DateTime)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "status": self.status,
+            "attempts": self.attempts,
+            "max_attempts": self.max_attempts,
+            "run_at": self.run_at.isoformat() if self.run_at else None,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+            "result": json.loads(self.result) if self.result else None,
+            "error": self.error,
+        }
+
+    def __repr__(self):
+        return "<Job: {0} {1} {2}>".format(self.id, self.name, self.status)
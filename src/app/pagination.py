@@ -0,0 +1,128 @@
+# app/pagination.py
+"""Keyset (seek) pagination helpers"""
+
+import base64
+import binascii
+import json
+
+from sqlalchemy import and_
+from sqlalchemy import tuple_
+
+
+class InvalidCursor(ValueError):
+    """Raised when a pagination cursor cannot be decoded"""
+
+
+def encode_cursor(value, row_id):
+    """Pack the sort value and the id of a row into an opaque url-safe token"""
+    raw = json.dumps([value, row_id], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token):
+    """Unpack a token created by encode_cursor into (value, id)"""
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        value, row_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except (binascii.Error, UnicodeError, ValueError, TypeError) as exp:
+        raise InvalidCursor(token) from exp
+    if not isinstance(row_id, int):
+        raise InvalidCursor(token)
+    return value, row_id
+
+
+def _segments(column, id_column, value, row_id, descending):
+    """Return the (WHERE clause, ORDER BY) parts holding the rows after (value, row_id)
+
+    Rows are ordered by column and then id, with NULLs sorted last on
+    ascending and first on descending order (the PostgreSQL default). Rows
+    with a value are sought with a range on the (column, id) index, the
+    NULL rows are queried apart instead of being ORed into that range,
+    which would keep the database from walking the index.
+    """
+    order = _order(column, id_column, descending)
+    if value is None:
+        if descending:
+            nulls = (and_(column.is_(None), id_column < row_id), (id_column.desc(),))
+            return [nulls, (column.isnot(None), order)]
+        return [(and_(column.is_(None), id_column > row_id), (id_column.asc(),))]
+    if descending:
+        return [(and_(column <= value, tuple_(column, id_column) < (value, row_id)), order)]
+    segments = [(and_(column >= value, tuple_(column, id_column) > (value, row_id)), order)]
+    if column.nullable:
+        segments.append((column.is_(None), (id_column.asc(),)))
+    return segments
+
+
+def _order(column, id_column, descending):
+    if descending:
+        return column.desc().nulls_first(), id_column.desc()
+    return column.asc().nulls_last(), id_column.asc()
+
+
+class KeysetPage(object):
+    """One page of a keyset paginated query"""
+
+    def __init__(self, items, per_page, has_next, has_prev, key):
+        self.items = items
+        self.per_page = per_page
+        self.has_next = has_next
+        self.has_prev = has_prev
+        self._key = key
+
+    @property
+    def next_cursor(self):
+        if not self.has_next or not self.items:
+            return None
+        return encode_cursor(*self._key(self.items[-1]))
+
+    @property
+    def prev_cursor(self):
+        if not self.has_prev or not self.items:
+            return None
+        return encode_cursor(*self._key(self.items[0]))
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def keyset_paginate(query, column, id_column, per_page, after=None, before=None, descending=False):
+    """Return a KeysetPage of query sorted by (column, id_column)
+
+    `after` and `before` are cursors taken from a previous page. Only one
+    of them should be given; `before` walks the index backwards and the
+    rows are reversed afterwards so they keep the requested order.
+    """
+    backwards = before is not None
+    cursor = before if backwards else after
+    direction = descending != backwards
+
+    if cursor is None:
+        segments = [(None, _order(column, id_column, direction))]
+    else:
+        segments = _segments(column, id_column, *decode_cursor(cursor), direction)
+
+    rows = []
+    for where, order in segments:
+        segment = query if where is None else query.filter(where)
+        rows.extend(segment.order_by(*order).limit(per_page + 1 - len(rows)).all())
+        if len(rows) > per_page:
+            break
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+
+    def key(item):
+        return getattr(item, column.key), getattr(item, id_column.key)
+
+    return KeysetPage(
+        rows,
+        per_page,
+        has_next=more if not backwards else True,
+        has_prev=more if backwards else cursor is not None,
+        key=key,
+    )
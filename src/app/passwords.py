@@ -0,0 +1,80 @@
+# app/passwords.py
+"""Password hashing in a bounded worker pool"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import check_password_hash
+from werkzeug.security import generate_password_hash
+
+
+class PasswordHasher(object):
+    """Run werkzeug's password hashing on a fixed number of threads
+
+    scrypt and pbkdf2 release the GIL, so the pool hashes in parallel while
+    capping how many CPU bound hashes a worker runs at once; requests over
+    the cap wait for a free thread instead of starving the others.
+    """
+
+    def __init__(self, method="scrypt:32768:8:1", workers=2):
+        self.method = method
+        self.workers = workers
+        self._executor = None
+        self._pid = None
+        self._prefix = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.method = app.config.get("PASSWORD_HASH_METHOD", self.method)
+        self.workers = app.config.get("PASSWORD_HASH_WORKERS", self.workers)
+        self._prefix = self._probe(self.method)
+        self.shutdown()
+
+    @staticmethod
+    def _probe(method):
+        # werkzeug completes a bare method such as "scrypt" with its default
+        # cost, the prefix of a real hash is what stored hashes must match
+        return generate_password_hash("", method).split("$", 1)[0]
+
+    def _pool(self):
+        # threads do not survive a fork, so every process gets its own pool
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="password-hash"
+                )
+                self._pid = os.getpid()
+            return self._executor
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def hash(self, password):
+        """Hash password with the configured method"""
+        return self._pool().submit(generate_password_hash, password, self.method).result()
+
+    def hash_many(self, passwords):
+        """Hash a batch of passwords using every thread of the pool"""
+        method = self.method
+        return list(
+            self._pool().map(lambda password: generate_password_hash(password, method), passwords)
+        )
+
+    def verify(self, pwhash, password):
+        """Check password against pwhash"""
+        if not pwhash:
+            return False
+        return self._pool().submit(check_password_hash, pwhash, password).result()
+
+    def needs_rehash(self, pwhash):
+        """Tell if pwhash was made with another method or cost than configured"""
+        if self._prefix is None:
+            self._prefix = self._probe(self.method)
+        return pwhash.split("$", 1)[0] != self._prefix
+
+
+hasher = PasswordHasher()
@@ -0,0 +1,91 @@
+# app/refdata.py
+"""Versioned in-process cache of departments and roles"""
+
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app import db
+from app.models import Department
+from app.models import Role
+
+MODELS = (Department, Role)
+
+
+class ReferenceData(object):
+    """Cache the (id, name) pairs of small lookup tables
+
+    Every write to a cached table made through the ORM bumps the version
+    once its transaction commits, which drops the cached rows of this
+    process. The TTL bounds how long writes made by other processes stay
+    invisible.
+    """
+
+    def __init__(self, ttl=30):
+        self.ttl = ttl
+        self.version = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.ttl = app.config.get("REFERENCE_DATA_TTL", self.ttl)
+        self.invalidate()
+
+    def _load(self, model):
+        with self._lock:
+            entry = self._entries.get(model)
+            if entry is not None and entry[0] == self.version and entry[1] > time.monotonic():
+                return entry
+            version = self.version
+
+        rows = db.session.query(model.id, model.name).order_by(model.name, model.id).all()
+        choices = [(row_id, name) for row_id, name in rows]
+        entry = (version, time.monotonic() + self.ttl, choices, frozenset(dict(choices)))
+        with self._lock:
+            # a write committed while loading makes this result stale already
+            if version == self.version:
+                self._entries[model] = entry
+        return entry
+
+    def choices(self, model):
+        """Return the (id, name) pairs of model ordered by name"""
+        return self._load(model)[2]
+
+    def contains(self, model, row_id):
+        """Tell if row_id exists, reloading once before saying no"""
+        if row_id in self._load(model)[3]:
+            return True
+        self.invalidate(model)
+        return row_id in self._load(model)[3]
+
+    def invalidate(self, model=None):
+        with self._lock:
+            self.version += 1
+            if model is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(model, None)
+
+
+refdata = ReferenceData()
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_changes(session, flush_context):
+    changed = session.info.setdefault("refdata_changed", set())
+    for instance in session.new | session.dirty | session.deleted:
+        if isinstance(instance, MODELS):
+            changed.add(type(instance))
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_changes(session):
+    for model in session.info.pop("refdata_changed", ()):
+        refdata.invalidate(model)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_changes(session):
+    session.info.pop("refdata_changed", None)
@@ -0,0 +1,95 @@
+# app/search.py
+"""Employee search by name, username and email
+
+Prefix matches come first: one ordered index range scan per column,
+each stopping after limit rows, so their cost does not grow with the
+table. On PostgreSQL the remaining places are filled with fuzzy matches
+through the pg_trgm word similarity of SEARCH_TEXT. Elsewhere they are
+filled with substring matches. The indexes are created by migration
+d5a9b3c7f214 on PostgreSQL only.
+"""
+
+from sqlalchemy import func
+from sqlalchemy import literal_column
+from sqlalchemy import select
+from sqlalchemy import union_all
+
+from app import db
+from app.models import Employee
+
+SEARCH_COLUMNS = (Employee.first_name, Employee.last_name, Employee.username, Employee.email)
+
+# must stay identical to the expression of ix_employees_search_trgm, with
+# literals rather than bound parameters so the planner can match it
+SEARCH_TEXT = func.lower(
+    func.coalesce(Employee.first_name, literal_column("''"))
+    .op("||")(literal_column("' '"))
+    .op("||")(func.coalesce(Employee.last_name, literal_column("''")))
+    .op("||")(literal_column("' '"))
+    .op("||")(func.coalesce(Employee.username, literal_column("''")))
+    .op("||")(literal_column("' '"))
+    .op("||")(func.coalesce(Employee.email, literal_column("''")))
+)
+
+# shortest term worth a trigram lookup
+FUZZY_MIN_LENGTH = 3
+
+
+def _escape_like(term):
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _prefix_ids(term, limit, postgresql):
+    pattern = _escape_like(term) + "%"
+    scans = []
+    for column in SEARCH_COLUMNS:
+        lowered = func.lower(column)
+        if postgresql:
+            # the C collation of ix_employees_<column>_prefix serves both
+            # the LIKE range and the ORDER BY, so each scan stops at limit
+            lowered = lowered.collate("C")
+        scan = (
+            select(Employee.id)
+            .where(lowered.like(pattern, escape="\\"))
+            .order_by(lowered)
+            .limit(limit)
+            .subquery()
+        )
+        scans.append(select(scan.c.id))
+    return [row_id for (row_id,) in db.session.execute(union_all(*scans))]
+
+
+def search_employees(term, limit=10, options=()):
+    """Return up to limit employees matching term, best matches first
+
+    options are loader options of the employee query, e.g. joinedload.
+    """
+    term = (term or "").strip().lower()
+    if not term:
+        return []
+
+    postgresql = db.session.get_bind().dialect.name == "postgresql"
+    ids = list(dict.fromkeys(_prefix_ids(term, limit, postgresql)))
+    results = []
+    if ids:
+        results = (
+            Employee.query.options(*options)
+            .filter(Employee.id.in_(ids))
+            .order_by(Employee.last_name, Employee.first_name, Employee.id)
+            .limit(limit)
+            .all()
+        )
+    if len(results) >= limit or len(term) < FUZZY_MIN_LENGTH:
+        return results
+
+    query = Employee.query.options(*options)
+    if ids:
+        query = query.filter(Employee.id.not_in(ids))
+    if postgresql:
+        query = query.filter(SEARCH_TEXT.op("%>")(term)).order_by(
+            func.word_similarity(term, SEARCH_TEXT).desc(), Employee.id
+        )
+    else:
+        pattern = "%" + _escape_like(term) + "%"
+        query = query.filter(SEARCH_TEXT.like(pattern, escape="\\")).order_by(Employee.id)
+    return results + query.limit(limit - len(results)).all()
@@ -0,0 +1,206 @@
+# app/seed.py
+"""Synthetic departments, roles and employees for realistic table sizes"""
+
+import csv
+import io
+import random
+from itertools import accumulate
+
+from sqlalchemy import func
+from sqlalchemy import insert
+from sqlalchemy import select
+
+from app import changes
+from app import db
+from app import stats
+from app.models import Department
+from app.models import Employee
+from app.models import Role
+from app.models import utcnow
+from app.passwords import hasher
+
+DEPARTMENTS = (
+    "Engineering",
+    "Sales",
+    "Support",
+    "Operations",
+    "Marketing",
+    "Finance",
+    "Human Resources",
+    "Legal",
+    "Research",
+    "Logistics",
+)
+ROLES = (
+    "Associate",
+    "Engineer",
+    "Analyst",
+    "Manager",
+    "Specialist",
+    "Consultant",
+    "Coordinator",
+    "Director",
+)
+FIRST_NAMES = (
+    "James Mary John Patricia Robert Jennifer Michael Linda David Elizabeth William Barbara "
+    "Richard Susan Joseph Jessica Thomas Sarah Charles Karen Amir Fatima Wei Mei Hiroshi Yuki "
+    "Carlos Sofia Lucas Ana Ivan Olga Kwame Amara Raj Priya Noah Emma Liam Olivia"
+).split()
+LAST_NAMES = (
+    "Smith Johnson Williams Brown Jones Garcia Miller Davis Rodriguez Martinez Hernandez Lopez "
+    "Gonzalez Wilson Anderson Thomas Taylor Moore Jackson Martin Lee Perez Thompson White Harris "
+    "Nguyen Kim Chen Wang Singh Patel Kumar Ivanov Muller Rossi Silva Mensah Okafor Sato Tanaka"
+).split()
+COLUMNS = (
+    "email",
+    "username",
+    "first_name",
+    "last_name",
+    "password_hash",
+    "department_id",
+    "role_id",
+    "is_admin",
+    "updated_at",
+)
+
+
+def zipf_weights(count, skew):
+    """Cumulative weights of count groups, the k-th being 1 / k ** skew"""
+    return list(accumulate(1.0 / rank**skew for rank in range(1, count + 1)))
+
+
+def group_names(bases, count, taken):
+    """count names cycling through bases, numbered after the first round"""
+    names = []
+    index = 0
+    while len(names) < count:
+        base = bases[index % len(bases)]
+        name = base if index < len(bases) else "{0} {1}".format(base, index // len(bases) + 1)
+        if name not in taken:
+            names.append(name)
+        index += 1
+    return names
+
+
+class Seeder(object):
+    """Insert generated rows in large batches, reproducibly from seed
+
+    Employees are spread over departments and roles with a Zipf skew, the
+    first groups holding most of them, and a share left unassigned. Every
+    account gets the same password, hashed once. On PostgreSQL with
+    psycopg2 each batch is loaded with COPY, elsewhere with one executemany
+    INSERT. Batches are committed one by one and the dashboard statistics
+    are rebuilt at the end, as the rows never go through the ORM.
+    """
+
+    def __init__(self, seed=0, skew=1.1, unassigned=0.02, password="password", batch_size=50000):
+        self.random = random.Random(seed)
+        self.skew = skew
+        self.unassigned = unassigned
+        self.batch_size = batch_size
+        self.password_hash = hasher.hash(password)
+        self.departments = []
+        self.roles = []
+        self.weights = ([], [])
+        self.now = utcnow()
+
+    def groups(self, departments, roles):
+        """Insert the departments and roles employees are spread over"""
+        self.departments = self._groups(Department, DEPARTMENTS, departments)
+        self.roles = self._groups(Role, ROLES, roles)
+        self.weights = (
+            zipf_weights(len(self.departments), self.skew),
+            zipf_weights(len(self.roles), self.skew),
+        )
+
+    def accounts(self, admin=None, user=None):
+        """Create the admin and regular user account of the load test if missing"""
+        rows = []
+        for username, is_admin in ((admin, True), (user, False)):
+            if username and not db.session.scalar(
+                select(Employee.id).where(Employee.username == username)
+            ):
+                row = self._row(username, "Load", "Test")
+                if is_admin:
+                    row.update(department_id=None, role_id=None, is_admin=True)
+                rows.append(row)
+        if rows:
+            self._insert(rows)
+            db.session.commit()
+        return len(rows)
+
+    def employees(self, count):
+        """Insert count employees, yielding the number inserted after each batch"""
+        start = db.session.scalar(select(func.max(Employee.id))) or 0
+        inserted = 0
+        while inserted < count:
+            size = min(self.batch_size, count - inserted)
+            rows = []
+            for number in range(start + inserted + 1, start + inserted + size + 1):
+                first = self.random.choice(FIRST_NAMES)
+                last = self.random.choice(LAST_NAMES)
+                rows.append(
+                    self._row("{0}.{1}{2}".format(first, last, number).lower(), first, last)
+                )
+            self._insert(rows)
+            db.session.commit()
+            inserted += size
+            yield inserted
+
+    def rebuild_stats(self):
+        """Recount the statistics of the dashboard, return the employees counted"""
+        counted = stats.rebuild(db.session)
+        db.session.commit()
+        return counted
+
+    def _pick(self, ids, weights):
+        if not ids or self.random.random() < self.unassigned:
+            return None
+        return self.random.choices(ids, cum_weights=weights)[0]
+
+    def _groups(self, model, bases, count):
+        taken = set(db.session.scalars(select(model.name)))
+        names = group_names(bases, count, taken)
+        if names:
+            db.session.execute(
+                insert(model.__table__),
+                [{"name": name, "description": "{0} (seeded)".format(name)} for name in names],
+            )
+        ids = dict(
+            db.session.execute(select(model.name, model.id).where(model.name.in_(names))).all()
+        )
+        db.session.commit()
+        return [ids[name] for name in names]
+
+    def _row(self, username, first_name, last_name):
+        return {
+            "email": "{0}@example.com".format(username),
+            "username": username,
+            "first_name": first_name,
+            "last_name": last_name,
+            "password_hash": self.password_hash,
+            "department_id": self._pick(self.departments, self.weights[0]),
+            "role_id": self._pick(self.roles, self.weights[1]),
+            "is_admin": False,
+            "updated_at": self.now,
+        }
+
+    def _insert(self, rows):
+        connection = db.session.connection()
+        if connection.dialect.driver != "psycopg2":
+            db.session.execute(insert(Employee.__table__), rows)
+            return
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow(["" if row[name] is None else row[name] for name in COLUMNS])
+        buffer.seek(0)
+        cursor = connection.connection.cursor()
+        try:
+            cursor.copy_expert(
+                "COPY employees ({0}) FROM STDIN WITH (FORMAT csv)".format(", ".join(COLUMNS)),
+                buffer,
+            )
+        finally:
+            cursor.close()
+        changes.mark_changed(db.session, "employees")
@@ -0,0 +1,51 @@
+# app/startup.py
+"""Startup profiler of create_app
+
+Run with FLASK_STARTUP_PROFILE=1 to log how long every step of
+create_app took, including the imports it makes. The steps are kept in
+app.extensions["startup_profile"] either way, empty when disabled.
+benchmarks/startup.py adds the import of the package itself, for a
+per-module breakdown use python -X importtime.
+"""
+
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+
+def enabled():
+    return os.getenv("FLASK_STARTUP_PROFILE", "").lower() in ("1", "true", "yes", "on")
+
+
+class StartupProfile(object):
+    """Durations, in milliseconds, of the named steps of the startup"""
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.steps = []
+        self._start = time.perf_counter()
+
+    def add(self, name, milliseconds):
+        if self.enabled:
+            self.steps.append((name, milliseconds))
+
+    @contextmanager
+    def step(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, (time.perf_counter() - start) * 1000)
+
+    def report(self, logger):
+        if not self.enabled:
+            return
+        total = (time.perf_counter() - self._start) * 1000
+        lines = ["{0:<24} {1:8.1f} ms".format(name, ms) for name, ms in self.steps]
+        logger.info(
+            "Startup profile, create_app took %.1f ms, %d modules loaded\n%s",
+            total,
+            len(sys.modules),
+            "\n".join(lines),
+        )
@@ -0,0 +1,51 @@
+// Headcount charts of the admin dashboard, drawn with d3 from
+// <div id="headcount-stats" data-url="url"> and its .headcount-chart children
+$(function () {
+  var container = d3.select("#headcount-stats");
+  if (container.empty()) {
+    return;
+  }
+
+  function draw(element, rows) {
+    var barHeight = 24;
+    var labelWidth = 160;
+    var width = Math.max(element.node().getBoundingClientRect().width, 320) - labelWidth - 40;
+    var x = d3.scaleLinear()
+      .domain([0, d3.max(rows, function (row) { return row.headcount; }) || 1])
+      .range([0, width]);
+
+    element.selectAll("*").remove();
+    var svg = element.append("svg")
+      .attr("width", labelWidth + width + 40)
+      .attr("height", rows.length * barHeight);
+    var bars = svg.selectAll("g").data(rows).enter().append("g")
+      .attr("transform", function (row, index) { return "translate(0," + index * barHeight + ")"; });
+
+    bars.append("text")
+      .attr("x", labelWidth - 6).attr("y", barHeight / 2).attr("dy", "0.35em")
+      .attr("text-anchor", "end")
+      .text(function (row) { return row.name; });
+    bars.append("rect")
+      .attr("x", labelWidth).attr("y", 2)
+      .attr("height", barHeight - 4)
+      .attr("width", function (row) { return x(row.headcount); })
+      .attr("fill", function (row) { return row.id === null ? "#999" : "#337ab7"; });
+    bars.append("text")
+      .attr("x", function (row) { return labelWidth + x(row.headcount) + 4; })
+      .attr("y", barHeight / 2).attr("dy", "0.35em")
+      .text(function (row) { return row.headcount; });
+  }
+
+  d3.json(container.attr("data-url"), function (error, stats) {
+    if (error) {
+      container.append("p").attr("class", "text-danger").text("The statistics could not be loaded.");
+      return;
+    }
+    container.selectAll(".headcount-chart").each(function () {
+      var element = d3.select(this);
+      var rows = stats[element.attr("data-series")].slice();
+      rows.push({id: null, name: "Unassigned", headcount: stats.unassigned[element.attr("data-unassigned")]});
+      draw(element, rows);
+    });
+  });
+});
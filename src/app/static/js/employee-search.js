@@ -0,0 +1,38 @@
+// Autocomplete of the employee search box: <input data-autocomplete="url">
+$(function () {
+  $("input[data-autocomplete]").each(function () {
+    var input = $(this);
+    var menu = $('<ul class="dropdown-menu"></ul>').insertAfter(input);
+    var timer = null;
+    var pending = null;
+
+    function show(employees) {
+      menu.empty();
+      $.each(employees, function (index, employee) {
+        var label = (employee.name || employee.username) + " (" + employee.email + ")";
+        $("<li></li>").append($("<a></a>").attr("href", employee.url).text(label)).appendTo(menu);
+      });
+      menu.toggle(employees.length > 0);
+    }
+
+    input.on("input", function () {
+      clearTimeout(timer);
+      var term = $.trim(input.val());
+      if (!term) {
+        show([]);
+        return;
+      }
+      // wait for a pause in typing and drop answers to older terms
+      timer = setTimeout(function () {
+        if (pending) {
+          pending.abort();
+        }
+        pending = $.getJSON(input.data("autocomplete"), { q: term }).done(show);
+      }, 150);
+    });
+
+    input.on("blur", function () {
+      setTimeout(function () { menu.hide(); }, 200);
+    });
+  });
+});
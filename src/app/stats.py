@@ -0,0 +1,240 @@
+# app/stats.py
+"""Headcount statistics of the admin dashboard
+
+headcount_stats holds one counter per department, per role and for the
+employees missing either, so the dashboard never scans employees. The
+counters are adjusted in the transaction moving an employee: flushes of
+Employee, Department and Role objects are tracked here, bulk statements
+bypassing the ORM report what they wrote with apply(). rebuild()
+recomputes everything from employees, e.g. after fixing rows by hand.
+"""
+
+from collections import Counter
+
+from sqlalchemy import and_
+from sqlalchemy import bindparam
+from sqlalchemy import delete
+from sqlalchemy import event
+from sqlalchemy import func
+from sqlalchemy import insert
+from sqlalchemy import inspect
+from sqlalchemy import select
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+from sqlalchemy.orm import object_session
+
+from app import db
+from app.cache import LRUCache
+from app.changes import table_versions
+from app.jobs import jobs
+from app.models import Department
+from app.models import Employee
+from app.models import HeadcountStat
+from app.models import Role
+
+UNASSIGNED = 0
+DIMENSIONS = (("department", Department), ("role", Role))
+
+# the employee attributes deciding which counters an employee is in
+TRACKED = ("department_id", "role_id", "is_admin")
+
+# per process cache of summary(), keyed on the versions of its tables
+summaries = LRUCache(maxsize=16)
+
+
+def groups(department_id, role_id, is_admin=False):
+    """Return the (dimension, group_id) counters an employee counts in"""
+    if is_admin:
+        return ()
+    return (("department", department_id or UNASSIGNED), ("role", role_id or UNASSIGNED))
+
+
+def count(rows):
+    """Return the deltas of inserting rows, dicts of employees table values"""
+    deltas = Counter()
+    for row in rows:
+        deltas.update(groups(row.get("department_id"), row.get("role_id"), row.get("is_admin")))
+    return deltas
+
+
+def apply(session, deltas):
+    """Add deltas, a Counter keyed on (dimension, group_id), to the counters"""
+    table = HeadcountStat.__table__
+    params = [
+        {"b_dimension": dimension, "b_group_id": group_id, "b_delta": delta}
+        for (dimension, group_id), delta in sorted(deltas.items())
+        if delta
+    ]
+    if params:
+        # sorted, so concurrent transactions lock the rows in the same order
+        session.connection().execute(
+            update(table)
+            .where(
+                table.c.dimension == bindparam("b_dimension"),
+                table.c.group_id == bindparam("b_group_id"),
+            )
+            .values(headcount=table.c.headcount + bindparam("b_delta")),
+            params,
+        )
+
+
+def rebuild(session):
+    """Recompute every counter from employees, in the current transaction
+
+    Returns the number of employees counted.
+    """
+    deltas = Counter()
+    rows = session.execute(
+        select(Employee.department_id, Employee.role_id, func.count())
+        .where(Employee.is_admin.is_not(True))
+        .group_by(Employee.department_id, Employee.role_id)
+    )
+    for department_id, role_id, headcount in rows:
+        for group in groups(department_id, role_id):
+            deltas[group] += headcount
+
+    keys = [(dimension, UNASSIGNED) for dimension, model in DIMENSIONS]
+    for dimension, model in DIMENSIONS:
+        keys += [(dimension, group_id) for group_id in session.scalars(select(model.id))]
+    table = HeadcountStat.__table__
+    session.execute(delete(table))
+    session.execute(
+        insert(table),
+        [
+            {"dimension": dimension, "group_id": group_id, "headcount": deltas[dimension, group_id]}
+            for dimension, group_id in keys
+        ],
+    )
+    # every counted employee is in exactly one department counter
+    return sum(
+        headcount
+        for (dimension, group_id), headcount in deltas.items()
+        if dimension == "department"
+    )
+
+
+@jobs.task("rebuild_stats")
+def rebuild_job():
+    """rebuild() in a job of its own"""
+    counted = rebuild(db.session)
+    db.session.commit()
+    return {"counted": counted}
+
+
+def _summarize(session):
+    table = HeadcountStat.__table__
+    summary = {"unassigned": {}}
+    for dimension, model in DIMENSIONS:
+        rows = session.execute(
+            select(model.id, model.name, table.c.headcount)
+            .join(table, and_(table.c.dimension == dimension, table.c.group_id == model.id))
+            .order_by(model.name)
+        )
+        summary[model.__tablename__] = [
+            {"id": id, "name": name, "headcount": headcount} for id, name, headcount in rows
+        ]
+    for dimension, headcount in session.execute(
+        select(table.c.dimension, table.c.headcount).where(table.c.group_id == UNASSIGNED)
+    ):
+        summary["unassigned"][dimension] = headcount
+    return summary
+
+
+def summary(session):
+    """Return (versions, statistics) where versions identify the statistics
+
+    The statistics are computed from headcount_stats once per change of
+    the employees, departments or roles tables.
+    """
+    versions = table_versions(session)
+    key = tuple(versions.get(name) for name in ("departments", "employees", "roles"))
+    return key, summaries.get_or_set(key, lambda: _summarize(session))
+
+
+def _info(target, name, factory):
+    return object_session(target).info.setdefault(name, factory())
+
+
+def _old_groups(target):
+    state = inspect(target)
+    values = []
+    for name in TRACKED:
+        history = state.attrs[name].history
+        values.append(history.deleted[0] if history.deleted else state.attrs[name].value)
+    return groups(*values)
+
+
+def _new_groups(target):
+    return groups(*(getattr(target, name) for name in TRACKED))
+
+
+def _keep_old_value(target, value, oldvalue, initiator):
+    return value
+
+
+# load the value an attribute replaces even when it was expired, so the
+# counter the employee leaves is known
+for _name in TRACKED:
+    event.listen(getattr(Employee, _name), "set", _keep_old_value, active_history=True)
+
+
+@event.listens_for(Employee, "before_insert")
+def _count_inserted(mapper, connection, target):
+    _info(target, "headcount_deltas", Counter).update(_new_groups(target))
+
+
+@event.listens_for(Employee, "before_update")
+def _count_updated(mapper, connection, target):
+    old, new = _old_groups(target), _new_groups(target)
+    if old != new:
+        deltas = _info(target, "headcount_deltas", Counter)
+        deltas.subtract(old)
+        deltas.update(new)
+
+
+@event.listens_for(Employee, "before_delete")
+def _count_deleted(mapper, connection, target):
+    _info(target, "headcount_deltas", Counter).subtract(_old_groups(target))
+
+
+@event.listens_for(Department, "after_insert")
+@event.listens_for(Role, "after_insert")
+def _add_group(mapper, connection, target):
+    _info(target, "headcount_created", set).add((mapper.class_.__name__.lower(), target.id))
+
+
+@event.listens_for(Department, "after_delete")
+@event.listens_for(Role, "after_delete")
+def _drop_group(mapper, connection, target):
+    _info(target, "headcount_dropped", set).add((mapper.class_.__name__.lower(), target.id))
+
+
+@event.listens_for(Session, "after_flush")
+def _write_counters(session, flush_context):
+    created = session.info.pop("headcount_created", None)
+    deltas = session.info.pop("headcount_deltas", None)
+    dropped = session.info.pop("headcount_dropped", None)
+    table = HeadcountStat.__table__
+    connection = session.connection()
+    if created:
+        connection.execute(
+            insert(table),
+            [{"dimension": dimension, "group_id": group_id} for dimension, group_id in created],
+        )
+    if deltas:
+        apply(session, deltas)
+    for dimension, group_id in sorted(dropped or ()):
+        # employees the database itself detached now count as unassigned
+        remaining = connection.execute(
+            delete(table)
+            .where(table.c.dimension == dimension, table.c.group_id == group_id)
+            .returning(table.c.headcount)
+        ).scalar()
+        if remaining:
+            apply(session, Counter({(dimension, UNASSIGNED): remaining}))
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_counters(session):
+    for name in ("headcount_created", "headcount_deltas", "headcount_dropped"):
+        session.info.pop(name, None)
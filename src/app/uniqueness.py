@@ -0,0 +1,178 @@
+# app/uniqueness.py
+"""Username and email uniqueness checks with an optional Bloom filter"""
+
+import hashlib
+import logging
+import math
+import os
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy import or_
+from sqlalchemy import select
+
+from app import db
+from app.models import Employee
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter(object):
+    """Probabilistic set answering "maybe present" or "definitely absent" """
+
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(capacity, 1)
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value):
+        digest = hashlib.blake2b(value.encode("utf-8"), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, value):
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value):
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value)
+        )
+
+
+class UniquenessChecker(object):
+    """Tell which of a username and an email are already taken
+
+    Both values are looked up with a single query. With the Bloom filter
+    enabled, values the filter has never seen skip the database entirely.
+    The filter only knows the employees of its own process and of its last
+    rebuild, so the unique indexes remain the final arbiter and callers
+    must still handle an IntegrityError on insert. It is built by start()
+    in a background thread of every worker and rebuilt there every
+    rebuild_interval seconds, requests never wait for a build and query
+    the database until the first one is done.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.capacity = 100000
+        self.error_rate = 0.01
+        self.rebuild_interval = 600
+        self._bloom = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._building = threading.Lock()
+        self._thread = None
+
+    def init_app(self, app):
+        self.enabled = app.config.get("UNIQUENESS_BLOOM_ENABLED", self.enabled)
+        self.capacity = app.config.get("UNIQUENESS_BLOOM_CAPACITY", self.capacity)
+        self.error_rate = app.config.get("UNIQUENESS_BLOOM_ERROR_RATE", self.error_rate)
+        self.rebuild_interval = app.config.get("UNIQUENESS_BLOOM_REBUILD", self.rebuild_interval)
+        self._bloom = None
+
+    def start(self, app):
+        """Build the filter in a background thread, then rebuild it periodically
+
+        Called once per worker process, after the fork.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            # threads do not survive a fork, a forked worker starts its own
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(
+                target=self._refresh, args=(app,), name="uniqueness-bloom", daemon=True
+            )
+            self._thread.start()
+
+    def _refresh(self, app):
+        while True:
+            try:
+                with app.app_context():
+                    self.warm()
+            except Exception:
+                logger.exception("Cannot build the uniqueness Bloom filter")
+            time.sleep(self.rebuild_interval)
+
+    def warm(self):
+        """Build the Bloom filter from every username and email
+
+        The previous filter is served until the new one replaces it. A
+        call made while another build runs returns without building.
+        """
+        if not self._building.acquire(blocking=False):
+            return
+        try:
+            count = db.session.query(db.func.count(Employee.id)).scalar()
+            bloom = BloomFilter(max(self.capacity, 2 * count), self.error_rate)
+            rows = db.session.execute(
+                select(Employee.username, Employee.email).execution_options(yield_per=10000)
+            )
+            for username, email in rows:
+                self._add(bloom, username, email)
+            with self._lock:
+                self._bloom = bloom
+                self._pid = os.getpid()
+        finally:
+            self._building.release()
+
+    def _current_bloom(self):
+        """The last filter built by this process, or None"""
+        with self._lock:
+            return self._bloom if self._pid == os.getpid() else None
+
+    @staticmethod
+    def _add(bloom, username, email):
+        if username:
+            bloom.add("u:" + username)
+        if email:
+            bloom.add("e:" + email)
+
+    def add(self, username, email):
+        """Record a new employee in the Bloom filter"""
+        with self._lock:
+            if self._bloom is not None:
+                self._add(self._bloom, username, email)
+
+    def taken(self, username, email):
+        """Return the subset of {"username", "email"} already in use"""
+        bloom = self._current_bloom() if self.enabled else None
+        if bloom is not None:
+            if username and "u:" + username not in bloom:
+                username = None
+            if email and "e:" + email not in bloom:
+                email = None
+
+        conditions = []
+        if username:
+            conditions.append(Employee.username == username)
+        if email:
+            conditions.append(Employee.email == email)
+        if not conditions:
+            return set()
+
+        rows = db.session.execute(
+            select(Employee.username, Employee.email).where(or_(*conditions)).limit(2)
+        ).all()
+        taken = set()
+        for row_username, row_email in rows:
+            if username and row_username == username:
+                taken.add("username")
+            if email and row_email == email:
+                taken.add("email")
+        return taken
+
+
+uniqueness = UniquenessChecker()
+
+
+@event.listens_for(Employee, "after_insert")
+@event.listens_for(Employee, "after_update")
+def _record_employee(mapper, connection, target):
+    # an update may give an employee a username or email the filter never saw
+    uniqueness.add(target.username, target.email)
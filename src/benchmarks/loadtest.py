@@ -0,0 +1,320 @@
+"""
+Load test of the admin and employee pages against a running server.
+
+Every client thread logs in through the login form, as an admin or as a
+regular user depending on the scenario, and then repeats the requests of
+the scenario until its share of --requests is done. The throughput and
+the p50/p95/p99 latencies of every scenario are compared with a JSON
+baseline recorded earlier with --save-baseline. The run fails when
+throughput drops, or p95 grows, by more than --threshold, or when any
+request fails.
+
+Credentials are given as username:password, by default from the
+LOADTEST_ADMIN and LOADTEST_USER environment variables. `flask seed`
+fills the database at a realistic size and creates admin:password and
+jdoe:password. Only the standard
+library is used, so the script also runs outside the application
+environment. With --serve the server is started here with gunicorn.conf.py
+for the duration of the run.
+
+Usage:
+    flask seed --employees 1000000
+    python benchmarks/loadtest.py --admin admin:secret --user jdoe:secret
+    python benchmarks/loadtest.py --concurrency 16 --requests 2000 --save-baseline
+    python benchmarks/loadtest.py --serve --scenario list_employees --threshold 0.1
+"""
+
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+SRC = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE = os.path.join(SRC, "benchmarks", "baselines", "loadtest.json")
+
+CSRF_TOKEN = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+SELECTED = r'<select[^>]*name="{0}"[^>]*>(.*?)</select>'
+OPTION_VALUE = re.compile(r'<option[^>]*value="(\d+)"')
+
+
+class LoadTestError(Exception):
+    """Raised when the load test cannot log in or prepare its requests"""
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    """Answer redirects as they are, their target is not part of the timing"""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class Client(object):
+    """Browser-like session with its own cookies"""
+
+    def __init__(self, base_url, timeout=30):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), NoRedirect()
+        )
+
+    def request(self, path, data=None):
+        """Return the status and body of a GET, or a POST of data"""
+        body = urllib.parse.urlencode(data).encode("ascii") if data is not None else None
+        try:
+            with self.opener.open(self.base_url + path, body, timeout=self.timeout) as response:
+                return response.status, response.read().decode("utf-8", "replace")
+        except urllib.error.HTTPError as error:
+            return error.code, error.read().decode("utf-8", "replace")
+
+    def form(self, path):
+        """Return the page of a form and its CSRF token"""
+        status, page = self.request(path)
+        if status != 200:
+            raise LoadTestError("GET {0} answered {1}".format(path, status))
+        match = CSRF_TOKEN.search(page)
+        return page, match.group(1) if match else ""
+
+    def login(self, credentials):
+        username, _, password = credentials.partition(":")
+        page, token = self.form("/login")
+        status, page = self.request(
+            "/login", {"username": username, "password": password, "csrf_token": token}
+        )
+        if status != 302:
+            raise LoadTestError("Cannot log in as {0}".format(username))
+
+
+def choices(page, name):
+    """Return the option values of the select field name of a form page"""
+    select = re.search(SELECTED.format(name), page, re.S)
+    return [int(value) for value in OPTION_VALUE.findall(select.group(1))] if select else []
+
+
+class AssignEmployee(object):
+    """Posts of the assign form with random departments and roles"""
+
+    def __init__(self, client):
+        status, body = client.request("/api/v1/employees?per_page=200")
+        if status != 200:
+            raise LoadTestError("Cannot list employees, GET /api/v1/employees answered %d" % status)
+        self.employees = [item["id"] for item in json.loads(body)["items"] if not item["is_admin"]]
+        if not self.employees:
+            raise LoadTestError("No employee to assign, seed the database first")
+        page, self.token = client.form("/admin/employees/assign/%d" % self.employees[0])
+        self.departments = choices(page, "department_id")
+        self.roles = choices(page, "role_id")
+        if not (self.departments and self.roles):
+            raise LoadTestError("Assigning needs at least one department and one role")
+
+    def __call__(self, client):
+        return client.request(
+            "/admin/employees/assign/%d" % random.choice(self.employees),
+            {
+                "department_id": random.choice(self.departments),
+                "role_id": random.choice(self.roles),
+                "csrf_token": self.token,
+            },
+        )[0]
+
+
+def get(path):
+    """Factory of a scenario repeating GET path"""
+
+    def prepare(client):
+        return lambda client: client.request(path)[0]
+
+    return prepare
+
+
+# name: (logged in as, expected status, factory of the request function)
+SCENARIOS = {
+    "list_employees": ("admin", 200, get("/admin/employees")),
+    "list_departments": ("admin", 200, get("/admin/departments")),
+    "assign_employee": ("admin", 302, AssignEmployee),
+    "dashboard": ("user", 200, get("/dashboard")),
+}
+
+
+def percentile(values, share):
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+def run_scenario(name, base_url, credentials, concurrency, requests):
+    """Run requests of scenario name from concurrency clients, return its summary"""
+    role, expected, factory = SCENARIOS[name]
+    clients = []
+    for _ in range(concurrency):
+        client = Client(base_url)
+        client.login(credentials[role])
+        clients.append((client, factory(client)))
+
+    latencies, errors = [], []
+    lock = threading.Lock()
+    shares = [
+        requests // concurrency + (index < requests % concurrency) for index in range(concurrency)
+    ]
+
+    def work(client, send, count):
+        for _ in range(count):
+            start = time.perf_counter()
+            try:
+                status = send(client)
+            except OSError as error:
+                status = str(error)
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                latencies.append(elapsed)
+                if status != expected:
+                    errors.append(status)
+
+    threads = [
+        threading.Thread(target=work, args=(client, send, count))
+        for (client, send), count in zip(clients, shares)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "throughput": len(latencies) / wall,
+        "p50_ms": percentile(latencies, 0.5),
+        "p95_ms": percentile(latencies, 0.95),
+        "p99_ms": percentile(latencies, 0.99),
+        "max_ms": latencies[-1],
+        "error_sample": [str(status) for status in errors[:5]],
+    }
+
+
+def regressions(results, baseline, threshold):
+    """Return a message for every scenario worse than baseline by more than threshold"""
+    messages = []
+    for name, result in results.items():
+        if result["errors"]:
+            messages.append("{0}: {1} failed requests".format(name, result["errors"]))
+        before = baseline.get("scenarios", {}).get(name)
+        if before is None:
+            continue
+        if result["throughput"] < before["throughput"] * (1 - threshold):
+            messages.append(
+                "{0}: throughput {1:.1f}/s, baseline {2:.1f}/s".format(
+                    name, result["throughput"], before["throughput"]
+                )
+            )
+        if result["p95_ms"] > before["p95_ms"] * (1 + threshold):
+            messages.append(
+                "{0}: p95 {1:.1f} ms, baseline {2:.1f} ms".format(
+                    name, result["p95_ms"], before["p95_ms"]
+                )
+            )
+    return messages
+
+
+def serve(base_url):
+    """Start gunicorn on the host and port of base_url and wait until it answers"""
+    bind = urllib.parse.urlsplit(base_url).netloc
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "run:app"],
+        cwd=SRC,
+        env=dict(os.environ, GUNICORN_BIND=bind),
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise LoadTestError("The server exited with %d" % server.returncode)
+        try:
+            Client(base_url, timeout=1).request("/login")
+            return server
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise LoadTestError("The server did not answer within 30 seconds")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--admin", default=os.getenv("LOADTEST_ADMIN"), help="username:password")
+    parser.add_argument("--user", default=os.getenv("LOADTEST_USER"), help="username:password")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=500, help="per scenario")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--threshold", type=float, default=0.2, help="tolerated regression")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    parser.add_argument("--serve", action="store_true", help="start the server with gunicorn")
+    args = parser.parse_args()
+
+    names = args.scenario or list(SCENARIOS)
+    credentials = {"admin": args.admin, "user": args.user}
+    missing = {SCENARIOS[name][0] for name in names if not credentials[SCENARIOS[name][0]]}
+    if missing:
+        parser.error("credentials missing for: {0}".format(", ".join(sorted(missing))))
+
+    server = serve(args.base_url) if args.serve else None
+    try:
+        results = {
+            name: run_scenario(name, args.base_url, credentials, args.concurrency, args.requests)
+            for name in names
+        }
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    print(f"{'scenario':<18} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for name, result in results.items():
+        print(
+            f"{name:<18} {result['throughput']:>8.1f} {result['p50_ms']:>8.1f} "
+            f"{result['p95_ms']:>8.1f} {result['p99_ms']:>8.1f} {result['errors']:>7}"
+        )
+
+    report = {
+        "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "base_url": args.base_url,
+        "concurrency": args.concurrency,
+        "requests": args.requests,
+        "scenarios": results,
+    }
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, "w") as output:
+            json.dump(report, output, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as stream:
+            baseline = json.load(stream)
+    else:
+        print(f"No baseline at {args.baseline}, only failed requests are checked")
+    problems = regressions(results, baseline, args.threshold)
+    for problem in problems:
+        print(f"REGRESSION {problem}")
+    if problems:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Latency of a log call on the request path, synchronous file vs queue.
+
+"sync" is the former setup, a RotatingFileHandler written by the calling
+thread and rotated every 10 KB. "queue" is app/log.py, where the calling
+thread only puts the record on a queue. --delay adds a sleep to every
+write to stand for a slow or busy disk.
+
+Usage:
+    python benchmarks/logging_latency.py
+    python benchmarks/logging_latency.py --threads 16 --records 2000 --delay 1
+"""
+
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from logging.handlers import RotatingFileHandler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.log import JSONFormatter  # noqa: E402
+from app.log import LogPipeline  # noqa: E402
+
+
+class SlowRotatingFileHandler(RotatingFileHandler):
+    def __init__(self, *args, delay_ms=0, **kwargs):
+        super(SlowRotatingFileHandler, self).__init__(*args, **kwargs)
+        self.delay_ms = delay_ms
+
+    def emit(self, record):
+        if self.delay_ms:
+            time.sleep(self.delay_ms / 1000)
+        super(SlowRotatingFileHandler, self).emit(record)
+
+
+def make_logger(mode, directory, delay_ms):
+    logger = logging.getLogger("benchmark." + mode)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    if mode == "sync":
+        handler = SlowRotatingFileHandler(
+            os.path.join(directory, "sync.log"), maxBytes=10240, backupCount=10, delay_ms=delay_ms
+        )
+        handler.setFormatter(
+            logging.Formatter("%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]")
+        )
+        logger.addHandler(handler)
+        return logger, handler.close
+    handler = SlowRotatingFileHandler(
+        os.path.join(directory, "queue.log"),
+        maxBytes=10 * 1024 * 1024,
+        backupCount=10,
+        delay_ms=delay_ms,
+    )
+    handler.setFormatter(JSONFormatter())
+    pipeline = LogPipeline([handler], queue_size=100000, sample_rate=1.0)
+    pipeline.start()
+    logger.addHandler(pipeline.handler)
+    return logger, pipeline.stop
+
+
+def run(mode, threads, records, delay_ms):
+    """Return the sorted latencies, in milliseconds, of every log call"""
+    with tempfile.TemporaryDirectory() as directory:
+        logger, close = make_logger(mode, directory, delay_ms)
+
+        def request(index):
+            start = time.perf_counter()
+            logger.info(
+                "GET /admin/employees 200",
+                extra={"request_id": "%032x" % index, "status": 200, "duration_ms": 12.5},
+            )
+            return (time.perf_counter() - start) * 1000
+
+        # threads stand for the request threads of a worker
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            latencies = sorted(pool.map(request, range(records)))
+        close()
+    return latencies
+
+
+def percentile(values, share):
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--records", type=int, default=5000)
+    parser.add_argument("--delay", type=float, default=0, help="milliseconds per write")
+    args = parser.parse_args()
+
+    print(f"{'mode':<8} {'p50 ms':>10} {'p99 ms':>10} {'max ms':>10}")
+    for mode in ("sync", "queue"):
+        latencies = run(mode, args.threads, args.records, args.delay)
+        print(
+            f"{mode:<8} {percentile(latencies, 0.5):>10.3f} "
+            f"{percentile(latencies, 0.99):>10.3f} {latencies[-1]:>10.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Password verification throughput for a range of hash costs.
+
+Every login verifies one password, so the verifications per second of a
+worker are an upper bound of the logins per second it can serve.
+
+Usage:
+    python benchmarks/password_hashing.py
+    python benchmarks/password_hashing.py --workers 4 --logins 200 pbkdf2:sha256:600000
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.passwords import PasswordHasher  # noqa: E402
+
+DEFAULT_METHODS = [
+    "pbkdf2:sha256:260000",
+    "pbkdf2:sha256:600000",
+    "pbkdf2:sha256:1000000",
+    "scrypt:16384:8:1",
+    "scrypt:32768:8:1",
+]
+
+
+def run(method, workers, logins, clients):
+    """Return the logins per second verified through a pool of workers"""
+    hasher = PasswordHasher(method=method, workers=workers)
+    pwhash = hasher.hash("correct horse battery staple")
+
+    start = time.perf_counter()
+    # clients stand for request threads all logging in at the same time
+    with ThreadPoolExecutor(max_workers=clients) as requests:
+        results = list(
+            requests.map(
+                lambda _: hasher.verify(pwhash, "correct horse battery staple"), range(logins)
+            )
+        )
+    elapsed = time.perf_counter() - start
+    hasher.shutdown()
+
+    assert all(results)
+    return logins / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("methods", nargs="*", default=DEFAULT_METHODS)
+    parser.add_argument("--workers", type=int, default=2, help="PASSWORD_HASH_WORKERS")
+    parser.add_argument("--logins", type=int, default=50)
+    parser.add_argument("--clients", type=int, default=16)
+    args = parser.parse_args()
+
+    print(f"{'method':<28} {'logins/s':>10}")
+    for method in args.methods:
+        rate = run(method, args.workers, args.logins, args.clients)
+        print(f"{method:<28} {rate:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
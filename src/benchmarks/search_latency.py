@@ -0,0 +1,81 @@
+"""
+Latency of the employee autocomplete against the configured database.
+
+Runs app.search.search_employees with terms of 1 to 5 characters taken
+from existing usernames, names and emails, the way a user types them,
+and fails when the p95 exceeds the target. Meant for a PostgreSQL
+database migrated to head and holding a realistic number of employees,
+e.g. a million.
+
+Usage:
+    FLASK_DB=postgresql://... python benchmarks/search_latency.py
+    python benchmarks/search_latency.py --queries 2000 --target-ms 20 --config production
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app  # noqa: E402
+from app import db  # noqa: E402
+from app.models import Employee  # noqa: E402
+from app.search import search_employees  # noqa: E402
+
+
+def sample_terms(count, seed):
+    """Prefixes of random employee values, as typed while autocompleting"""
+    rng = random.Random(seed)
+    rows = (
+        db.session.query(Employee.first_name, Employee.last_name, Employee.username, Employee.email)
+        .order_by(db.func.random())
+        .limit(max(1, count // 5))
+        .all()
+    )
+    values = [value for row in rows for value in row if value]
+    return [rng.choice(values)[: rng.randint(1, 5)] for _ in range(count)]
+
+
+def percentile(values, share):
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--config", default="production")
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--target-ms", type=float, default=20.0)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    app = create_app(args.config)
+    with app.app_context():
+        total = db.session.query(db.func.count(Employee.id)).scalar()
+        terms = sample_terms(args.queries, args.seed)
+        search_employees(terms[0], args.limit)
+
+        latencies = []
+        for term in terms:
+            start = time.perf_counter()
+            search_employees(term, args.limit)
+            latencies.append((time.perf_counter() - start) * 1000)
+            db.session.rollback()
+    latencies.sort()
+
+    p95 = percentile(latencies, 0.95)
+    print(f"{total} employees, {len(terms)} queries")
+    print(f"p50 {percentile(latencies, 0.5):.2f} ms")
+    print(f"p95 {p95:.2f} ms")
+    print(f"p99 {percentile(latencies, 0.99):.2f} ms")
+    print(f"max {latencies[-1]:.2f} ms")
+    if p95 > args.target_ms:
+        print(f"p95 is above the {args.target_ms} ms target")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
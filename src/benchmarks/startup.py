@@ -0,0 +1,90 @@
+"""
+Time to first request of a fresh worker process.
+
+Every run starts a new interpreter which imports the application, calls
+create_app and serves one request, the way a gunicorn worker does after
+a restart. The wall clock time of the whole run is reported together
+with the create_app steps timed by FLASK_STARTUP_PROFILE.
+
+Usage:
+    python benchmarks/startup.py
+    python benchmarks/startup.py --runs 20 --config production --path /login
+    python benchmarks/startup.py --output startup.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+SRC = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WORKER = """
+import json, time
+start = time.perf_counter()
+from app import create_app
+imported = (time.perf_counter() - start) * 1000
+app = create_app({config!r})
+status = app.test_client().get({path!r}).status_code
+first_request = (time.perf_counter() - start) * 1000
+steps = [("import app", imported)] + app.extensions["startup_profile"].steps
+print(json.dumps({{"status": status, "first_request": first_request, "steps": steps}}))
+"""
+
+
+def run_once(config, path):
+    """Return the wall clock milliseconds of one run and what the worker measured"""
+    env = dict(os.environ, FLASK_STARTUP_PROFILE="1")
+    env.setdefault("SECRET_KEY", "benchmark")
+    env.setdefault("FLASK_DB", "sqlite://")
+    start = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, "-c", WORKER.format(config=config, path=path)],
+        cwd=SRC,
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    wall = (time.perf_counter() - start) * 1000
+    return wall, json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--config", default="testing")
+    parser.add_argument("--path", default="/")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    walls, firsts, steps = [], [], {}
+    for _ in range(args.runs):
+        wall, worker = run_once(args.config, args.path)
+        walls.append(wall)
+        firsts.append(worker["first_request"])
+        for name, duration in worker["steps"]:
+            steps.setdefault(name, []).append(duration)
+
+    print(f"{'step':<24} {'median ms':>10}")
+    for name, durations in steps.items():
+        print(f"{name:<24} {statistics.median(durations):>10.1f}")
+    print(f"{'in process':<24} {statistics.median(firsts):>10.1f}")
+    print(f"{'wall clock':<24} {statistics.median(walls):>10.1f}  (min {min(walls):.1f})")
+
+    if args.output:
+        result = {
+            "runs": args.runs,
+            "wall_clock_ms": statistics.median(walls),
+            "first_request_ms": statistics.median(firsts),
+            "steps_ms": {name: statistics.median(values) for name, values in steps.items()},
+        }
+        with open(args.output, "w") as output:
+            json.dump(result, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
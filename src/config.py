@@ -1,5 +1,16 @@
 # config.py
 
+import os
+from typing import Optional
+
+
+def env_int(name, default):
+    return int(os.getenv(name, default))
+
+
+def env_bool(name, default):
+    return os.getenv(name, str(default)).lower() in ("1", "true", "yes", "on")
+
 
 class Config(object):
     """Common configuration"""
@@ -7,11 +18,120 @@ class Config(object):
     # Put here all env config
     Debug = True
 
+    # Listing page sizes
+    EMPLOYEES_PER_PAGE = 50
+    API_PER_PAGE = 100
+    MAX_PER_PAGE = 200
+    # Employee search results and autocomplete suggestions
+    SEARCH_RESULTS = 50
+    AUTOCOMPLETE_RESULTS = 10
+
+    # Cache of the users loaded by flask-login, per worker process
+    PRINCIPAL_CACHE_SIZE = 4096
+    PRINCIPAL_CACHE_TTL = 60
+
+    # Seconds the department and role choices of the forms are cached
+    REFERENCE_DATA_TTL = 30
+
+    # Bloom filter of taken usernames and emails letting registrations of
+    # new values skip the uniqueness queries, rebuilt every REBUILD seconds
+    UNIQUENESS_BLOOM_ENABLED = True
+    UNIQUENESS_BLOOM_CAPACITY = 100000
+    UNIQUENESS_BLOOM_ERROR_RATE = 0.01
+    UNIQUENESS_BLOOM_REBUILD = 600
+
+    # Database engine, see app/database.py; SQLite ignores the pool settings
+    DB_POOL_SIZE = 5
+    DB_MAX_OVERFLOW = 10
+    DB_POOL_TIMEOUT = 30
+    DB_POOL_RECYCLE = -1
+    DB_POOL_PRE_PING = False
+    # PgBouncer in transaction pooling mode, optionally without a local pool
+    DB_PGBOUNCER = False
+    DB_NULL_POOL = False
+    # Read replicas, set in instance/config.py, serve the views marked with
+    # database.read_only; a client reads from the primary for LAG seconds
+    # after each of its writes
+    DB_REPLICAS: list[str] = []
+    DB_REPLICA_LAG = 5
+    # Milliseconds a statement of a request may run, None for no limit
+    DB_STATEMENT_TIMEOUT: Optional[int] = None
+
+    # Report the SQL time of every request in a Server-Timing header and
+    # warn when a statement runs more than THRESHOLD times in one request
+    SQL_SERVER_TIMING = True
+    SQL_NPLUSONE_THRESHOLD: Optional[int] = None
+
+    # JSON lines log written by a background thread, see app/log.py; when
+    # more than QUEUE_SIZE records are pending new ones are dropped, and
+    # only a share SAMPLE_RATE of the records below WARNING is kept
+    LOG_DIR = "log"
+    LOG_FILE = "microblog.log"
+    LOG_MAX_BYTES = 10 * 1024 * 1024
+    LOG_BACKUP_COUNT = 10
+    LOG_QUEUE_SIZE = 10000
+    LOG_INFO_SAMPLE_RATE = 1.0
+
+    # Cache of the {% cache %} template fragments, see app/fragments.py;
+    # BACKEND is one of lru (per process), filesystem, redis or null
+    FRAGMENT_CACHE_BACKEND = "lru"
+    FRAGMENT_CACHE_SIZE = 512
+    FRAGMENT_CACHE_TTL = 300
+    FRAGMENT_CACHE_DIR = "cache/fragments"
+    FRAGMENT_CACHE_URL: Optional[str] = None
+    # change it on deploy when a shared backend must forget old templates
+    FRAGMENT_CACHE_PREFIX = "fragment"
+
+    # Serve the files built by `flask assets build` when its manifest exists
+    ASSETS_FINGERPRINT = True
+
+    # gunicorn.conf.py, overridden by the environment variables it lists;
+    # None workers means one per CPU for gthread and gevent, 2 per CPU + 1
+    # for sync. Recycling after MAX_REQUESTS bounds the memory of a worker.
+    WEB_BIND = "0.0.0.0:8000"
+    WEB_WORKERS: Optional[int] = None
+    WEB_WORKER_CLASS = "gthread"
+    WEB_THREADS = 4
+    WEB_WORKER_CONNECTIONS = 1000
+    WEB_PRELOAD = True
+    WEB_MAX_REQUESTS = 1000
+    WEB_MAX_REQUESTS_JITTER = 100
+    WEB_TIMEOUT = 30
+    WEB_GRACEFUL_TIMEOUT = 30
+    WEB_KEEPALIVE = 5
+
+    # Background jobs run by `flask worker`, see app/jobs.py; a failed job
+    # is retried after up to BACKOFF * 2 ** attempt seconds, capped at
+    # BACKOFF_MAX; a running job renews its lock every HEARTBEAT seconds
+    # and one whose lock was not renewed for TIMEOUT seconds is run again
+    JOB_MAX_ATTEMPTS = 3
+    JOB_BACKOFF = 10
+    JOB_BACKOFF_MAX = 600
+    JOB_TIMEOUT = 600
+    JOB_HEARTBEAT = 60
+    # Uploads handed to jobs, relative to the instance folder unless
+    # absolute; the web and worker processes must share it
+    JOB_FILES_DIR = "jobs"
+    WORKER_CONCURRENCY = 2
+    WORKER_POLL_INTERVAL = 1.0
+    # Uploaded imports larger than this are run by a job
+    IMPORT_INLINE_MAX_BYTES = 1024 * 1024
+
+    # Prometheus metrics on /metrics, needs the metrics extra installed
+    METRICS_ENABLED = True
+
+    # Werkzeug hash method including its cost, e.g. "scrypt:32768:8:1" or
+    # "pbkdf2:sha256:1000000"; hashes made otherwise are upgraded on login
+    PASSWORD_HASH_METHOD = "scrypt:32768:8:1"
+    # Number of passwords a worker process hashes concurrently
+    PASSWORD_HASH_WORKERS = 2
+
 
 class DevelopmentConfig(Config):
     """Development configuration"""
 
     SQLALCHEMY_ECHO = True
+    SQL_NPLUSONE_THRESHOLD = 5
 
 
 class ProductionConfig(Config):
@@ -19,11 +139,33 @@ class ProductionConfig(Config):
 
     DEBUG = False
 
+    DB_POOL_SIZE = env_int("DB_POOL_SIZE", 10)
+    DB_MAX_OVERFLOW = env_int("DB_MAX_OVERFLOW", 5)
+    DB_POOL_TIMEOUT = env_int("DB_POOL_TIMEOUT", 10)
+    DB_POOL_RECYCLE = env_int("DB_POOL_RECYCLE", 1800)
+    DB_POOL_PRE_PING = env_bool("DB_POOL_PRE_PING", True)
+    DB_PGBOUNCER = env_bool("DB_PGBOUNCER", False)
+    DB_NULL_POOL = env_bool("DB_NULL_POOL", False)
+    DB_STATEMENT_TIMEOUT = env_int("DB_STATEMENT_TIMEOUT", 5000)
+
+    LOG_INFO_SAMPLE_RATE = float(os.getenv("LOG_INFO_SAMPLE_RATE", 1.0))
+
+    WORKER_CONCURRENCY = env_int("WORKER_CONCURRENCY", 2)
+    JOB_FILES_DIR = os.getenv("JOB_FILES_DIR", "jobs")
+
+    FRAGMENT_CACHE_BACKEND = os.getenv("FRAGMENT_CACHE_BACKEND", "lru")
+    FRAGMENT_CACHE_URL = os.getenv("FRAGMENT_CACHE_URL")
+    FRAGMENT_CACHE_PREFIX = os.getenv("FRAGMENT_CACHE_PREFIX", "fragment")
+
 
 class TestingConfig(Config):
     """Testing configuration"""
 
     TESTING = True
+    WTF_CSRF_ENABLED = False
+    SQL_NPLUSONE_THRESHOLD = 5
+    PASSWORD_HASH_METHOD = "pbkdf2:sha256:1000"
+    ASSETS_FINGERPRINT = False
 
 
 app_config = {
@@ -0,0 +1,90 @@
+# gunicorn.conf.py
+"""gunicorn settings, read from config.py and the environment
+
+    gunicorn -c gunicorn.conf.py run:app
+
+Environment variables override the WEB_* settings of the FLASK_CONFIG
+configuration: WEB_CONCURRENCY (workers), GUNICORN_BIND,
+GUNICORN_WORKER_CLASS (gthread, gevent or sync), GUNICORN_THREADS,
+GUNICORN_WORKER_CONNECTIONS, GUNICORN_PRELOAD, GUNICORN_MAX_REQUESTS,
+GUNICORN_MAX_REQUESTS_JITTER, GUNICORN_TIMEOUT, GUNICORN_GRACEFUL_TIMEOUT
+and GUNICORN_KEEPALIVE.
+"""
+
+import os
+import shutil
+
+from config import app_config
+from config import env_bool
+from config import env_int
+
+settings = app_config[os.getenv("FLASK_CONFIG", "production")]
+
+
+def cpu_count():
+    """CPUs this process may run on, which a container can restrict"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # pragma: no cover
+        return os.cpu_count() or 1
+
+
+def default_workers(worker_class, cpus):
+    # sync workers block on I/O, threaded and green ones do not
+    return 2 * cpus + 1 if worker_class == "sync" else cpus
+
+
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", settings.WEB_WORKER_CLASS)
+if worker_class == "gevent":
+    # patch before the preloaded application creates locks and sockets
+    from gevent import monkey
+
+    monkey.patch_all()
+
+bind = os.getenv("GUNICORN_BIND", settings.WEB_BIND)
+workers = env_int("WEB_CONCURRENCY", 0) or settings.WEB_WORKERS
+workers = workers or default_workers(worker_class, cpu_count())
+threads = env_int("GUNICORN_THREADS", settings.WEB_THREADS)
+worker_connections = env_int("GUNICORN_WORKER_CONNECTIONS", settings.WEB_WORKER_CONNECTIONS)
+preload_app = env_bool("GUNICORN_PRELOAD", settings.WEB_PRELOAD)
+max_requests = env_int("GUNICORN_MAX_REQUESTS", settings.WEB_MAX_REQUESTS)
+max_requests_jitter = env_int("GUNICORN_MAX_REQUESTS_JITTER", settings.WEB_MAX_REQUESTS_JITTER)
+timeout = env_int("GUNICORN_TIMEOUT", settings.WEB_TIMEOUT)
+graceful_timeout = env_int("GUNICORN_GRACEFUL_TIMEOUT", settings.WEB_GRACEFUL_TIMEOUT)
+keepalive = env_int("GUNICORN_KEEPALIVE", settings.WEB_KEEPALIVE)
+accesslog = "-"
+
+
+def on_starting(server):
+    """Remove the metrics files left by the workers of a previous run"""
+    directory = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if directory:
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory, exist_ok=True)
+
+
+def post_fork(server, worker):
+    """Drop the state a worker must not share with the master, start its threads"""
+    from app import db
+    from app import log
+    from app.uniqueness import uniqueness
+
+    app = worker.app.wsgi()
+    if server.cfg.preload_app:
+        with app.app_context():
+            # the pooled connections belong to the master, close=False leaves
+            # them open for it and gives this worker an empty pool
+            for engine in db.engines.values():
+                engine.dispose(close=False)
+        log.after_fork()
+    uniqueness.start(app)
+
+
+def child_exit(server, worker):
+    """Merge the metrics of a worker that exited into the dead ones"""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        try:
+            from prometheus_client import multiprocess
+        except ImportError:  # pragma: no cover
+            return
+        multiprocess.mark_process_dead(worker.pid)
@@ -4,3 +4,7 @@ import os
 
 SECRET_KEY = os.getenv("SECRET_KEY")
 SQLALCHEMY_DATABASE_URI = os.getenv("FLASK_DB")
+# Comma separated urls of read replicas of FLASK_DB
+DB_REPLICAS = [url for url in os.getenv("FLASK_DB_REPLICAS", "").split(",") if url]
+# Bearer token for /metrics, admins only when unset
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
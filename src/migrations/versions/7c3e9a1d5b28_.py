@@ -0,0 +1,36 @@
+"""widen employees.password_hash for scrypt hashes
+
+Revision ID: 7c3e9a1d5b28
+Revises: 0b6e2d5f7a31
+Create Date: 2026-10-18 09:12:40.184203
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "7c3e9a1d5b28"
+down_revision = "0b6e2d5f7a31"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("employees") as batch_op:
+        batch_op.alter_column(
+            "password_hash",
+            existing_type=sa.String(length=128),
+            type_=sa.String(length=256),
+            existing_nullable=True,
+        )
+
+
+def downgrade():
+    with op.batch_alter_table("employees") as batch_op:
+        batch_op.alter_column(
+            "password_hash",
+            existing_type=sa.String(length=256),
+            type_=sa.String(length=128),
+            existing_nullable=True,
+        )
@@ -0,0 +1,37 @@
+"""index employees by (sort column, id) for keyset pagination
+
+Revision ID: 9e4f2b7d1c60
+Revises: 7c3e9a1d5b28
+Create Date: 2026-10-18 14:37:05.512830
+
+"""
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "9e4f2b7d1c60"
+down_revision = "7c3e9a1d5b28"
+branch_labels = None
+depends_on = None
+
+SORT_COLUMNS = ("email", "username", "first_name", "last_name")
+
+# the (column, id) indexes cover lookups on column alone, the unique
+# indexes of email and username stay for their constraint
+REPLACED = ("first_name", "last_name")
+
+
+def upgrade():
+    with op.batch_alter_table("employees") as batch_op:
+        for column in SORT_COLUMNS:
+            batch_op.create_index("ix_employees_{0}_id".format(column), [column, "id"])
+        for column in REPLACED:
+            batch_op.drop_index("ix_employees_{0}".format(column))
+
+
+def downgrade():
+    with op.batch_alter_table("employees") as batch_op:
+        for column in REPLACED:
+            batch_op.create_index("ix_employees_{0}".format(column), [column])
+        for column in SORT_COLUMNS:
+            batch_op.drop_index("ix_employees_{0}_id".format(column))
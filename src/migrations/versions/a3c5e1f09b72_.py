@@ -0,0 +1,34 @@
+"""add row versions
+
+Revision ID: a3c5e1f09b72
+Revises: 4bdd8d115d3d
+Create Date: 2026-10-17 10:12:40.118213
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "a3c5e1f09b72"
+down_revision = "4bdd8d115d3d"
+branch_labels = None
+depends_on = None
+
+TABLES = ("departments", "roles", "employees")
+
+
+def upgrade():
+    for table in TABLES:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.add_column(
+                sa.Column("version", sa.Integer(), server_default="1", nullable=False)
+            )
+            batch_op.add_column(sa.Column("updated_at", sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    for table in reversed(TABLES):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_column("updated_at")
+            batch_op.drop_column("version")
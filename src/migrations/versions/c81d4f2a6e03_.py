@@ -0,0 +1,32 @@
+"""add table change counters
+
+Revision ID: c81d4f2a6e03
+Revises: a3c5e1f09b72
+Create Date: 2026-10-17 14:02:11.540318
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "c81d4f2a6e03"
+down_revision = "a3c5e1f09b72"
+branch_labels = None
+depends_on = None
+
+VERSIONED_TABLES = ("departments", "employees", "roles")
+
+
+def upgrade():
+    table_versions = op.create_table(
+        "table_versions",
+        sa.Column("name", sa.String(length=64), nullable=False),
+        sa.Column("version", sa.Integer(), server_default="0", nullable=False),
+        sa.PrimaryKeyConstraint("name"),
+    )
+    op.bulk_insert(table_versions, [{"name": name} for name in VERSIONED_TABLES])
+
+
+def downgrade():
+    op.drop_table("table_versions")
@@ -0,0 +1,51 @@
+"""add employee search indexes
+
+Revision ID: d5a9b3c7f214
+Revises: c81d4f2a6e03
+Create Date: 2026-10-17 16:25:48.903114
+
+"""
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "d5a9b3c7f214"
+down_revision = "c81d4f2a6e03"
+branch_labels = None
+depends_on = None
+
+PREFIX_COLUMNS = ("first_name", "last_name", "username", "email")
+
+# keep identical to app.search.SEARCH_TEXT
+SEARCH_TEXT = (
+    "lower(coalesce(first_name, '') || ' ' || coalesce(last_name, '') || ' ' || "
+    "coalesce(username, '') || ' ' || coalesce(email, ''))"
+)
+
+
+def upgrade():
+    # the indexes rely on PostgreSQL operator classes, other databases
+    # search without them
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    # built concurrently so that a large employees table stays writable
+    with op.get_context().autocommit_block():
+        for column in PREFIX_COLUMNS:
+            op.execute(
+                "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_employees_{0}_prefix "
+                'ON employees ((lower({0}) COLLATE "C"))'.format(column)
+            )
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_employees_search_trgm "
+            "ON employees USING gin ({0} gin_trgm_ops)".format(SEARCH_TEXT)
+        )
+
+
+def downgrade():
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_employees_search_trgm")
+        for column in PREFIX_COLUMNS:
+            op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_employees_{0}_prefix".format(column))
@@ -0,0 +1,44 @@
+"""add headcount statistics
+
+Revision ID: e2b7c4d9a185
+Revises: d5a9b3c7f214
+Create Date: 2026-10-17 18:12:37.206518
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "e2b7c4d9a185"
+down_revision = "d5a9b3c7f214"
+branch_labels = None
+depends_on = None
+
+# same counters as app.stats.rebuild, 0 standing for no department or role
+POPULATE = """
+INSERT INTO headcount_stats (dimension, group_id, headcount)
+SELECT '{dimension}', 0, count(*) FROM employees
+WHERE {column} IS NULL AND (is_admin IS NULL OR NOT is_admin)
+UNION ALL
+SELECT '{dimension}', {table}.id, count(employees.id) FROM {table}
+LEFT OUTER JOIN employees
+ON employees.{column} = {table}.id AND (employees.is_admin IS NULL OR NOT employees.is_admin)
+GROUP BY {table}.id
+"""
+
+
+def upgrade():
+    op.create_table(
+        "headcount_stats",
+        sa.Column("dimension", sa.String(length=16), nullable=False),
+        sa.Column("group_id", sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column("headcount", sa.Integer(), server_default="0", nullable=False),
+        sa.PrimaryKeyConstraint("dimension", "group_id"),
+    )
+    for dimension, table in (("department", "departments"), ("role", "roles")):
+        op.execute(POPULATE.format(dimension=dimension, table=table, column=dimension + "_id"))
+
+
+def downgrade():
+    op.drop_table("headcount_stats")
@@ -0,0 +1,37 @@
+"""unassign employees of deleted departments and roles in the database
+
+Revision ID: f4c1a8e6b392
+Revises: e2b7c4d9a185
+Create Date: 2026-10-17 19:40:03.671925
+
+"""
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "f4c1a8e6b392"
+down_revision = "e2b7c4d9a185"
+branch_labels = None
+depends_on = None
+
+FOREIGN_KEYS = (("department_id", "departments"), ("role_id", "roles"))
+
+# the names PostgreSQL gave the unnamed constraints, SQLite reflects them
+# unnamed and batch mode applies this convention to them
+NAMING_CONVENTION = {"fk": "%(table_name)s_%(column_0_name)s_fkey"}
+
+
+def replace_foreign_keys(ondelete):
+    with op.batch_alter_table("employees", naming_convention=NAMING_CONVENTION) as batch_op:
+        for column, table in FOREIGN_KEYS:
+            name = "employees_{0}_fkey".format(column)
+            batch_op.drop_constraint(name, type_="foreignkey")
+            batch_op.create_foreign_key(name, table, [column], ["id"], ondelete=ondelete)
+
+
+def upgrade():
+    replace_foreign_keys("SET NULL")
+
+
+def downgrade():
+    replace_foreign_keys(None)
@@ -1,15 +1,55 @@
+import csv
+import datetime
+import io
+import json
+import logging
+import os
+import runpy
+import shutil
+import tempfile
+import threading
 import unittest
 from os import getenv
+from unittest import mock
 
 from flask import abort
+from flask import g
 from flask import url_for
 from flask_testing import TestCase
+from sqlalchemy import create_engine
+from sqlalchemy import exc
+from sqlalchemy.pool import NullPool
+from werkzeug.security import generate_password_hash
 
+from app import assets
+from app import assignments
 from app import create_app
+from app import database
 from app import db
+from app import fragments
+from app import importer
+from app import jobs
+from app import log
+from app import metrics
+from app import search
+from app import seed
+from app import startup
+from app import stats
+from app.instrumentation import assert_max_queries
+from app.instrumentation import count_queries
+from app.instrumentation import statement_shape
 from app.models import Department
 from app.models import Employee
+from app.models import HeadcountStat
 from app.models import Role
+from app.models import TableVersion
+from app.models import load_user
+from app.models import principals
+from app.passwords import hasher
+from app.refdata import refdata
+from app.uniqueness import BloomFilter
+from app.uniqueness import uniqueness
+from config import app_config
 
 
 class TestBase(TestCase):
@@ -142,6 +182,1474 @@ class TestViews(TestBase):
         self.assertRedirects(response, redirect_url)
 
 
+class TestAdminBase(TestBase):
+    """Base class for tests that need a populated database and an admin"""
+
+    def setUp(self):
+        """Create database, departments, roles and employees"""
+        db.create_all()
+
+        self.admin = Employee(username="admin", password="admin2017", is_admin=True)
+        self.departments = [Department(name="Dept%d" % i, description="-") for i in range(3)]
+        self.roles = [Role(name="Role%d" % i, description="-") for i in range(3)]
+        db.session.add(self.admin)
+        db.session.add_all(self.departments + self.roles)
+
+        self.employees = []
+        for i in range(25):
+            employee = Employee(
+                email="user%d@example.com" % i,
+                username="user%02d" % i,
+                first_name="First%d" % i,
+                last_name="Last%d" % (i % 7),
+                password_hash="-",
+                department=self.departments[i % 3],
+                role=self.roles[i % 2],
+            )
+            self.employees.append(employee)
+        db.session.add_all(self.employees)
+        db.session.commit()
+
+    def login(self, employee):
+        with self.client.session_transaction() as session:
+            session["_user_id"] = str(employee.id)
+            session["_fresh"] = True
+        # requests share the app context of the test, drop the user it holds
+        g.pop("_login_user", None)
+
+    def count_queries(self, func):
+        """Return the number of SQL statements func executes"""
+        with count_queries() as collector:
+            func()
+        return collector.count
+
+
+class TestEmployeeListing(TestAdminBase):
+    """Check the paginated employees listing"""
+
+    def test_pages_cover_all_employees(self):
+        """Walking the next links visits every employee exactly once"""
+        self.login(self.admin)
+        seen = []
+        url = url_for("admin.list_employees", sort="last_name", per_page=10)
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            page = self.get_context_variable("page")
+            seen.extend(employee.id for employee in page.items)
+            url = None
+            if page.has_next:
+                url = url_for(
+                    "admin.list_employees",
+                    sort="last_name",
+                    per_page=10,
+                    after=page.next_cursor,
+                )
+        self.assertEqual(sorted(seen), sorted(e.id for e in Employee.query.all()))
+        self.assertEqual(len(seen), len(set(seen)))
+
+    def test_previous_page(self):
+        """The previous link returns the rows of the page before"""
+        self.login(self.admin)
+        self.client.get(url_for("admin.list_employees", sort="username", per_page=5))
+        first = [e.id for e in self.get_context_variable("page").items]
+        self.client.get(
+            url_for(
+                "admin.list_employees",
+                sort="username",
+                per_page=5,
+                after=self.get_context_variable("page").next_cursor,
+            )
+        )
+        second = self.get_context_variable("page")
+        self.client.get(
+            url_for(
+                "admin.list_employees",
+                sort="username",
+                per_page=5,
+                before=second.prev_cursor,
+            )
+        )
+        self.assertEqual([e.id for e in self.get_context_variable("page").items], first)
+
+    def walk(self, **args):
+        """Ids of the employees listed following the next links"""
+        seen = []
+        after = None
+        while True:
+            self.client.get(url_for("admin.list_employees", per_page=4, after=after, **args))
+            page = self.get_context_variable("page")
+            seen.extend(employee.id for employee in page.items)
+            if not page.has_next:
+                return seen
+            after = page.next_cursor
+
+    def test_null_values_across_pages(self):
+        """Employees without a value come last ascending and first descending"""
+        for employee in self.employees[::4]:
+            employee.last_name = None
+        db.session.commit()
+        self.login(self.admin)
+        rows = Employee.query.all()
+        named = sorted((e for e in rows if e.last_name), key=lambda e: (e.last_name, e.id))
+        unnamed = sorted(e.id for e in rows if e.last_name is None)
+        expected = [e.id for e in named] + unnamed
+        self.assertEqual(self.walk(sort="last_name"), expected)
+        self.assertEqual(self.walk(sort="last_name", order="desc"), expected[::-1])
+
+    def test_seek_uses_a_range(self):
+        """The rows after a cursor are sought with a range, not an OR"""
+        self.login(self.admin)
+        self.client.get(url_for("admin.list_employees", per_page=5))
+        after = self.get_context_variable("page").next_cursor
+        with count_queries() as collector:
+            self.client.get(url_for("admin.list_employees", per_page=5, after=after))
+        statement = next(s for s in collector.shapes if "last_name >=" in s)
+        self.assertNotIn(" OR ", statement)
+
+    def test_constant_query_count(self):
+        """The number of queries does not grow with the page size"""
+        self.login(self.admin)
+        self.client.get(url_for("admin.list_employees"))
+        small = self.count_queries(
+            lambda: self.client.get(url_for("admin.list_employees", per_page=2))
+        )
+        large = self.count_queries(
+            lambda: self.client.get(url_for("admin.list_employees", per_page=50))
+        )
+        self.assertEqual(small, large)
+
+    def test_invalid_cursor(self):
+        """A broken cursor is rejected"""
+        self.login(self.admin)
+        response = self.client.get(url_for("admin.list_employees", after="!!"))
+        self.assertEqual(response.status_code, 400)
+
+
+class TestHeadcounts(TestAdminBase):
+    """Check the department and role headcounts"""
+
+    def test_department_headcount(self):
+        """Headcounts match the number of assigned employees"""
+        counts = {department.name: count for department, count in Department.with_headcount()}
+        self.assertEqual(counts, {"Dept0": 9, "Dept1": 8, "Dept2": 8})
+
+    def test_role_headcount_includes_empty_roles(self):
+        """Roles without employees are listed with a zero headcount"""
+        counts = {role.name: count for role, count in Role.with_headcount()}
+        self.assertEqual(counts, {"Role0": 13, "Role1": 12, "Role2": 0})
+
+    def test_departments_view_query_count(self):
+        """The departments page does not query once per department"""
+        self.login(self.admin)
+        self.client.get(url_for("admin.list_departments"))
+        # every write makes the next render miss the fragment cache
+        db.session.add(Department(name="First", description="-"))
+        db.session.commit()
+        before = self.count_queries(lambda: self.client.get(url_for("admin.list_departments")))
+        db.session.add_all([Department(name="Extra%d" % i, description="-") for i in range(5)])
+        db.session.commit()
+        after = self.count_queries(lambda: self.client.get(url_for("admin.list_departments")))
+        self.assertEqual(before, after)
+
+
+class TestStats(TestAdminBase):
+    """Check the incrementally maintained dashboard statistics"""
+
+    def counters(self):
+        return {(row.dimension, row.group_id): row.headcount for row in HeadcountStat.query.all()}
+
+    def assertCountersRebuilt(self):
+        """The incremental counters equal a recomputation from employees"""
+        incremental = self.counters()
+        stats.rebuild(db.session)
+        self.assertEqual(incremental, self.counters())
+        db.session.rollback()
+
+    def test_counters(self):
+        """Admins are not counted, new roles start at zero"""
+        counters = self.counters()
+        self.assertEqual(counters["department", self.departments[0].id], 9)
+        self.assertEqual(counters["role", self.roles[2].id], 0)
+        self.assertEqual(counters["department", stats.UNASSIGNED], 0)
+        self.assertCountersRebuilt()
+
+    def test_assign_and_delete(self):
+        """Moving employees and deleting a department keep the counters exact"""
+        employee = self.employees[0]
+        employee.department = self.departments[1]
+        employee.role_id = None
+        db.session.commit()
+        db.session.delete(self.employees[1])
+        db.session.delete(self.departments[2])
+        db.session.commit()
+        counters = self.counters()
+        self.assertEqual(counters["department", self.departments[1].id], 8)
+        self.assertEqual(counters["department", stats.UNASSIGNED], 8)
+        self.assertEqual(counters["role", stats.UNASSIGNED], 1)
+        self.assertCountersRebuilt()
+
+    def test_rollback_discards_changes(self):
+        """Counters of a rolled back flush are not kept"""
+        before = self.counters()
+        self.employees[0].department = None
+        db.session.flush()
+        db.session.rollback()
+        self.assertEqual(self.counters(), before)
+
+    def test_import_updates_counters(self):
+        """Rows inserted by the importer are counted"""
+        data = "email,username,department\na@example.com,alice,Dept1\nb@example.com,bob,\n"
+        importer.import_employees(io.StringIO(data), "csv")
+        counters = self.counters()
+        self.assertEqual(counters["department", self.departments[1].id], 9)
+        self.assertEqual(counters["department", stats.UNASSIGNED], 1)
+        self.assertCountersRebuilt()
+
+    def test_rebuild_command(self):
+        """flask stats rebuild restores counters changed by hand"""
+        db.session.execute(db.update(HeadcountStat).values(headcount=0))
+        db.session.commit()
+        result = self.app.test_cli_runner().invoke(args=["stats", "rebuild"])
+        self.assertIn("Counted 25 employees", result.output)
+        self.assertEqual(self.counters()["role", self.roles[0].id], 13)
+
+    def test_stats_endpoint(self):
+        """The JSON is computed once per change and revalidated by ETag"""
+        self.login(self.admin)
+        response = self.client.get(url_for("home.admin_stats"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row["headcount"] for row in response.json["departments"]], [9, 8, 8])
+        self.assertEqual(response.json["unassigned"], {"department": 0, "role": 0})
+
+        g.pop("_table_versions", None)
+        etag = response.headers["ETag"]
+        hits = stats.summaries.hits
+        response = self.client.get(url_for("home.admin_stats"), headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(stats.summaries.hits, hits + 1)
+
+        self.employees[0].department = None
+        db.session.commit()
+        response = self.client.get(url_for("home.admin_stats"), headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["unassigned"]["department"], 1)
+
+    def test_stats_endpoint_admins_only(self):
+        self.login(self.employees[0])
+        response = self.client.get(url_for("home.admin_stats"))
+        self.assertEqual(response.status_code, 403)
+
+
+class FakeRedis(object):
+    """Local stand-in for redis.Redis"""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value.encode("utf-8")
+
+
+class TestFragmentCache(TestAdminBase):
+    """Check the template fragment cache and the table change counters"""
+
+    def versions(self):
+        return dict(db.session.query(TableVersion.name, TableVersion.version))
+
+    def test_commit_bumps_changed_tables(self):
+        """Only the tables written by a transaction get a new version"""
+        before = self.versions()
+        db.session.add(Role(name="Extra", description="-"))
+        db.session.commit()
+        db.session.execute(db.update(Employee).values(last_name="Bulk"))
+        db.session.commit()
+        after = self.versions()
+        self.assertEqual(after["roles"], before["roles"] + 1)
+        self.assertEqual(after["employees"], before["employees"] + 1)
+        self.assertEqual(after["departments"], before["departments"])
+
+    def test_listing_served_from_cache_until_changed(self):
+        """A cached listing skips its query and is refreshed by writes"""
+        self.login(self.admin)
+        self.client.get(url_for("admin.list_roles"))
+        with count_queries() as collector:
+            self.client.get(url_for("admin.list_roles"))
+        self.assertFalse([shape for shape in collector.shapes if "count(" in shape])
+
+        db.session.add(Role(name="Brand new role", description="-"))
+        db.session.commit()
+        response = self.client.get(url_for("admin.list_roles"))
+        self.assertIn("Brand new role", response.get_data(as_text=True))
+
+    def test_template_tag(self):
+        """The block is rendered once per key"""
+        template = self.app.jinja_env.from_string(
+            '{% cache "test", 60, "roles" %}{{ counter.append(1) or counter|length }}{% endcache %}'
+        )
+        counter = []
+        with self.app.test_request_context():
+            self.assertEqual(template.render(counter=counter), "1")
+            self.assertEqual(template.render(counter=counter), "1")
+
+    def test_shared_backends(self):
+        """Filesystem and Redis backends store fragments with their TTL"""
+        with tempfile.TemporaryDirectory() as directory:
+            for backend in (
+                fragments.FileSystemBackend(directory),
+                fragments.RedisBackend(FakeRedis()),
+            ):
+                self.assertIsNone(backend.get("key"))
+                backend.set("key", "<p>fragment</p>", 60)
+                self.assertEqual(backend.get("key"), "<p>fragment</p>")
+            backend = fragments.FileSystemBackend(directory)
+            backend.set("expired", "old", -1)
+            self.assertIsNone(backend.get("expired"))
+
+    def test_filesystem_backend_removes_old_fragments(self):
+        """Expired files are unlinked and the directory is kept to maxsize"""
+        with tempfile.TemporaryDirectory() as directory:
+            backend = fragments.FileSystemBackend(directory, maxsize=3, prune_every=5)
+            backend.set("expired", "old", -1)
+            self.assertIsNone(backend.get("expired"))
+            self.assertEqual(os.listdir(directory), [])
+
+            backend = fragments.FileSystemBackend(directory, maxsize=3, prune_every=5)
+            backend.set("expired", "old", -1)
+            for number in range(4):
+                backend.set("key%d" % number, "fragment", 60)
+                os.utime(backend._path("key%d" % number), (number, number))
+            self.assertEqual(len(os.listdir(directory)), 3)
+            self.assertIsNone(backend.get("key0"))
+            self.assertEqual(backend.get("key3"), "fragment")
+
+
+class TestAssets(TestBase):
+    """Check the fingerprinted static files"""
+
+    def setUp(self):
+        super(TestAssets, self).setUp()
+        self.static = tempfile.TemporaryDirectory()
+        os.makedirs(os.path.join(self.static.name, "css"))
+        os.makedirs(os.path.join(self.static.name, "fonts"))
+        with open(os.path.join(self.static.name, "fonts", "icons.ttf"), "wb") as font:
+            font.write(b"font" * 100)
+        with open(os.path.join(self.static.name, "css", "site.css"), "w") as css:
+            css.write("@font-face { src: url('../fonts/icons.ttf?v=1'); }\n" * 50)
+        self.manifest = assets.build(self.static.name)
+        self.app.static_folder = self.static.name
+        self.app.config["ASSETS_FINGERPRINT"] = True
+        assets.assets.init_app(self.app)
+
+    def tearDown(self):
+        super(TestAssets, self).tearDown()
+        self.static.cleanup()
+
+    def test_build_rewrites_stylesheets(self):
+        """Stylesheets refer to the fingerprinted files they use"""
+        font = self.manifest["fonts/icons.ttf"]
+        self.assertRegex(font, r"^fonts/icons\.[0-9a-f]{12}\.ttf$")
+        path = os.path.join(self.static.name, "dist", self.manifest["css/site.css"])
+        with open(path) as css:
+            self.assertIn("url('../%s?v=1')" % font, css.read())
+        self.assertTrue(os.path.exists(path + ".gz"))
+
+    def test_url_for_and_compressed_response(self):
+        """url_for points to the hashed file, served compressed and immutable"""
+        url = url_for("static", filename="css/site.css")
+        self.assertIn("/dist/" + self.manifest["css/site.css"], url)
+        response = self.client.get(url, headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertEqual(response.mimetype, "text/css")
+        self.assertIn("immutable", response.headers["Cache-Control"])
+        self.assertIn("Accept-Encoding", response.headers["Vary"])
+        plain = self.client.get(url)
+        self.assertNotIn("Content-Encoding", plain.headers)
+        self.assertIn(b"@font-face", plain.data)
+        plain.close()
+        response.close()
+
+
+class TestUserLoader(TestAdminBase):
+    """Check the cached flask-login user loader"""
+
+    def test_second_load_is_a_cache_hit(self):
+        """Loading the same user twice queries the database once"""
+        user_id = str(self.employees[0].id)
+        first = self.count_queries(lambda: load_user(user_id))
+        second = self.count_queries(lambda: load_user(user_id))
+        self.assertEqual((first, second), (1, 0))
+        self.assertEqual(principals.stats()["hits"], 1)
+        self.assertEqual(load_user(user_id).username, self.employees[0].username)
+
+    def test_update_invalidates(self):
+        """Writing an employee drops its cached principal"""
+        employee = self.employees[0]
+        load_user(str(employee.id))
+        employee.role = self.roles[2]
+        db.session.commit()
+        self.assertEqual(load_user(str(employee.id)).role_id, self.roles[2].id)
+
+    def test_invalidated_on_commit_only(self):
+        """A principal stays cached until the write commits, and after a rollback"""
+        employee = self.employees[0]
+        load_user(str(employee.id))
+        employee.role = self.roles[2]
+        db.session.flush()
+        self.assertIsNotNone(principals.get(employee.id))
+        db.session.rollback()
+        self.assertIsNotNone(principals.get(employee.id))
+
+        employee.role = self.roles[2]
+        db.session.commit()
+        self.assertIsNone(principals.get(employee.id))
+
+    def test_bulk_assign_invalidates_on_commit(self):
+        """Principals assigned in bulk are dropped once the assignment commits"""
+        employee = self.employees[0]
+        load_user(str(employee.id))
+        assignments.assign_employees({"role_id": self.roles[2].id}, ids=[employee.id])
+        self.assertIsNotNone(principals.get(employee.id))
+        db.session.commit()
+        self.assertIsNone(principals.get(employee.id))
+
+    def test_unknown_user(self):
+        """Unknown ids load as None and are not cached"""
+        self.assertIsNone(load_user("9999"))
+        self.assertEqual(len(principals), 0)
+
+
+class TestPasswords(TestAdminBase):
+    """Check password hashing and rehash on login"""
+
+    def test_password_uses_configured_method(self):
+        """New hashes are made with PASSWORD_HASH_METHOD"""
+        self.assertTrue(self.admin.password_hash.startswith("pbkdf2:sha256:1000$"))
+        self.assertTrue(self.admin.verify_password("admin2017"))
+        self.assertFalse(self.admin.verify_password("wrong"))
+
+    def test_production_hash_fits_column(self):
+        """Hashes of the production method fit employees.password_hash"""
+        pwhash = generate_password_hash("x", app_config["production"].PASSWORD_HASH_METHOD)
+        self.assertLessEqual(len(pwhash), Employee.password_hash.type.length)
+
+    def test_outdated_hash_is_upgraded_on_login(self):
+        """Logging in with an outdated hash stores a new one"""
+        employee = self.employees[0]
+        employee.password_hash = generate_password_hash("user2017", "pbkdf2:sha256:2000")
+        db.session.commit()
+        self.assertTrue(employee.password_needs_rehash())
+
+        response = self.client.post(
+            url_for("auth.login"), data={"username": employee.username, "password": "user2017"}
+        )
+        self.assertEqual(response.location, url_for("home.dashboard"))
+        db.session.refresh(employee)
+        self.assertFalse(employee.password_needs_rehash())
+        self.assertTrue(employee.verify_password("user2017"))
+
+    def test_bare_method_does_not_rehash(self):
+        """Hashes of a method named without its cost are not made again"""
+        for method in ("pbkdf2:sha256", "scrypt"):
+            self.app.config.update(PASSWORD_HASH_METHOD=method)
+            hasher.init_app(self.app)
+            self.assertFalse(hasher.needs_rehash(hasher.hash("secret")))
+            self.assertTrue(hasher.needs_rehash(self.admin.password_hash))
+
+
+class TestImport(TestAdminBase):
+    """Check the bulk employee import"""
+
+    CSV = (
+        "email,username,first_name,last_name,password,department,role\n"
+        "a@example.com,alice,Alice,A,secret,Dept1,Role0\n"
+        "b@example.com,bob,Bob,B,,,\n"
+        "not-an-email,carol,Carol,C,,,\n"
+        "d@example.com,user00,Dave,D,,,\n"
+        "b@example.com,bobby,Bob,B,,,\n"
+        "e@example.com,erin,Erin,E,,Nowhere,\n"
+    )
+
+    def test_import_csv(self):
+        """Valid rows are inserted and every other row is reported"""
+        errors = importer.ErrorSample()
+        result = importer.import_employees(
+            io.StringIO(self.CSV), "csv", errors=errors, chunk_size=2
+        )
+        self.assertEqual((result.read, result.inserted, result.errors), (6, 2, 4))
+        self.assertEqual(sorted(line for line, username, email, error in errors), [4, 5, 6, 7])
+
+        alice = Employee.query.filter_by(username="alice").one()
+        self.assertEqual(alice.department.name, "Dept1")
+        self.assertTrue(alice.verify_password("secret"))
+        self.assertIsNone(Employee.query.filter_by(username="bob").one().password_hash)
+
+    def test_import_ndjson(self):
+        """NDJSON rows are imported and unreadable lines rejected"""
+        data = '{"email": "a@example.com", "username": "alice"}\n[1, 2]\n{broken\n'
+        result = importer.import_employees(io.StringIO(data), "ndjson")
+        self.assertEqual((result.read, result.inserted, result.errors), (3, 1, 2))
+
+    def test_import_command(self):
+        """The CLI writes an error file next to the imported file"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "employees.csv")
+            with open(path, "w") as stream:
+                stream.write(self.CSV)
+            result = self.app.test_cli_runner().invoke(args=["employees", "import", path])
+            self.assertIn("inserted 2, rejected 4", result.output)
+            with open(path + ".errors.csv") as stream:
+                self.assertEqual(len(list(csv.reader(stream))), 5)
+
+    def test_import_view(self):
+        """Admins can upload a file"""
+        self.login(self.admin)
+        response = self.client.post(
+            url_for("admin.import_employees"),
+            data={"file": (io.BytesIO(self.CSV.encode()), "employees.csv")},
+            content_type="multipart/form-data",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_context_variable("result").inserted, 2)
+
+    def test_unreadable_file(self):
+        """A file that stops being UTF-8 stops the import with its line number"""
+        data = self.CSV.encode().replace(b"Erin", b"\xff\xfe")
+        with self.assertRaises(importer.ImportFileError) as raised:
+            stream = io.TextIOWrapper(
+                io.BytesIO(data), encoding="utf-8", errors="surrogateescape", newline=""
+            )
+            importer.import_employees(stream, "csv", chunk_size=2)
+        self.assertIn("Line 7", str(raised.exception))
+        self.assertEqual(raised.exception.result.inserted, 2)
+
+        self.login(self.admin)
+        response = self.client.post(
+            url_for("admin.import_employees"),
+            data={"file": (io.BytesIO(b"email\n\xff\n"), "employees.csv")},
+            content_type="multipart/form-data",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"The import stopped", response.data)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "employees.csv")
+            with open(path, "wb") as stream:
+                stream.write(data)
+            result = self.app.test_cli_runner().invoke(args=["employees", "import", path])
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn("Line 7: not UTF-8 text. 0 employees were imported before.", result.output)
+
+
+@jobs.jobs.task("tests.fail", max_attempts=2)
+def failing_task(message):
+    raise RuntimeError(message)
+
+
+class TestJobs(TestAdminBase):
+    """Check the database backed job queue"""
+
+    def run_worker(self):
+        jobs.Worker(self.app, concurrency=2, burst=True).run()
+        db.session.expire_all()
+
+    def test_worker_runs_jobs(self):
+        job = jobs.jobs.enqueue("rebuild_stats")
+        db.session.commit()
+        self.run_worker()
+        self.assertEqual(job.status, jobs.DONE)
+        self.assertEqual(job.to_dict()["result"], {"counted": 25})
+        self.assertIsNone(jobs.jobs.claim("test"))
+
+    def test_retries_with_backoff(self):
+        job = jobs.jobs.enqueue("tests.fail", message="boom")
+        db.session.commit()
+        jobs.jobs.run(jobs.jobs.claim("test"))
+        self.assertEqual((job.status, job.attempts), (jobs.QUEUED, 1))
+        self.assertEqual(job.error, "RuntimeError: boom")
+        self.assertGreater(job.run_at, job.created_at)
+        # not due before its backoff has passed
+        self.assertIsNone(jobs.jobs.claim("test"))
+
+        job.run_at = job.created_at
+        db.session.commit()
+        jobs.jobs.run(jobs.jobs.claim("test"))
+        self.assertEqual((job.status, job.attempts), (jobs.FAILED, 2))
+
+    def test_lost_jobs_are_claimed_again(self):
+        job = jobs.jobs.enqueue("rebuild_stats")
+        db.session.commit()
+        self.assertEqual(jobs.jobs.claim("first").id, job.id)
+        self.assertIsNone(jobs.jobs.claim("second"))
+        job.locked_at -= datetime.timedelta(seconds=self.app.config["JOB_TIMEOUT"] + 1)
+        db.session.commit()
+        self.assertEqual(jobs.jobs.claim("second").locked_by, "second")
+
+    def test_heartbeat_renews_the_lock(self):
+        """A job running past JOB_TIMEOUT is not claimed again while its worker lives"""
+        self.app.config.update(JOB_HEARTBEAT=0.01)
+        job = jobs.jobs.enqueue("rebuild_stats")
+        db.session.commit()
+        jobs.jobs.claim("first")
+        job.locked_at -= datetime.timedelta(seconds=self.app.config["JOB_TIMEOUT"] + 1)
+        db.session.commit()
+
+        stopping = threading.Event()
+        beat = threading.Thread(
+            target=jobs.jobs.heartbeat, args=(self.app, job.id, "first", stopping)
+        )
+        beat.start()
+        stopping.wait(0.1)
+        stopping.set()
+        beat.join()
+        db.session.expire_all()
+        self.assertIsNone(jobs.jobs.claim("second"))
+
+    def test_files_dir_under_instance_folder(self):
+        """A relative JOB_FILES_DIR is resolved under the instance folder"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.app.config.update(JOB_FILES_DIR="uploads")
+        with mock.patch.object(self.app, "instance_path", directory):
+            self.assertEqual(jobs.jobs.files_dir(), os.path.join(directory, "uploads"))
+        self.assertTrue(os.path.isdir(os.path.join(directory, "uploads")))
+
+    def test_failed_import_removes_file_on_last_attempt(self):
+        """The uploaded file is kept for retries, and deleted once the job failed"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "employees.xml")
+        with open(path, "w") as stream:
+            stream.write("<employees/>")
+        self.app.config.update(JOB_MAX_ATTEMPTS=2, JOB_FILES_DIR=directory)
+        job = jobs.jobs.enqueue("import_employees", path="employees.xml", fmt="xml")
+        db.session.commit()
+
+        jobs.jobs.run(jobs.jobs.claim("test"))
+        self.assertEqual(job.status, jobs.QUEUED)
+        self.assertTrue(os.path.exists(path))
+        job.run_at = job.created_at
+        db.session.commit()
+        jobs.jobs.run(jobs.jobs.claim("test"))
+        self.assertEqual(job.status, jobs.FAILED)
+        self.assertFalse(os.path.exists(path))
+
+    def test_large_import_runs_in_background(self):
+        self.login(self.admin)
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.app.config.update(IMPORT_INLINE_MAX_BYTES=10, JOB_FILES_DIR=directory)
+        response = self.client.post(
+            url_for("admin.import_employees"),
+            data={"file": (io.BytesIO(TestImport.CSV.encode()), "employees.csv")},
+            content_type="multipart/form-data",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(self.get_context_variable("result"))
+        job = self.get_context_variable("job")
+        self.assertEqual(os.listdir(directory), [json.loads(job.payload)["path"]])
+        url = url_for("api.get_job", id=job.id)
+        self.assertEqual(self.client.get(url).json["status"], jobs.QUEUED)
+
+        self.run_worker()
+        status = self.client.get(url).json
+        self.assertEqual(status["status"], jobs.DONE)
+        self.assertEqual(status["result"]["inserted"], 2)
+        self.assertEqual(len(status["result"]["rejected"]), 4)
+        self.assertEqual(os.listdir(directory), [])
+
+
+class TestSeed(TestBase):
+    """Check the synthetic data generator"""
+
+    def setUp(self):
+        db.create_all()
+
+    def seed(self, *args):
+        result = self.app.test_cli_runner().invoke(args=["seed", "--seed", "3"] + list(args))
+        self.assertEqual(result.exit_code, 0, result.output)
+        return [
+            (employee.username, employee.department_id, employee.role_id)
+            for employee in Employee.query.order_by(Employee.id)
+        ]
+
+    def test_seed_command(self):
+        """Skewed groups, the load test accounts and rebuilt statistics"""
+        rows = self.seed("--departments", "4", "--roles", "3", "--employees", "200")
+        self.assertEqual(len(rows), 202)
+        self.assertEqual((Department.query.count(), Role.query.count()), (4, 3))
+        admin = Employee.query.filter_by(username="admin").one()
+        user = Employee.query.filter_by(username="jdoe").one()
+        self.assertTrue(admin.is_admin)
+        self.assertFalse(user.is_admin)
+        self.assertTrue(user.verify_password("password"))
+
+        headcounts = {
+            row.group_id: row.headcount
+            for row in HeadcountStat.query.filter_by(dimension="department")
+        }
+        self.assertEqual(sum(headcounts.values()), 201)
+        ranked = [department.id for department in Department.query.order_by(Department.id)]
+        self.assertGreater(headcounts[ranked[0]], headcounts[ranked[-1]])
+
+    def test_reproducible(self):
+        """The same seed on an empty database gives the same rows"""
+        first = self.seed("--employees", "30", "--batch-size", "7")
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        self.assertEqual(self.seed("--employees", "30", "--batch-size", "7"), first)
+        self.assertEqual(seed.group_names(("A", "B"), 3, {"B"}), ["A", "A 2", "B 2"])
+
+
+class TestExport(TestAdminBase):
+    """Check the streaming export"""
+
+    def test_export_employees_csv(self):
+        """Employees are exported with their department and role names"""
+        self.login(self.admin)
+        response = self.client.get(url_for("admin.export", entity="employees", fmt="csv"))
+        self.assertEqual(response.mimetype, "text/csv")
+        rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+        self.assertEqual(len(rows), 26)
+        self.assertEqual((rows[1]["department"], rows[1]["role"]), ("Dept0", "Role0"))
+        self.assertNotIn("password_hash", rows[0])
+
+    def test_export_command(self):
+        """The CLI writes NDJSON"""
+        result = self.app.test_cli_runner().invoke(
+            args=["export", "departments", "--format", "ndjson"]
+        )
+        lines = result.output.splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertIn('"name": "Dept0"', lines[0])
+
+    def test_unknown_entity(self):
+        """Only the known tables can be exported"""
+        self.login(self.admin)
+        response = self.client.get(url_for("admin.export", entity="secrets", fmt="csv"))
+        self.assertEqual(response.status_code, 404)
+
+
+class TestApi(TestAdminBase):
+    """Check the JSON API"""
+
+    def test_requires_admin(self):
+        """Anonymous calls get a 401 and non-admins a 403"""
+        response = self.client.get(url_for("api.list_resource", resource="roles"))
+        self.assertEqual(response.status_code, 401)
+        self.login(self.employees[0])
+        response = self.client.get(url_for("api.list_resource", resource="roles"))
+        self.assertEqual(response.status_code, 403)
+
+    def test_list_pages_and_not_modified(self):
+        """Lists are paginated and answer 304 to a matching If-None-Match"""
+        self.login(self.admin)
+        response = self.client.get(url_for("api.list_resource", resource="employees", per_page=10))
+        self.assertEqual(len(response.json["items"]), 10)
+        self.assertIn('rel="next"', response.headers["Link"])
+
+        etag = response.headers["ETag"]
+        url = url_for("api.list_resource", resource="employees", per_page=10)
+        response = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+
+        self.employees[0].first_name = "Changed"
+        db.session.commit()
+        response = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+
+    def test_if_modified_since(self):
+        """Without If-None-Match the Last-Modified date is checked"""
+        self.login(self.admin)
+        url = url_for("api.get_resource_item", resource="roles", id=self.roles[0].id)
+        last_modified = self.client.get(url).headers["Last-Modified"]
+        response = self.client.get(url, headers={"If-Modified-Since": last_modified})
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(
+            url, headers={"If-Modified-Since": "Mon, 01 Jan 2001 00:00:00 GMT"}
+        )
+        self.assertEqual(response.status_code, 200)
+        # an ETag that does not match wins over a matching date
+        response = self.client.get(
+            url, headers={"If-Modified-Since": last_modified, "If-None-Match": '"old"'}
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_put_replaces_whole_resource(self):
+        """PUT needs every field but the password, PATCH any of them"""
+        self.login(self.admin)
+        employee = self.employees[0]
+        url = url_for("api.get_resource_item", resource="employees", id=employee.id)
+        response = self.client.put(url, json={"first_name": "Only"})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("last_name", response.json["message"])
+
+        body = {
+            "email": "new@example.com",
+            "username": "newname",
+            "first_name": "New",
+            "last_name": None,
+            "department_id": None,
+            "role_id": self.roles[1].id,
+        }
+        response = self.client.put(url, json=body)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["username"], "newname")
+        self.assertIsNone(response.json["last_name"])
+        self.assertEqual(self.client.patch(url, json={"first_name": "Patched"}).status_code, 200)
+
+    def test_create_update_delete(self):
+        """Resources can be created, updated and deleted"""
+        self.login(self.admin)
+        response = self.client.post(
+            url_for("api.list_resource", resource="departments"),
+            json={"name": "Sales", "description": "Sales"},
+        )
+        self.assertEqual(response.status_code, 201)
+        url = response.headers["Location"]
+        etag = response.headers["ETag"]
+
+        response = self.client.patch(url, json={"description": "More sales"})
+        self.assertEqual(response.json["version"], 2)
+
+        # the first ETag is outdated now
+        response = self.client.delete(url, headers={"If-Match": etag})
+        self.assertEqual(response.status_code, 412)
+        response = self.client.delete(url, headers={"If-Match": response.headers.get("ETag", "*")})
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_validation(self):
+        """Invalid bodies, duplicates and admin assignment are refused"""
+        self.login(self.admin)
+        url = url_for("api.list_resource", resource="roles")
+        self.assertEqual(self.client.post(url, json={"name": 3}).status_code, 400)
+        self.assertEqual(self.client.post(url, json={"name": "Role0"}).status_code, 409)
+
+        url = url_for("api.get_resource_item", resource="employees", id=self.admin.id)
+        response = self.client.patch(url, json={"role_id": self.roles[0].id})
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.json["error"], "Forbidden")
+
+
+class TestSearch(TestAdminBase):
+    """Check the employee search and autocomplete"""
+
+    def test_prefix_matches_any_column(self):
+        """Prefixes match names, usernames and emails regardless of case"""
+        names = [employee.username for employee in search.search_employees("LAST6")]
+        self.assertEqual(sorted(names), ["user06", "user13", "user20"])
+        self.assertEqual(len(search.search_employees("user1", limit=10)), 10)
+        self.assertEqual(search.search_employees("user1@")[0].username, "user01")
+
+    def test_substring_fallback_and_escaping(self):
+        """Terms matching no prefix fall back, LIKE wildcards are literal"""
+        self.assertEqual(len(search.search_employees("example.com", limit=5)), 5)
+        self.assertEqual(search.search_employees("user_"), [])
+        self.assertEqual(search.search_employees("  "), [])
+
+    def test_autocomplete(self):
+        """Suggestions are JSON, for admins only"""
+        url = url_for("admin.autocomplete_employees", q="first2")
+        self.login(self.employees[0])
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.login(self.admin)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        suggestions = response.get_json()
+        self.assertIn("First2 Last2", [suggestion["name"] for suggestion in suggestions])
+        self.assertEqual(len(suggestions), 6)
+        self.assertIn("private", response.headers["Cache-Control"])
+
+    def test_search_page(self):
+        """The search page lists the matches with their department"""
+        self.login(self.admin)
+        response = self.client.get(url_for("admin.search_employees", q="user07"))
+        text = response.get_data(as_text=True)
+        self.assertIn("user7@example.com", text)
+        self.assertIn("Dept1", text)
+        self.assertNotIn("user08", text)
+
+
+class TestAssignEmployee(TestAdminBase):
+    """Check the assign form and its cached choices"""
+
+    def test_choices_are_cached(self):
+        """Rendering the form twice reads the departments once"""
+        self.login(self.admin)
+        url = url_for("admin.assign_employee", id=self.employees[0].id)
+        self.client.get(url)
+        first = self.count_queries(lambda: self.client.get(url))
+        refdata.invalidate()
+        second = self.count_queries(lambda: self.client.get(url))
+        self.assertEqual(first + 2, second)
+
+    def test_assign(self):
+        """Posting the form assigns the department and role"""
+        self.login(self.admin)
+        employee = self.employees[0]
+        response = self.client.post(
+            url_for("admin.assign_employee", id=employee.id),
+            data={"department_id": self.departments[2].id, "role_id": self.roles[2].id},
+        )
+        self.assertEqual(response.status_code, 302)
+        db.session.refresh(employee)
+        self.assertEqual((employee.department, employee.role), (self.departments[2], self.roles[2]))
+
+    def test_new_department_is_a_valid_choice(self):
+        """Committing a department invalidates the cached choices"""
+        self.login(self.admin)
+        self.assertEqual(len(refdata.choices(Department)), 3)
+        department = Department(name="New", description="-")
+        db.session.add(department)
+        db.session.commit()
+        self.assertIn((department.id, "New"), refdata.choices(Department))
+
+    def test_unknown_choice(self):
+        """Ids that do not exist are refused"""
+        self.login(self.admin)
+        response = self.client.post(
+            url_for("admin.assign_employee", id=self.employees[0].id),
+            data={"department_id": 999, "role_id": self.roles[0].id},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"Not a valid choice", response.data)
+
+
+class TestBulkAssign(TestAdminBase):
+    """Check the set-based assignment of many employees"""
+
+    def test_assign_by_ids(self):
+        """Only employees whose values change are updated and versioned"""
+        moved, kept = self.employees[0], self.employees[3]
+        ids = [moved.id, kept.id]
+        values = {"department_id": self.departments[0].id, "role_id": self.roles[1].id}
+        principals.set(moved.id, "stale")
+        with assert_max_queries(3):
+            result = assignments.assign_employees(values, ids=ids)
+        db.session.commit()
+        self.assertEqual((result.matched, result.updated), (2, 1))
+        self.assertEqual((moved.role, moved.version), (self.roles[1], 2))
+        self.assertEqual(kept.version, 1)
+        self.assertIsNone(principals.get(moved.id))
+
+    def test_assign_by_filter(self):
+        """A filter moves everyone matching it and the statistics follow"""
+        result = assignments.assign_employees(
+            {"department_id": None}, where={"department_id": self.departments[0].id}
+        )
+        db.session.commit()
+        self.assertEqual(result.updated, 9)
+        self.assertEqual(self.departments[0].employees.count(), 0)
+        counters = {(row.dimension, row.group_id): row.headcount for row in HeadcountStat.query}
+        self.assertEqual(counters["department", stats.UNASSIGNED], 9)
+        self.assertEqual(counters["department", self.departments[0].id], 0)
+
+    def test_admins_cannot_be_assigned(self):
+        with self.assertRaises(assignments.AdminAssignmentError):
+            assignments.assign_employees(
+                {"role_id": self.roles[0].id}, ids=[self.admin.id, self.employees[0].id]
+            )
+        result = assignments.assign_employees(
+            {"role_id": self.roles[0].id}, where={"department_id": None}
+        )
+        self.assertEqual(result.matched, 0)
+
+    def test_api(self):
+        self.login(self.admin)
+        url = url_for("api.assign_employees")
+        response = self.client.post(
+            url, json={"filter": {"role_id": self.roles[1].id}, "role_id": self.roles[2].id}
+        )
+        self.assertEqual(response.json, {"matched": 12, "updated": 12})
+        self.assertEqual(self.client.post(url, json={"role_id": 1}).status_code, 400)
+        response = self.client.post(url, json={"ids": [1, "2"], "role_id": self.roles[0].id})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(url, json={"ids": [self.admin.id], "role_id": None})
+        self.assertEqual(response.status_code, 403)
+
+    def test_view(self):
+        self.login(self.admin)
+        response = self.client.post(
+            url_for("admin.bulk_assign_employees"),
+            data={
+                "employee_ids": "%d, %d" % (self.employees[0].id, self.employees[1].id),
+                "from_department_id": 0,
+                "from_role_id": 0,
+                "department_id": self.departments[2].id,
+                "role_id": 0,
+            },
+        )
+        self.assertEqual(response.status_code, 302)
+        db.session.expire_all()
+        self.assertEqual(self.employees[1].department, self.departments[2])
+        self.assertEqual(self.employees[1].role, self.roles[1])
+
+    def test_view_requires_a_selection(self):
+        self.login(self.admin)
+        response = self.client.post(
+            url_for("admin.bulk_assign_employees"),
+            data={"from_department_id": 0, "from_role_id": 0, "department_id": 0, "role_id": 0},
+        )
+        self.assertIn(b"Select employees by id, department or role.", response.data)
+
+
+class TestDeleteGroup(TestAdminBase):
+    """Check that deleting departments and roles never loads their employees"""
+
+    def test_unassigns_employees(self):
+        self.login(self.admin)
+        department = self.departments[0]
+        url = url_for("admin.delete_department", id=department.id)
+        db.session.expire_all()
+        with count_queries() as collector:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 302)
+        updates = [shape for shape in collector.shapes if shape.startswith("UPDATE employees")]
+        self.assertEqual(len(updates), 1)
+        # one statement on the department, not a list of the employee ids
+        self.assertNotIn(" IN (", updates[0])
+        self.assertEqual(Employee.query.filter_by(department_id=None, is_admin=False).count(), 9)
+        counters = {(row.dimension, row.group_id): row.headcount for row in HeadcountStat.query}
+        self.assertEqual(counters["department", stats.UNASSIGNED], 9)
+        self.assertNotIn(("department", department.id), counters)
+
+    def test_unassigned_employees_change_etag(self):
+        self.login(self.admin)
+        employee = self.employees[0]
+        url = url_for("api.get_resource_item", resource="employees", id=employee.id)
+        etag = self.client.get(url).headers["ETag"]
+        self.client.get(url_for("admin.delete_department", id=employee.department_id))
+        response = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.json["department_id"])
+
+    def test_api_delete_changes_etag_and_principal(self):
+        self.login(self.admin)
+        employee = self.employees[0]
+        load_user(str(employee.id))
+        url = url_for("api.get_resource_item", resource="employees", id=employee.id)
+        etag = self.client.get(url).headers["ETag"]
+        response = self.client.delete(
+            url_for("api.delete_resource", resource="departments", id=employee.department_id)
+        )
+        self.assertEqual(response.status_code, 204)
+        response = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.json["department_id"])
+        self.assertIsNone(principals.get(employee.id))
+        self.assertIsNone(load_user(str(employee.id)).department_id)
+
+    def test_reassign_to_target(self):
+        self.login(self.admin)
+        role, target = self.roles[0], self.roles[2]
+        response = self.client.post(
+            url_for("admin.delete_role", id=role.id), data={"reassign_to": target.id}
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(target.employees.count(), 13)
+        self.assertIsNone(db.session.get(Role, role.id))
+
+    def test_reassign_to_itself(self):
+        self.login(self.admin)
+        role = self.roles[0]
+        response = self.client.post(
+            url_for("admin.delete_role", id=role.id), data={"reassign_to": role.id}
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(role.employees.count(), 13)
+
+
+class TestUniqueness(TestAdminBase):
+    """Check the registration uniqueness checks"""
+
+    def register(self, username, email):
+        return self.client.post(
+            url_for("admin.register"),
+            data={
+                "email": email,
+                "username": username,
+                "first_name": "New",
+                "last_name": "Employee",
+                "password": "secret",
+                "confirm_password": "secret",
+            },
+        )
+
+    def test_bloom_filter(self):
+        """Added values are always found and most others are not"""
+        bloom = BloomFilter(1000, 0.01)
+        for i in range(1000):
+            bloom.add("value%d" % i)
+        self.assertTrue(all("value%d" % i in bloom for i in range(1000)))
+        false_positives = sum("other%d" % i in bloom for i in range(1000))
+        self.assertLess(false_positives, 50)
+
+    def test_taken(self):
+        """Both values are checked with a single query"""
+        uniqueness.warm()
+        queries = self.count_queries(
+            lambda: self.assertEqual(
+                uniqueness.taken("user00", "user1@example.com"), {"username", "email"}
+            )
+        )
+        self.assertEqual(queries, 1)
+
+    def test_new_values_skip_the_database(self):
+        """Values the Bloom filter never saw are not queried"""
+        uniqueness.warm()
+        queries = self.count_queries(
+            lambda: self.assertEqual(uniqueness.taken("newcomer", "new@example.com"), set())
+        )
+        self.assertEqual(queries, 0)
+
+    def test_built_in_the_background(self):
+        """Checks query the database until start() has built the filter"""
+        self.assertEqual(self.count_queries(lambda: uniqueness.taken("newcomer", None)), 1)
+        uniqueness.start(self.app)
+        for _ in range(100):
+            if uniqueness._current_bloom() is not None:
+                break
+            uniqueness._thread.join(0.05)
+        self.assertEqual(self.count_queries(lambda: uniqueness.taken("newcomer", None)), 0)
+        uniqueness.start(self.app)
+        self.assertEqual(
+            [thread.name for thread in threading.enumerate()].count("uniqueness-bloom"), 1
+        )
+
+    def test_register_taken_username(self):
+        """Registering a taken username shows an error"""
+        self.login(self.admin)
+        response = self.register("user00", "new@example.com")
+        self.assertIn(b"Username is already in use.", response.data)
+
+    def test_register_race(self):
+        """Values the filter missed are caught by the unique index"""
+        self.login(self.admin)
+        uniqueness.warm()
+        # inserted behind the back of the filter, as another worker would
+        db.session.execute(
+            Employee.__table__.insert().values(username="racer", email="racer@example.com")
+        )
+        db.session.commit()
+        response = self.register("racer", "racer2@example.com")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"email or username is already in use", response.data)
+
+    def test_register(self):
+        """New employees are added to the filter"""
+        self.login(self.admin)
+        response = self.register("newcomer", "new@example.com")
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(uniqueness.taken("newcomer", None), {"username"})
+
+    def test_renamed_employee(self):
+        """Usernames and emails given by an update are added to the filter"""
+        uniqueness.warm()
+        employee = self.employees[0]
+        employee.username = "renamed"
+        employee.email = "renamed@example.com"
+        db.session.commit()
+        self.assertEqual(uniqueness.taken("renamed", "renamed@example.com"), {"username", "email"})
+
+
+class TestStartup(TestBase):
+    """Check the startup profiler and the lazily initialised components"""
+
+    def test_migrate_only_under_cli(self):
+        """Flask-Migrate is not set up for a serving worker"""
+        self.assertNotIn("migrate", self.app.extensions)
+
+    def test_profile_steps(self):
+        """Enabled profiles record their steps, disabled ones nothing"""
+        profile = startup.StartupProfile(enabled=True)
+        with profile.step("models"):
+            pass
+        self.assertEqual([name for name, ms in profile.steps], ["models"])
+        disabled = startup.StartupProfile()
+        with disabled.step("models"):
+            pass
+        self.assertEqual(disabled.steps, [])
+        self.assertIn("startup_profile", self.app.extensions)
+
+
+class TestGunicornConfig(TestBase):
+    """Check gunicorn.conf.py"""
+
+    def load(self, **environ):
+        saved = dict(os.environ)
+        os.environ.update(environ, FLASK_CONFIG="testing")
+        try:
+            return runpy.run_path(os.path.join(os.path.dirname(__file__), "gunicorn.conf.py"))
+        finally:
+            os.environ.clear()
+            os.environ.update(saved)
+
+    def test_workers_from_cpus_or_environment(self):
+        """Threaded workers default to one per CPU, WEB_CONCURRENCY wins"""
+        conf = self.load()
+        self.assertEqual(conf["worker_class"], "gthread")
+        self.assertEqual(conf["workers"], conf["cpu_count"]())
+        self.assertEqual(conf["default_workers"]("sync", 4), 9)
+        self.assertEqual(self.load(WEB_CONCURRENCY="3")["workers"], 3)
+
+    def test_post_fork_gives_worker_a_new_pool(self):
+        """Forked workers do not reuse the connections of the master"""
+        conf = self.load()
+        app = self.app
+
+        class Worker(object):
+            class app(object):
+                @staticmethod
+                def wsgi():
+                    return app
+
+        class Server(object):
+            class cfg(object):
+                preload_app = True
+
+        pool = db.engine.pool
+        with mock.patch.object(uniqueness, "start") as start:
+            conf["post_fork"](Server, Worker)
+        self.assertIsNot(db.engine.pool, pool)
+        start.assert_called_once_with(app)
+
+
+class TestReplicaRouting(TestAdminBase):
+    """Check that read-only work goes to the replica, writes to the primary"""
+
+    def create_app(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.primary = os.path.join(self.directory.name, "primary.db")
+        self.replica = os.path.join(self.directory.name, "replica.db")
+        saved = dict(os.environ)
+        os.environ.update(FLASK_DB="sqlite:///" + self.primary)
+        os.environ.update(FLASK_DB_REPLICAS="sqlite:///" + self.replica)
+        try:
+            return create_app("testing")
+        finally:
+            os.environ.clear()
+            os.environ.update(saved)
+
+    def setUp(self):
+        super(TestReplicaRouting, self).setUp()
+        # the replica starts as a copy and then misses the last write
+        shutil.copy(self.primary, self.replica)
+        db.session.add(Role(name="Primary only", description="-"))
+        db.session.commit()
+        self.login(self.admin)
+
+    def tearDown(self):
+        super(TestReplicaRouting, self).tearDown()
+        for engine in db.engines.values():
+            engine.dispose()
+        # the extension keeps a metadata per bind key across applications
+        db.metadatas.pop("replica0", None)
+        self.directory.cleanup()
+
+    def test_binds(self):
+        """Reads inside replica_reads use the replica, writes never do"""
+        with self.app.test_request_context():
+            self.assertIs(db.session.get_bind(), db.engines[None])
+            with database.replica_reads():
+                self.assertIs(db.session.get_bind(), db.engines["replica0"])
+                statement = db.update(Role).values(description="x")
+                self.assertIs(db.session.get_bind(clause=statement), db.engines[None])
+
+    def test_listing_reads_replica(self):
+        """The read-only listing is served by the replica"""
+        response = self.client.get(url_for("admin.list_roles"))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("Primary only", response.get_data(as_text=True))
+
+    def test_reads_own_writes(self):
+        """After a write the client reads from the primary"""
+        response = self.client.post(
+            url_for("admin.add_role"), data={"name": "Fresh role", "description": "-"}
+        )
+        self.assertEqual(response.status_code, 302)
+        text = self.client.get(url_for("admin.list_roles")).get_data(as_text=True)
+        self.assertIn("Fresh role", text)
+        self.assertIn("Primary only", text)
+
+
+class TestDatabaseEngine(unittest.TestCase):
+    """Check the engine options and pool instrumentation"""
+
+    def test_engine_options(self):
+        """Pool settings apply to PostgreSQL and explicit options win"""
+        config = {
+            "SQLALCHEMY_DATABASE_URI": "postgresql://db/app",
+            "DB_POOL_SIZE": 20,
+            "DB_POOL_PRE_PING": True,
+            "SQLALCHEMY_ENGINE_OPTIONS": {"pool_recycle": 60},
+        }
+        options = database.engine_options(config)
+        self.assertIs(options["poolclass"], database.InstrumentedQueuePool)
+        self.assertEqual((options["pool_size"], options["pool_recycle"]), (20, 60))
+        self.assertTrue(options["pool_pre_ping"])
+
+    def test_pgbouncer_options(self):
+        """PgBouncer mode can skip the local pool and prepared statements"""
+        config = {
+            "SQLALCHEMY_DATABASE_URI": "postgresql+psycopg://db/app",
+            "DB_PGBOUNCER": True,
+            "DB_NULL_POOL": True,
+        }
+        options = database.engine_options(config)
+        self.assertIs(options["poolclass"], NullPool)
+        self.assertEqual(options["connect_args"], {"prepare_threshold": None})
+        self.assertEqual(database.engine_options({"SQLALCHEMY_DATABASE_URI": "sqlite://"}), {})
+
+    def test_pool_stats(self):
+        """Checkouts, waits and timeouts are counted"""
+        engine = create_engine(
+            "sqlite://",
+            poolclass=database.InstrumentedQueuePool,
+            pool_size=1,
+            max_overflow=0,
+            pool_timeout=0.05,
+        )
+        with engine.connect():
+            self.assertEqual(database.pool_stats(engine)["saturation"], 1.0)
+            with self.assertRaises(exc.TimeoutError):
+                engine.connect()
+        stats = database.pool_stats(engine)
+        self.assertEqual((stats["checkouts"], stats["timeouts"]), (2, 1))
+        self.assertGreaterEqual(stats["wait_max"], 0.05)
+
+
+class TestInstrumentation(TestAdminBase):
+    """Check the per-request SQL instrumentation"""
+
+    def test_server_timing(self):
+        """Responses report their query count and database time"""
+        self.login(self.admin)
+        response = self.client.get(url_for("admin.list_departments"))
+        self.assertRegex(response.headers["Server-Timing"], r'^db;dur=[0-9.]+;desc="\d+ queries"$')
+
+    def test_nplusone_warning(self):
+        """Statements repeated within a request are logged"""
+        with (
+            self.assertLogs(self.app.logger, "WARNING") as logs,
+            self.app.test_request_context(),
+        ):
+            self.app.preprocess_request()
+            for employee in self.employees[:6]:
+                db.session.execute(Employee.__table__.select().where(Employee.id == employee.id))
+            self.app.process_response(self.app.response_class())
+        self.assertIn("Possible N+1 query", logs.output[0])
+
+    def test_assert_max_queries(self):
+        """The helper fails when a block runs too many statements"""
+        self.login(self.admin)
+        with assert_max_queries(2):
+            self.client.get(url_for("admin.list_employees"))
+        with self.assertRaises(AssertionError), assert_max_queries(1):
+            Employee.query.all()
+            Department.query.all()
+
+    def test_failing_statement(self):
+        """A failing statement is not timed and does not upset the next timings"""
+        with count_queries() as collector:
+            with self.assertRaises(exc.IntegrityError):
+                db.session.execute(Employee.__table__.insert().values(username="user00"))
+            db.session.rollback()
+            Employee.query.first()
+        self.assertEqual(collector.count, 1)
+        self.assertLess(collector.duration, 1)
+
+    def test_statement_shape(self):
+        """IN lists of any length share a shape"""
+        self.assertEqual(
+            statement_shape("SELECT * FROM t WHERE id IN (?, ?,\n ?)"),
+            statement_shape("SELECT * FROM t WHERE id IN (?)"),
+        )
+
+
+@unittest.skipIf(metrics.prometheus_client is None, "prometheus_client is not installed")
+class TestMetrics(TestAdminBase):
+    """Check the Prometheus metrics endpoint"""
+
+    def test_requires_admin_or_token(self):
+        """Anonymous scrapes are refused, the token is accepted"""
+        self.assertEqual(self.client.get("/metrics").status_code, 403)
+        self.app.config["METRICS_TOKEN"] = "secret"
+        self.assertEqual(self.client.get("/metrics").status_code, 401)
+        response = self.client.get("/metrics", headers={"Authorization": "Bearer secret"})
+        self.assertEqual(response.status_code, 200)
+
+    def test_latency_by_endpoint(self):
+        """Requests are recorded under their endpoint name"""
+        self.login(self.admin)
+        self.client.get(url_for("admin.list_employees"))
+        self.client.get("/nothinghere")
+        text = self.client.get("/metrics").get_data(as_text=True)
+        self.assertIn(
+            'http_request_duration_seconds_count{endpoint="admin.list_employees",method="GET"}',
+            text,
+        )
+        self.assertIn('endpoint="unmatched",method="GET",status="404"', text)
+        self.assertIn("http_requests_in_flight", text)
+
+
+class TestLogging(TestBase):
+    """Check the queued JSON logging pipeline"""
+
+    def pipeline(self, directory, **kwargs):
+        handler = logging.FileHandler(os.path.join(directory, "test.log"))
+        handler.setFormatter(log.JSONFormatter())
+        kwargs.setdefault("queue_size", 100)
+        kwargs.setdefault("sample_rate", 1.0)
+        pipeline = log.LogPipeline([handler], **kwargs)
+        logger = logging.getLogger("test_app.logging")
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        logger.handlers = [pipeline.handler]
+        return pipeline, logger
+
+    def test_json_lines_with_request_id(self):
+        """Records are written as JSON with their extra fields and request id"""
+        with tempfile.TemporaryDirectory() as directory:
+            pipeline, logger = self.pipeline(directory)
+            pipeline.start()
+            with self.app.test_request_context(headers={"X-Request-ID": "abc"}):
+                g.request_id = "abc"
+                logger.info("took %d ms", 12, extra={"duration_ms": 12})
+            pipeline.stop()
+            with open(os.path.join(directory, "test.log")) as lines:
+                entry = json.loads(lines.readline())
+        self.assertEqual(entry["message"], "took 12 ms")
+        self.assertEqual(entry["request_id"], "abc")
+        self.assertEqual(entry["duration_ms"], 12)
+        self.assertEqual(entry["level"], "INFO")
+
+    def test_full_queue_drops(self):
+        """Logging never blocks, records beyond the queue size are dropped"""
+        with tempfile.TemporaryDirectory() as directory:
+            pipeline, logger = self.pipeline(directory, queue_size=2)
+            for index in range(5):
+                logger.info("record %d", index)
+            self.assertEqual(pipeline.handler.dropped, 3)
+            pipeline.stop()
+
+    def test_sampling_keeps_warnings(self):
+        """Sampling only thins out the records below WARNING"""
+        sampler = log.SamplingFilter(0)
+        self.assertFalse(sampler.filter(logging.makeLogRecord({"levelno": logging.INFO})))
+        self.assertTrue(sampler.filter(logging.makeLogRecord({"levelno": logging.WARNING})))
+
+    def test_request_id_header(self):
+        """The request id is taken from the request or generated"""
+        response = self.client.get("/", headers={"X-Request-ID": "req-1"})
+        self.assertEqual(response.headers["X-Request-ID"], "req-1")
+        self.assertEqual(len(self.client.get("/").headers["X-Request-ID"]), 32)
+
+
 class TestErrorPages(TestBase):
     def test_403_forbidden(self):
         # create route to abort the request with the 403 Error